@@ -0,0 +1,4 @@
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS last_attempt_at TIMESTAMPTZ;
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS last_fetch_ok BOOLEAN DEFAULT TRUE;
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS last_error TEXT;
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS failure_count INT DEFAULT 0;
@@ -0,0 +1,4 @@
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS etag TEXT;
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS last_modified TEXT;
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS content_hash TEXT;
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS content_length INT;
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_code_attempts_created_id ON code_attempts(created_at, id);
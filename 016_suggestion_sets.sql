@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS suggestion_sets (
+  id SERIAL PRIMARY KEY,
+  domain TEXT NOT NULL UNIQUE,
+  ranked_json TEXT DEFAULT '[]',
+  sources_json TEXT DEFAULT '{}',
+  computed_at TIMESTAMPTZ DEFAULT NOW(),
+  stale BOOLEAN DEFAULT FALSE
+);
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS idx_retailer_inventory_retailer_expires ON retailer_inventory(retailer_id, expires_at);
@@ -0,0 +1,21 @@
+ALTER TABLE retailer_profiles ADD COLUMN IF NOT EXISTS version BIGINT DEFAULT 0;
+ALTER TABLE retailer_inventory ADD COLUMN IF NOT EXISTS version BIGINT DEFAULT 0;
+CREATE INDEX IF NOT EXISTS idx_retailer_profiles_version ON retailer_profiles(version);
+CREATE INDEX IF NOT EXISTS idx_retailer_inventory_version ON retailer_inventory(version);
+
+CREATE TABLE IF NOT EXISTS catalog_state (
+  id INTEGER PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0,
+  pruned_through BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO catalog_state (id, version, pruned_through) VALUES (1, 0, 0) ON CONFLICT (id) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS catalog_tombstones (
+  id BIGSERIAL PRIMARY KEY,
+  domain TEXT NOT NULL,
+  code TEXT NOT NULL,
+  version BIGINT NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_catalog_tombstones_version ON catalog_tombstones(version);
+CREATE INDEX IF NOT EXISTS idx_catalog_tombstones_created ON catalog_tombstones(created_at);
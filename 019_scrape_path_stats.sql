@@ -0,0 +1,4 @@
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS fetch_count INT DEFAULT 0;
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS yield_count INT DEFAULT 0;
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS codes_yielded INT DEFAULT 0;
+ALTER TABLE scrape_cache ADD COLUMN IF NOT EXISTS fetch_ms_total DOUBLE PRECISION DEFAULT 0;
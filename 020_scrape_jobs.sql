@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS scrape_jobs (
+  id SERIAL PRIMARY KEY,
+  domain TEXT NOT NULL UNIQUE,
+  priority INT DEFAULT 0,
+  interval_seconds INT DEFAULT 3600,
+  run_after TIMESTAMPTZ DEFAULT NOW(),
+  lease_owner TEXT,
+  lease_expires_at TIMESTAMPTZ,
+  attempts INT DEFAULT 0,
+  last_run_at TIMESTAMPTZ,
+  last_ok_at TIMESTAMPTZ,
+  last_error TEXT,
+  codes_found INT DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_scrape_jobs_due ON scrape_jobs(run_after, priority);
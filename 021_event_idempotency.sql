@@ -0,0 +1,2 @@
+ALTER TABLE code_attempts ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(64);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_attempt_idempotency_key ON code_attempts(idempotency_key);
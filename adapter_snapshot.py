@@ -0,0 +1,293 @@
+"""Versioned, memory-mapped adapter snapshot shared by every process on a host.
+
+``build_adapter_snapshot`` walks the whole retailer catalog (a count per retailer), and
+every uvicorn worker, ``scrape_cli.py`` run and scrape worker used to build and hold its
+own copy. Now one process compiles it into
+``ADAPTER_SNAPSHOT_DIR/adapters-<catalog version>-<built at>-<digest>.snap``, a small header plus
+pre-encoded JSON sections, and points ``CURRENT`` at it with an atomic rename. Every
+other process maps the file read-only, so its pages sit once in the page cache however
+many workers read them, and ``/adapters`` is served from the encoded bytes without a
+query or a JSON encode.
+
+Readers look at ``CURRENT`` at most every ``ADAPTER_SNAPSHOT_CHECK_SECONDS`` and swap to
+a new file in one assignment; requests still holding the old mapping finish on it (an
+unlinked file stays readable while mapped). ``start_snapshot_refresher`` republishes
+when the catalog version or ``adapters.json`` changes, or the snapshot is older than
+``ADAPTER_SNAPSHOT_MAX_AGE_SECONDS`` (inventory counts drift as codes expire). A file
+lock makes sure only one process per host rebuilds. Set ``ADAPTER_SNAPSHOT_DIR=off``
+to build per process as before.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from catalog import build_adapter_snapshot, current_catalog_version
+from db import DATABASE_URL
+from metrics import counter, register_collector
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: no cross-process lock, rebuilds may overlap
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# Per database by default, so two deployments sharing a host never share a snapshot.
+_DEFAULT_DIR = os.path.join(
+    tempfile.gettempdir(), "disco-adapters-" + hashlib.sha1(DATABASE_URL.encode("utf-8")).hexdigest()[:10]
+)
+SNAPSHOT_DIR = os.getenv("ADAPTER_SNAPSHOT_DIR", _DEFAULT_DIR).strip()
+ENABLED = SNAPSHOT_DIR.lower() not in ("", "0", "off", "false", "none")
+CHECK_SECONDS = float(os.getenv("ADAPTER_SNAPSHOT_CHECK_SECONDS", "1"))
+REFRESH_SECONDS = float(os.getenv("ADAPTER_SNAPSHOT_REFRESH_SECONDS", "5"))
+MAX_AGE_SECONDS = float(os.getenv("ADAPTER_SNAPSHOT_MAX_AGE_SECONDS", "300"))
+KEEP_FILES = int(os.getenv("ADAPTER_SNAPSHOT_KEEP", "3"))
+
+MAGIC = b"DISCOSNP"
+FORMAT = 1
+# magic, format, section count, catalog version, built at (epoch seconds), sha1 of the base adapters
+HEADER = struct.Struct("<8sHHqd20s")
+# section name, offset, length
+SECTION = struct.Struct("<16sQQ")
+POINTER = "CURRENT"
+
+SNAPSHOT_PUBLISHES = counter(
+    "disco_adapter_snapshot_publishes_total",
+    "Adapter snapshots compiled and published by this process.",
+)
+
+_current: Optional["AdapterSnapshot"] = None
+_checked_at = 0.0
+_lock = threading.Lock()
+_refresher: Optional[threading.Thread] = None
+_refresher_lock = threading.Lock()
+
+
+def _encode(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def source_digest(base_adapters: Optional[Dict[str, Any]]) -> bytes:
+    return hashlib.sha1(json.dumps(base_adapters or {}, sort_keys=True).encode("utf-8")).digest()
+
+
+class AdapterSnapshot:
+    """One published snapshot file, mapped read-only."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.name = path.name
+        with open(path, "rb") as fh:
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, count, self.version, self.built_at, self.source = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            raise ValueError(f"not an adapter snapshot: {path}")
+        self._sections: Dict[str, tuple] = {}
+        for index in range(count):
+            name, offset, length = SECTION.unpack_from(self._map, HEADER.size + index * SECTION.size)
+            if offset + length > len(self._map):
+                raise ValueError(f"truncated adapter snapshot: {path}")
+            self._sections[name.rstrip(b"\0").decode("ascii")] = (offset, length)
+        self._adapters: Optional[Dict[str, Any]] = None
+
+    def section(self, name: str) -> memoryview:
+        """A zero-copy view of one section; it keeps the mapping alive while a response holds it."""
+        offset, length = self._sections[name]
+        return memoryview(self._map)[offset:offset + length]
+
+    def adapters(self) -> Dict[str, Any]:
+        """The snapshot as a dict (decoded on first use, then kept for this version)."""
+        if self._adapters is None:
+            self._adapters = json.loads(bytes(self.section("adapters")))
+        return self._adapters
+
+    def age(self) -> float:
+        return max(0.0, time.time() - self.built_at)
+
+
+def _write_snapshot(directory: Path, version: int, source: bytes, sections: Dict[str, bytes]) -> Path:
+    built_at = time.time()
+    offset = HEADER.size + SECTION.size * len(sections)
+    parts = [HEADER.pack(MAGIC, FORMAT, len(sections), version, built_at, source)]
+    for name, data in sections.items():
+        parts.append(SECTION.pack(name.encode("ascii"), offset, len(data)))
+        offset += len(data)
+    parts.extend(sections.values())
+    blob = b"".join(parts)
+    # Never reuse a name: readers only remap when the name in CURRENT changes.
+    target = directory / f"adapters-{version}-{int(built_at * 1000)}-{hashlib.sha1(blob).hexdigest()[:8]}.snap"
+    _replace_atomically(target, blob)
+    return target
+
+
+def _replace_atomically(target: Path, data: bytes) -> None:
+    fd, tmp = tempfile.mkstemp(dir=str(target.parent), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, target)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _prune(directory: Path, keep: str) -> None:
+    files = sorted(directory.glob("adapters-*.snap"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in files[max(1, KEEP_FILES):]:
+        if path.name != keep:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+def publish_snapshot(db: Session, base_adapters: Dict[str, Any], directory: str = SNAPSHOT_DIR) -> "AdapterSnapshot":
+    """Compile the adapter snapshot from ``db`` and make it the current one for this host."""
+    folder = Path(directory)
+    folder.mkdir(parents=True, exist_ok=True)
+    snapshot = build_adapter_snapshot(db, base_adapters)
+    path = _write_snapshot(
+        folder,
+        snapshot["version"],
+        source_digest(base_adapters),
+        {"adapters": _encode(snapshot)},
+    )
+    _replace_atomically(folder / POINTER, path.name.encode("ascii"))
+    _prune(folder, path.name)
+    SNAPSHOT_PUBLISHES.inc()
+    return current_snapshot(force=True)
+
+
+def current_snapshot(force: bool = False) -> Optional[AdapterSnapshot]:
+    """The newest published snapshot, remapped when ``CURRENT`` has moved; None if none exists."""
+    global _current, _checked_at
+    if not ENABLED:
+        return None
+    now = time.monotonic()
+    snapshot = _current
+    if not force and snapshot is not None and now - _checked_at < CHECK_SECONDS:
+        return snapshot
+    with _lock:
+        _checked_at = now
+        try:
+            name = (Path(SNAPSHOT_DIR) / POINTER).read_text().strip()
+            if name and (_current is None or _current.name != name):
+                _current = AdapterSnapshot(Path(SNAPSHOT_DIR) / name)
+        except (OSError, ValueError, struct.error):
+            # Missing or pruned between the pointer read and the open; the next check retries.
+            pass
+        return _current
+
+
+def _is_fresh(snapshot: Optional[AdapterSnapshot], version: int, source: bytes) -> bool:
+    return (
+        snapshot is not None
+        and snapshot.version == version
+        and snapshot.source == source
+        and snapshot.age() < MAX_AGE_SECONDS
+    )
+
+
+def ensure_snapshot(db: Session, base_adapters: Dict[str, Any]) -> Optional[AdapterSnapshot]:
+    """The current snapshot, rebuilt first if it is behind the catalog, ``adapters.json`` or max age."""
+    if not ENABLED:
+        return None
+    version = current_catalog_version(db)
+    source = source_digest(base_adapters)
+    snapshot = current_snapshot(force=True)
+    if _is_fresh(snapshot, version, source):
+        return snapshot
+    folder = Path(SNAPSHOT_DIR)
+    folder.mkdir(parents=True, exist_ok=True)
+    with open(folder / ".lock", "a+") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        # Whoever held the lock before us may have just published the same version.
+        snapshot = current_snapshot(force=True)
+        if _is_fresh(snapshot, version, source):
+            return snapshot
+        return publish_snapshot(db, base_adapters, SNAPSHOT_DIR)
+
+
+def load_adapters(db: Session, base_adapters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The compiled adapter snapshot as a dict: the shared one when enabled, else built here.
+
+    Without ``base_adapters`` (no adapters.json) this process builds its own, so it never
+    replaces the host's snapshot with one missing the platform config.
+    """
+    if base_adapters is None:
+        return build_adapter_snapshot(db, {"platforms": {}, "retailers": []})
+    try:
+        snapshot = ensure_snapshot(db, base_adapters)
+    except OSError:
+        snapshot = None
+    return snapshot.adapters() if snapshot is not None else build_adapter_snapshot(db, base_adapters)
+
+
+def start_snapshot_refresher(session_factory, base_adapters: Dict[str, Any], interval: float = REFRESH_SECONDS) -> bool:
+    """Make sure a fresh snapshot exists now, then re-check every ``interval`` seconds (0: once)."""
+    global _refresher
+    if not ENABLED:
+        return False
+
+    def refresh() -> None:
+        db = session_factory()
+        try:
+            ensure_snapshot(db, base_adapters)
+        except Exception:
+            db.rollback()
+        finally:
+            db.close()
+
+    refresh()
+    if interval <= 0:
+        return False
+    with _refresher_lock:
+        if _refresher is not None:
+            return False
+
+        def loop() -> None:
+            stop = threading.Event()
+            while not stop.wait(interval):
+                refresh()
+
+        _refresher = threading.Thread(target=loop, name="adapter-snapshot-refresher", daemon=True)
+        _refresher.start()
+    return True
+
+
+def _collect_snapshot_metrics():
+    snapshot = _current
+    yield (
+        "disco_adapter_snapshot_version",
+        "gauge",
+        "Catalog version of the adapter snapshot this process has mapped (-1: none).",
+        [("disco_adapter_snapshot_version", {}, snapshot.version if snapshot is not None else -1)],
+    )
+    yield (
+        "disco_adapter_snapshot_age_seconds",
+        "gauge",
+        "Seconds since the mapped adapter snapshot was compiled.",
+        [("disco_adapter_snapshot_age_seconds", {}, round(snapshot.age(), 3) if snapshot is not None else 0.0)],
+    )
+
+
+register_collector(_collect_snapshot_metrics)
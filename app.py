@@ -1,27 +1,50 @@
 import os, json, hashlib
 from datetime import datetime, timedelta
-from typing import Optional
-from fastapi import FastAPI, Depends, Header, HTTPException
+from typing import Optional, Tuple
+from fastapi import FastAPI, Depends, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 
-from db import Base, engine, get_db
+from db import Base, ReadSessionLocal, SessionLocal, engine, get_db, get_read_db, get_write_db
 from models import CodeSeed, CodeAttempt, ScrapeCache
 from schemas import (HealthResponse, SuggestRequest, SuggestResponse, RankRequest, RankResponse, RankedCode,
-                    SeedRequest, EventRequest, ScrapeRequest, ScrapeResponse, AdaptersResponse)
-from ranking import rank_codes
-from scraper import scrape_pipeline
+                    SeedRequest, EventRequest, ScrapeRequest, ScrapeResponse, AdaptersResponse,
+                    CatalogChangesResponse, CatalogCoverageResponse, CatalogRetailerResponse)
+from ranking import bump_domain_version, rank_codes_cached, read_primary, start_version_poller
+from scraper import host_stats, path_stats, scrape_pipeline, revalidation_stats
+from parsing import HTML_MAX_BYTES, ParserBusy, PayloadTooLarge, html_bytes, parse_pool_stats
+from suggestions import suggest_codes, SUGGEST_STAGE_SECONDS
+from suggestion_sets import precomputed_suggestions, schedule_suggestion_refresh
+from scrape_jobs import queue_stats
+from shards import attempt_write_session, attempt_write_sessions, create_attempt_tables
+from stats_store import record_event, start_store_warmup
+from telemetry import (anonymous_event_fingerprint, event_idempotency_key, previous_event_key, prior_event_id,
+                       recent_event_id, remember_event, stored_event_id)
+from metrics import MetricsMiddleware, render as render_metrics
+import profiling
+from profiling import ProfilingMiddleware, profiled
+from adapter_snapshot import current_snapshot, start_snapshot_refresher
 from auth import require_api_key
+from domains import canonical_domain, start_alias_refresher
 from catalog import (
+    INVENTORY_COLUMNS,
     build_adapter_snapshot,
-    get_retailer_inventory,
+    catalog_changes,
+    decode_inventory_cursor,
     get_retailer_overrides,
-    get_retailer_bundle,
+    get_retailer_page,
     list_supported_domains,
+    start_inventory_sweeper,
 )
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
 load_dotenv()
 
 app = FastAPI(title="Disco Backend (Scraping+Adapters)", version="3.0.0")
@@ -34,20 +57,28 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+if profiling.ENABLED:
+    app.add_middleware(ProfilingMiddleware)
 
 Base.metadata.create_all(bind=engine)
+create_attempt_tables()
+# app_async imports this module, so both stacks share the one sweeper thread.
+start_inventory_sweeper(SessionLocal)
 
 with open(os.path.join(os.path.dirname(__file__), "adapters.json"), "r") as f:
     ADAPTERS = json.load(f)
 
+start_alias_refresher(SessionLocal, ADAPTERS)
+start_snapshot_refresher(SessionLocal, ADAPTERS)
+start_store_warmup(ReadSessionLocal)
+start_version_poller(ReadSessionLocal)
+
 RETENTION_DAYS = int(os.getenv("CODE_EVENT_RETENTION_DAYS", "180") or 0)
+CATALOG_PAGE_MAX = int(os.getenv("CATALOG_PAGE_MAX", "1000"))
 _last_prune = 0.0
 
 
-def _normalize_domain(domain: str) -> str:
-    return (domain or "").strip().lower().replace("http://", "").replace("https://", "").replace("www.", "")
-
-
 def _round_currency(value):
     if value is None:
         return None
@@ -63,6 +94,11 @@ def _hash_anon(value: Optional[str]) -> Optional[str]:
     return hashlib.sha256(value.strip().encode("utf-8")).hexdigest()
 
 
+def _check_html_payload(html: Optional[str]):
+    if html and html_bytes(html) > HTML_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"html payload exceeds {HTML_MAX_BYTES} bytes")
+
+
 def prune_old_attempts(db: Session):
     global _last_prune
     if RETENTION_DAYS <= 0:
@@ -71,8 +107,10 @@ def prune_old_attempts(db: Session):
     if now_ts - _last_prune < 3600:
         return
     cutoff = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
-    db.query(CodeAttempt).filter(CodeAttempt.created_at < cutoff).delete()
-    db.commit()
+    with attempt_write_sessions(db) as sessions:
+        for shard_db in sessions:
+            shard_db.query(CodeAttempt).filter(CodeAttempt.created_at < cutoff).delete()
+            shard_db.commit()
     _last_prune = now_ts
 
 
@@ -82,12 +120,16 @@ def health():
 
 
 @app.get("/adapters", response_model=AdaptersResponse)
-def get_adapters(db: Session = Depends(get_db)):
-    return build_adapter_snapshot(db, ADAPTERS)
+def get_adapters(db: Session = Depends(get_read_db)):
+    snapshot = current_snapshot()
+    if snapshot is None:
+        return build_adapter_snapshot(db, ADAPTERS)
+    # Already-encoded JSON from the shared mapping; every worker serves the same version.
+    return Response(content=snapshot.section("adapters"), media_type="application/json")
 
 
 @app.get("/catalog/coverage", response_model=CatalogCoverageResponse)
-def catalog_coverage(db: Session = Depends(get_db)):
+def catalog_coverage(db: Session = Depends(get_read_db)):
     entries = list_supported_domains(db)
     retailers = []
     for entry in entries:
@@ -107,97 +149,188 @@ def catalog_coverage(db: Session = Depends(get_db)):
     )
 
 
+class FastJSONResponse(Response):
+    """JSON body for payloads built from trusted dicts: no response_model revalidation."""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _catalog_query(
+    fields: Optional[str], cursor: Optional[str]
+) -> Tuple[Optional[set], Tuple[str, ...], Optional[Tuple[Optional[datetime], int]]]:
+    """Parse ``fields=`` into (top-level keys or None for all, inventory columns) and ``cursor``."""
+    after = None
+    if cursor:
+        try:
+            after = decode_inventory_cursor(cursor)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+    if not fields:
+        return None, INVENTORY_COLUMNS, after
+    top, columns = set(), set()
+    for name in (part.strip() for part in fields.split(",")):
+        if not name:
+            continue
+        key, _, column = name.partition(".")
+        if key not in CatalogRetailerResponse.model_fields or (column and (key != "inventory" or column not in INVENTORY_COLUMNS)):
+            raise HTTPException(status_code=400, detail=f"unknown field: {name}")
+        top.add(key)
+        if column:
+            columns.add(column)
+    if "inventory" in top and not columns:
+        columns = set(INVENTORY_COLUMNS)
+    return top, tuple(c for c in INVENTORY_COLUMNS if c in columns), after
+
+
+@app.get("/catalog/changes", response_model=CatalogChangesResponse)
+def catalog_changes_since(since: int = Query(0, ge=0), db: Session = Depends(get_read_db)):
+    return FastJSONResponse(catalog_changes(db, since))
+
+
 @app.get("/catalog/{domain}", response_model=CatalogRetailerResponse)
-def catalog_detail(domain: str, db: Session = Depends(get_db)):
-    bundle = get_retailer_bundle(db, domain)
+def catalog_detail(
+    domain: str,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=CATALOG_PAGE_MAX),
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+):
+    top, columns, after = _catalog_query(fields, cursor)
+    bundle = get_retailer_page(db, domain, columns, after, limit)
     if not bundle:
         raise HTTPException(status_code=404, detail="catalog entry not found")
-    inventory = []
+    return _catalog_response(bundle, top)
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _catalog_response(bundle: dict, fields: Optional[set] = None) -> FastJSONResponse:
     for entry in bundle.get("inventory", []):
-        inventory.append({
-            "code": entry.get("code"),
-            "source": entry.get("source"),
-            "tags": entry.get("tags", []),
-            "attributes": entry.get("attributes", {}),
-            "first_seen": entry.get("first_seen").isoformat() if entry.get("first_seen") else None,
-            "last_seen": entry.get("last_seen").isoformat() if entry.get("last_seen") else None,
-            "expires_at": entry.get("expires_at").isoformat() if entry.get("expires_at") else None,
-        })
-    return CatalogRetailerResponse(
-        domain=bundle.get("domain"),
-        retailer=bundle.get("retailer"),
-        platform=bundle.get("platform", "generic"),
-        checkout_hints=bundle.get("checkout_hints", []),
-        selectors=bundle.get("selectors", {}),
-        heuristics=bundle.get("heuristics", {}),
-        scrape=bundle.get("scrape", {}),
-        regions=bundle.get("regions", []),
-        aliases=bundle.get("aliases", []),
-        inventory=inventory,
-        inventory_count=bundle.get("inventory_count", 0),
-        last_synced=bundle.get("last_synced").isoformat() if bundle.get("last_synced") else None,
-    )
+        for key in ("first_seen", "last_seen", "expires_at"):
+            if key in entry:
+                entry[key] = _iso(entry[key])
+    payload = {
+        "domain": bundle.get("domain"),
+        "retailer": bundle.get("retailer"),
+        "platform": bundle.get("platform", "generic"),
+        "checkout_hints": bundle.get("checkout_hints", []),
+        "selectors": bundle.get("selectors", {}),
+        "heuristics": bundle.get("heuristics", {}),
+        "scrape": bundle.get("scrape", {}),
+        "regions": bundle.get("regions", []),
+        "aliases": bundle.get("aliases", []),
+        "inventory": bundle.get("inventory", []),
+        "inventory_count": bundle.get("inventory_count", 0),
+        "last_synced": _iso(bundle.get("last_synced")),
+        "next_cursor": bundle.get("next_cursor"),
+    }
+    if fields is not None:
+        # The cursor always survives projection so pagination keeps working.
+        payload = {key: value for key, value in payload.items() if key in fields or key == "next_cursor"}
+    return FastJSONResponse(payload)
 
 
 
 @app.post("/scrape", response_model=ScrapeResponse)
+@profiled("/scrape")
 def scrape(req: ScrapeRequest, db: Session = Depends(get_db)):
+    _check_html_payload(req.html)
     overrides = get_retailer_overrides(db, req.domain)
-    codes = scrape_pipeline(db, ADAPTERS, domain=req.domain, url=req.url, html=req.html, limit=req.limit, overrides=overrides)
+    try:
+        codes = scrape_pipeline(db, ADAPTERS, domain=req.domain, url=req.url, html=req.html, limit=req.limit, overrides=overrides)
+    except PayloadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except ParserBusy:
+        raise HTTPException(status_code=503, detail="html parser busy, retry shortly", headers={"Retry-After": "1"})
     return ScrapeResponse(codes=codes)
 
 
+@app.get("/scrape/stats", dependencies=[Depends(require_api_key)])
+def scrape_stats(domain: Optional[str] = None, db: Session = Depends(get_db)):
+    return {
+        "revalidation": revalidation_stats(),
+        "parser": parse_pool_stats(),
+        "paths": path_stats(db, domain),
+        "jobs": queue_stats(db),
+        "hosts": host_stats(),
+    }
+
+
+@app.get("/metrics", dependencies=[Depends(require_api_key)])
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/profiles", dependencies=[Depends(require_api_key)])
+def debug_profiles():
+    return profiling.list_profiles()
+
+
+@app.get("/debug/profiles/{profile_id}", dependencies=[Depends(require_api_key)])
+def debug_profile(profile_id: str, format: str = "text"):
+    record = profiling.get_profile(profile_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="profile not found")
+    if format == "pstats":
+        return Response(
+            record["pstats"],
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{record["endpoint"].strip("/")}-{profile_id}.prof"'},
+        )
+    return PlainTextResponse(record["text"])
+
+
 @app.post("/suggest", response_model=SuggestResponse)
+@profiled("/suggest")
 def suggest(req: SuggestRequest, db: Session = Depends(get_db)):
-    domain = _normalize_domain(req.domain)
-
-    attempts = db.query(CodeAttempt)\
-        .filter(CodeAttempt.domain == domain, CodeAttempt.success == True)\
-        .order_by(CodeAttempt.created_at.desc())\
-        .limit(req.limit).all()
-    recent_success = [a.code for a in attempts]
-
-    seed_rows = db.query(CodeSeed).filter(CodeSeed.domain == domain)\
-        .order_by(CodeSeed.created_at.desc()).limit(req.limit).all()
-    seeds = [r.code for r in seed_rows]
-
-    overrides = get_retailer_overrides(db, domain)
-    scraped = scrape_pipeline(db, ADAPTERS, domain=domain, url=req.url, html=req.html, limit=req.limit, overrides=overrides)
-    catalog_inventory = [item.get("code") for item in get_retailer_inventory(db, domain, req.limit)]
-
-    merged = []
-    seen = set()
-    for lst in (catalog_inventory, recent_success, scraped, seeds):
-        for c in lst:
-            cu = c.strip().upper()
-            if cu and cu not in seen:
-                merged.append(cu)
-                seen.add(cu)
-            if len(merged) >= req.limit:
-                break
-        if len(merged) >= req.limit:
-            break
-    return SuggestResponse(codes=merged[:req.limit])
+    domain = canonical_domain(req.domain)
+    _check_html_payload(req.html)
+    result = None if (req.url or req.html) else precomputed_suggestions(db, ADAPTERS, domain, req.limit)
+    try:
+        if result is None:
+            result = suggest_codes(db, ADAPTERS, domain, url=req.url, html=req.html, limit=req.limit, host=req.domain)
+    except ParserBusy:
+        raise HTTPException(status_code=503, detail="html parser busy, retry shortly", headers={"Retry-After": "1"})
+    ranked = result["ranked"]
+    with SUGGEST_STAGE_SECONDS.time(stage="serialize"):
+        return SuggestResponse(
+            codes=[c for (c, _, _) in ranked],
+            ranked=[RankedCode(code=c, score=float(round(s,4)), reasons=r) for (c,s,r) in ranked],
+            metadata=result["metadata"],
+        )
 
 
 @app.post("/rank", response_model=RankResponse)
-def rank(req: RankRequest, db: Session = Depends(get_db)):
-    domain = (req.domain or "").lower().replace("www.", "")
+@profiled("/rank")
+def rank(req: RankRequest, db: Session = Depends(get_read_db)):
+    domain = canonical_domain(req.domain)
     codes = None
     if isinstance(req.context, dict):
         codes = req.context.get("codes")
     if not codes:
         return RankResponse(codes=[], metadata={"reason": "no codes provided"})
-    ranked = rank_codes(db, domain, list(dict.fromkeys([str(c).strip().upper() for c in codes])))
+    if read_primary(domain):
+        # The replica may not have this process's last write to the domain yet.
+        with SessionLocal() as primary:
+            ranked, cached = rank_codes_cached(primary, domain, [str(c) for c in codes])
+    else:
+        ranked, cached = rank_codes_cached(db, domain, [str(c) for c in codes])
     return RankResponse(
         codes=[RankedCode(code=c, score=float(round(s,4)), reasons=r) for (c,s,r) in ranked],
-        metadata={"domain": domain, "count": len(ranked)}
+        metadata={"domain": domain, "count": len(ranked), "cached": cached}
     )
 
 
 @app.post("/seed", dependencies=[Depends(require_api_key)])
-def seed_codes(req: SeedRequest, db: Session = Depends(get_db)):
-    domain = req.domain.lower().replace("www.", "")
+def seed_codes(req: SeedRequest, db: Session = Depends(get_write_db)):
+    domain = canonical_domain(req.domain)
     added, skipped = 0, 0
     for code in req.codes:
         cu = code.strip().upper()
@@ -210,15 +343,74 @@ def seed_codes(req: SeedRequest, db: Session = Depends(get_db)):
         db.add(CodeSeed(domain=domain, code=cu, source=req.source))
         added += 1
     db.commit()
+    if added:
+        bump_domain_version(domain)
+        schedule_suggestion_refresh(domain, ADAPTERS)
     return {"ok": True, "added": added, "skipped": skipped}
 
 
 @app.post("/event")
-def log_event(req: EventRequest, db: Session = Depends(get_db), user_agent: str = Header(None)):
+def log_event(
+    req: EventRequest,
+    db: Session = Depends(get_write_db),
+    user_agent: str = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+):
     if req.opt_out:
         return JSONResponse({"ok": False, "stored": False, "reason": "opt_out"}, status_code=202)
 
-    domain = _normalize_domain(req.domain)
+    attempt = _build_attempt(req, user_agent, idempotency_key)
+    key = attempt.idempotency_key
+    duplicate_id = recent_event_id(key)
+    if duplicate_id is not None:
+        return _duplicate_event(duplicate_id)
+    previous = _previous_key(req, attempt, idempotency_key)
+    with attempt_write_session(attempt.domain, db) as shard_db:
+        # A retry just past a bucket edge was stored under the previous bucket's key.
+        duplicate_id = prior_event_id(shard_db, previous)
+        if duplicate_id is not None:
+            return _duplicate_event(duplicate_id)
+        shard_db.add(attempt)
+        try:
+            shard_db.commit()
+        except IntegrityError:
+            shard_db.rollback()
+            if key is None:
+                raise
+            # Another process (or a key this one has forgotten) stored it first.
+            return _duplicate_event(stored_event_id(shard_db, key))
+        event_id = attempt.id
+    remember_event(key, event_id)
+    record_event(attempt.domain, attempt.code, attempt.success, attempt.saved, event_id)
+    bump_domain_version(attempt.domain, event_id)
+    schedule_suggestion_refresh(attempt.domain, ADAPTERS)
+    prune_old_attempts(db)
+    return {"ok": True, "id": event_id}
+
+
+def _duplicate_event(event_id: Optional[int]) -> dict:
+    return {"ok": True, "id": event_id, "duplicate": True}
+
+
+def _previous_key(req: EventRequest, attempt: CodeAttempt, idempotency_key: Optional[str] = None) -> Optional[str]:
+    return previous_event_key(
+        idempotency_key or req.idempotency_key,
+        attempt.anon_id,
+        attempt.domain,
+        attempt.code,
+        attempt.success,
+        fingerprint=_event_fingerprint(attempt),
+    )
+
+
+def _event_fingerprint(attempt: CodeAttempt) -> Optional[str]:
+    if attempt.anon_id:
+        return None
+    return anonymous_event_fingerprint(attempt.user_agent, attempt.before_total, attempt.after_total, attempt.saved)
+
+
+def _build_attempt(req: EventRequest, user_agent: Optional[str], idempotency_key: Optional[str] = None) -> CodeAttempt:
+    domain = canonical_domain(req.domain)
     if not domain:
         raise HTTPException(status_code=400, detail="domain required")
 
@@ -232,6 +424,7 @@ def log_event(req: EventRequest, db: Session = Depends(get_db), user_agent: str
     if saved is None and before_total is not None and after_total is not None:
         saved = _round_currency(max(0.0, before_total - after_total))
 
+    anon_id = _hash_anon(req.anon_id)
     attempt = CodeAttempt(
         domain=domain,
         code=code,
@@ -240,9 +433,9 @@ def log_event(req: EventRequest, db: Session = Depends(get_db), user_agent: str
         before_total=before_total,
         after_total=after_total,
         user_agent=(user_agent or "")[:255],
-        anon_id=_hash_anon(req.anon_id),
+        anon_id=anon_id,
     )
-    db.add(attempt)
-    db.commit()
-    prune_old_attempts(db)
-    return {"ok": True, "id": attempt.id}
+    attempt.idempotency_key = event_idempotency_key(
+        idempotency_key or req.idempotency_key, anon_id, domain, code, req.success, fingerprint=_event_fingerprint(attempt)
+    )
+    return attempt
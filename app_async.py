@@ -0,0 +1,185 @@
+"""Async variant of the Disco API: ``uvicorn app_async:app``.
+
+The hot request paths (/suggest, /rank, /scrape, /event, /catalog/{domain}) run as
+coroutines on async SQLAlchemy sessions and an async HTTP client, so requests waiting
+on the database or a retailer no longer hold one of Starlette's threadpool slots.
+Every other route is served by the sync handlers from ``app``.
+"""
+
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import app as sync_app
+from app import (ADAPTERS, CATALOG_PAGE_MAX, RETENTION_DAYS, _build_attempt, _catalog_query, _catalog_response,
+                 _check_html_payload, _duplicate_event, _previous_key)
+from catalog import get_retailer_overrides_async, get_retailer_page_async
+from db import AsyncSessionLocal, get_async_db, get_async_read_db
+from domains import canonical_domain
+from metrics import MetricsMiddleware
+import profiling
+from profiling import ProfilingMiddleware, profiled
+from models import CodeAttempt
+from parsing import ParserBusy, PayloadTooLarge
+from ranking import bump_domain_version, rank_codes_cached_async, read_primary
+from schemas import (CatalogRetailerResponse, EventRequest, RankedCode, RankRequest, RankResponse,
+                     ScrapeRequest, ScrapeResponse, SuggestRequest, SuggestResponse)
+from scraper import scrape_pipeline_async
+from suggestion_sets import precomputed_suggestions_async, schedule_suggestion_refresh
+from shards import async_attempt_write_session, async_attempt_write_sessions
+from stats_store import record_event
+from telemetry import prior_event_id_async, recent_event_id, remember_event, stored_event_id_async
+from suggestions import SUGGEST_STAGE_SECONDS, suggest_codes_async
+
+app = FastAPI(title="Disco Backend (Scraping+Adapters, async)", version=sync_app.app.version)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"] if sync_app.origins == "*" else [o.strip() for o in sync_app.origins.split(",") if o.strip()],
+    allow_credentials=False,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(MetricsMiddleware)
+if profiling.ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+_last_prune = 0.0
+
+
+async def prune_old_attempts(db: AsyncSession):
+    global _last_prune
+    if RETENTION_DAYS <= 0:
+        return
+    now_ts = datetime.utcnow().timestamp()
+    if now_ts - _last_prune < 3600:
+        return
+    _last_prune = now_ts
+    cutoff = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+    async with async_attempt_write_sessions(db) as sessions:
+        for shard_db in sessions:
+            await shard_db.execute(delete(CodeAttempt).where(CodeAttempt.created_at < cutoff))
+            await shard_db.commit()
+
+
+@app.get("/catalog/{domain}", response_model=CatalogRetailerResponse)
+async def catalog_detail(
+    domain: str,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=CATALOG_PAGE_MAX),
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    top, columns, after = _catalog_query(fields, cursor)
+    bundle = await get_retailer_page_async(db, domain, columns, after, limit)
+    if not bundle:
+        raise HTTPException(status_code=404, detail="catalog entry not found")
+    return _catalog_response(bundle, top)
+
+
+@app.post("/scrape", response_model=ScrapeResponse)
+@profiled("/scrape")
+async def scrape(req: ScrapeRequest, db: AsyncSession = Depends(get_async_db)):
+    _check_html_payload(req.html)
+    overrides = await get_retailer_overrides_async(db, req.domain)
+    try:
+        codes = await scrape_pipeline_async(db, ADAPTERS, domain=req.domain, url=req.url, html=req.html, limit=req.limit, overrides=overrides)
+    except PayloadTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except ParserBusy:
+        raise HTTPException(status_code=503, detail="html parser busy, retry shortly", headers={"Retry-After": "1"})
+    return ScrapeResponse(codes=codes)
+
+
+@app.post("/suggest", response_model=SuggestResponse)
+@profiled("/suggest")
+async def suggest(req: SuggestRequest, db: AsyncSession = Depends(get_async_db)):
+    domain = canonical_domain(req.domain)
+    _check_html_payload(req.html)
+    result = None if (req.url or req.html) else await precomputed_suggestions_async(db, ADAPTERS, domain, req.limit)
+    try:
+        if result is None:
+            result = await suggest_codes_async(ADAPTERS, domain, url=req.url, html=req.html, limit=req.limit, host=req.domain)
+    except ParserBusy:
+        raise HTTPException(status_code=503, detail="html parser busy, retry shortly", headers={"Retry-After": "1"})
+    ranked = result["ranked"]
+    with SUGGEST_STAGE_SECONDS.time(stage="serialize"):
+        return SuggestResponse(
+            codes=[c for (c, _, _) in ranked],
+            ranked=[RankedCode(code=c, score=float(round(s,4)), reasons=r) for (c,s,r) in ranked],
+            metadata=result["metadata"],
+        )
+
+
+@app.post("/rank", response_model=RankResponse)
+@profiled("/rank")
+async def rank(req: RankRequest, db: AsyncSession = Depends(get_async_read_db)):
+    domain = canonical_domain(req.domain)
+    codes = None
+    if isinstance(req.context, dict):
+        codes = req.context.get("codes")
+    if not codes:
+        return RankResponse(codes=[], metadata={"reason": "no codes provided"})
+    if read_primary(domain):
+        async with AsyncSessionLocal() as primary:
+            ranked, cached = await rank_codes_cached_async(primary, domain, [str(c) for c in codes])
+    else:
+        ranked, cached = await rank_codes_cached_async(db, domain, [str(c) for c in codes])
+    return RankResponse(
+        codes=[RankedCode(code=c, score=float(round(s,4)), reasons=r) for (c,s,r) in ranked],
+        metadata={"domain": domain, "count": len(ranked), "cached": cached}
+    )
+
+
+@app.post("/event")
+async def log_event(
+    req: EventRequest,
+    db: AsyncSession = Depends(get_async_db),
+    user_agent: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+):
+    if req.opt_out:
+        return JSONResponse({"ok": False, "stored": False, "reason": "opt_out"}, status_code=202)
+
+    attempt = _build_attempt(req, user_agent, idempotency_key)
+    key = attempt.idempotency_key
+    duplicate_id = recent_event_id(key)
+    if duplicate_id is not None:
+        return _duplicate_event(duplicate_id)
+    previous = _previous_key(req, attempt, idempotency_key)
+    async with async_attempt_write_session(attempt.domain, db) as shard_db:
+        duplicate_id = await prior_event_id_async(shard_db, previous)
+        if duplicate_id is not None:
+            return _duplicate_event(duplicate_id)
+        shard_db.add(attempt)
+        try:
+            await shard_db.commit()
+        except IntegrityError:
+            await shard_db.rollback()
+            if key is None:
+                raise
+            return _duplicate_event(await stored_event_id_async(shard_db, key))
+    remember_event(key, attempt.id)
+    record_event(attempt.domain, attempt.code, attempt.success, attempt.saved, attempt.id)
+    bump_domain_version(attempt.domain, attempt.id)
+    schedule_suggestion_refresh(attempt.domain, ADAPTERS)
+    await prune_old_attempts(db)
+    return {"ok": True, "id": attempt.id}
+
+
+# Everything without an async handler above falls through to the sync implementation. Those
+# routes go first so static paths such as /catalog/coverage win over /catalog/{domain}.
+_async_routes = {(route.path, tuple(sorted(route.methods or ()))) for route in app.routes if hasattr(route, "methods")}
+app.router.routes[:0] = [
+    route
+    for route in sync_app.app.routes
+    if hasattr(route, "endpoint")
+    and route.path not in ("/openapi.json", "/docs", "/docs/oauth2-redirect", "/redoc")
+    and (route.path, tuple(sorted(route.methods or ()))) not in _async_routes
+]
@@ -0,0 +1,183 @@
+"""/adapters under several uvicorn workers, with and without the shared adapter snapshot.
+
+Seeds a synthetic catalog into SQLite once, then for each mode starts ``uvicorn app:app
+--workers N`` and hammers ``GET /adapters`` from client threads. ``off`` is the old
+behaviour (``ADAPTER_SNAPSHOT_DIR=off``: every request rebuilds the snapshot from the
+catalog); ``shared`` maps the snapshot file one process published. Prints one JSON
+document with startup time, throughput, latency percentiles and the workers' summed
+RSS and PSS (PSS splits shared pages between the processes mapping them).
+
+    python benchmarks/adapters_load.py --retailers 2000 --workers 4 --duration 10
+"""
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+for path in (ROOT, ROOT / "benchmarks"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from async_load import _free_port, _percentile
+
+
+def _seed(workdir: Path, retailers: int, inventory: int, seed: int) -> Path:
+    path = workdir / f"adapters-load-{retailers}-{inventory}-{seed}.db"
+    if not path.exists():
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import models; from db import Base, engine; from synthetic import seed_catalog; "
+                f"Base.metadata.create_all(bind=engine); seed_catalog(engine, retailers={retailers}, inventory={inventory}, seed={seed})",
+            ],
+            cwd=str(ROOT / "benchmarks"),
+            env=dict(os.environ, DATABASE_URL=f"sqlite:///{path}", PYTHONPATH=str(ROOT)),
+            check=True,
+        )
+    return path
+
+
+def _get(port: int, path: str, timeout: float = 30.0):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def _wait_ready(port: int, timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if _get(port, "/adapters")[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not become ready")
+
+
+def _memory_kb(parent: int) -> Dict[str, int]:
+    totals = {"rss_kb": 0, "pss_kb": 0}
+    children = Path(f"/proc/{parent}/task/{parent}/children")
+    pids = children.read_text().split() if children.exists() else []
+    for pid in pids or [str(parent)]:
+        try:
+            for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    totals[key.lower() + "_kb"] += int(rest.split()[0])
+        except OSError:
+            continue
+    return totals
+
+
+def _drive(port: int, clients: int, duration: float) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client() -> None:
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                status, _body = _get(port, "/adapters")
+            except OSError:
+                status = 0
+            elapsed = time.perf_counter() - started
+            with lock:
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "errors": errors[0],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="/adapters throughput and worker memory, snapshot off vs shared.")
+    parser.add_argument("--retailers", type=int, default=2000)
+    parser.add_argument("--inventory", type=int, default=20, help="Codes per retailer")
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn worker processes")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--modes", default="off,shared")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "disco-bench"))
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    database = _seed(workdir, args.retailers, args.inventory, args.seed)
+    results = {}
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        snapshot_dir = workdir / "adapters-load-snapshot"
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        port = _free_port()
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{database}",
+            ADAPTER_SNAPSHOT_DIR="off" if mode == "off" else str(snapshot_dir),
+            INVENTORY_SWEEP_INTERVAL_SECONDS="0",
+        )
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=str(ROOT),
+            env=env,
+        )
+        try:
+            _wait_ready(port)
+            startup = time.perf_counter() - started
+            # Let every worker finish starting before measuring memory.
+            time.sleep(2.0)
+            stats = _drive(port, args.clients, args.duration)
+            stats["startup_seconds"] = round(startup, 2)
+            stats.update(_memory_kb(server.pid))
+            stats["snapshot_files"] = sorted(p.name for p in snapshot_dir.glob("*.snap")) if mode != "off" else []
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        results[mode] = stats
+        print(f"{mode}: {stats}", file=sys.stderr)
+    json.dump(
+        {
+            "config": {"retailers": args.retailers, "inventory": args.inventory, "workers": args.workers, "clients": args.clients, "duration": args.duration},
+            "modes": results,
+        },
+        sys.stdout,
+        indent=2,
+        sort_keys=True,
+    )
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":  # pragma: no cover - CLI entry point
+    main()
@@ -0,0 +1,209 @@
+"""Load-test the sync (``app:app``) and async (``app_async:app``) stacks side by side.
+
+Both stacks are started under uvicorn against the same seeded SQLite file, then driven
+with a fixed mix of /rank, /suggest (client html, so no outbound fetches), /event and
+/catalog/{domain} requests at a fixed client concurrency. Prints one JSON document with
+p50/p99 latency and throughput per stack and per endpoint.
+
+    python benchmarks/async_load.py --concurrency 64 --duration 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+HTML = "<html><body>" + "".join(
+    f"<div class='promo'>Use promo code SAVE{i:03d} for {i % 40}% off</div>" for i in range(200)
+) + "</body></html>"
+
+
+def _seed_database(path: str, domains: int, attempts: int, seed: int) -> List[str]:
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    from db import Base, SessionLocal, engine
+    from catalog import ingest_catalog_entries
+    from models import CodeAttempt, CodeSeed
+
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(seed)
+    names = [f"shop{i}.example" for i in range(domains)]
+    session = SessionLocal()
+    try:
+        ingest_catalog_entries(
+            session,
+            [
+                {"domain": d, "name": d, "inventory": [{"code": f"CAT{d[4:-8]}X{j}"} for j in range(20)]}
+                for d in names
+            ],
+        )
+        session.bulk_save_objects([CodeSeed(domain=d, code=f"SEED{j}") for d in names for j in range(10)])
+        rows = []
+        now = datetime.utcnow()
+        for _ in range(attempts):
+            rows.append(
+                CodeAttempt(
+                    domain=rng.choice(names),
+                    code=f"SAVE{rng.randrange(100):03d}",
+                    success=rng.random() < 0.4,
+                    saved=round(rng.random() * 30, 2),
+                    created_at=now - timedelta(seconds=rng.randrange(60 * 86400)),
+                )
+            )
+            if len(rows) >= 5000:
+                session.bulk_save_objects(rows)
+                rows = []
+        session.bulk_save_objects(rows)
+        session.commit()
+    finally:
+        session.close()
+    return names
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(target: str, port: int, db_path: str) -> subprocess.Popen:
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", CODE_EVENT_RETENTION_DAYS="0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+        cwd=str(ROOT),
+        env=env,
+    )
+
+
+async def _wait_ready(client, base: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(f"{base}/health")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"server at {base} did not become ready")
+
+
+def _request(rng: random.Random, domains: List[str]):
+    domain = rng.choice(domains)
+    roll = rng.random()
+    if roll < 0.45:
+        codes = [f"SAVE{rng.randrange(100):03d}" for _ in range(12)]
+        return "rank", "POST", "/rank", {"domain": domain, "context": {"codes": codes}}
+    if roll < 0.75:
+        return "suggest", "POST", "/suggest", {"domain": domain, "html": HTML, "limit": 25}
+    if roll < 0.9:
+        return "event", "POST", "/event", {"domain": domain, "code": f"SAVE{rng.randrange(100):03d}", "success": rng.random() < 0.4, "saved": 5}
+    return "catalog", "GET", f"/catalog/{domain}", None
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _summarize(latencies: Dict[str, List[float]], errors: int, elapsed: float) -> Dict:
+    every = [v for vals in latencies.values() for v in vals]
+    return {
+        "requests": len(every),
+        "errors": errors,
+        "throughput_rps": round(len(every) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(every, 50) * 1000, 2),
+        "p99_ms": round(_percentile(every, 99) * 1000, 2),
+        "endpoints": {
+            name: {
+                "requests": len(vals),
+                "p50_ms": round(_percentile(vals, 50) * 1000, 2),
+                "p99_ms": round(_percentile(vals, 99) * 1000, 2),
+            }
+            for name, vals in sorted(latencies.items())
+        },
+    }
+
+
+async def _drive(base: str, domains: List[str], concurrency: int, duration: float, seed: int) -> Dict:
+    import httpx
+
+    latencies: Dict[str, List[float]] = {}
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as client:
+        await _wait_ready(client, base)
+        stop_at = time.monotonic() + duration
+
+        async def worker(worker_id: int) -> None:
+            nonlocal errors
+            rng = random.Random(seed * 1000 + worker_id)
+            while time.monotonic() < stop_at:
+                name, method, path, body = _request(rng, domains)
+                started = time.perf_counter()
+                try:
+                    resp = await client.request(method, base + path, json=body)
+                    ok = resp.status_code < 500
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.setdefault(name, []).append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return _summarize(latencies, errors, elapsed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare sync and async API stacks under load.")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of load per stack")
+    parser.add_argument("--domains", type=int, default=50)
+    parser.add_argument("--attempts", type=int, default=200000, help="Seeded CodeAttempt rows")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--stacks", default="app:app,app_async:app")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="disco-load-")
+    db_path = os.path.join(workdir, "bench.db")
+    domains = _seed_database(db_path, args.domains, args.attempts, args.seed)
+
+    results = {
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "attempt_rows": args.attempts,
+        "stacks": {},
+    }
+    for target in [t.strip() for t in args.stacks.split(",") if t.strip()]:
+        port = _free_port()
+        proc = _start_server(target, port, db_path)
+        try:
+            results["stacks"][target] = asyncio.run(
+                _drive(f"http://127.0.0.1:{port}", domains, args.concurrency, args.duration, args.seed)
+            )
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":  # pragma: no cover - CLI entry point
+    main()
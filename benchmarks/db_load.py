@@ -0,0 +1,177 @@
+"""Mixed read/write load against the database layer, with and without SQLite tuning.
+
+Seeds a synthetic SQLite database once, then for each mode runs a fresh copy of it in a
+subprocess. Reader threads alternate ``rank_codes`` and ``/catalog``-style page reads on
+``ReadSessionLocal``. Writer threads insert ``CodeAttempt`` rows one commit at a time on
+``WriteSessionLocal``, like ``/event`` does. Prints one JSON document with throughput,
+latency percentiles and lock errors per mode. ``untuned`` is the old single default engine
+(``SQLITE_TUNED=false``); ``tuned`` adds the WAL pragmas, the query_only read pool and the
+dedicated writer connection.
+
+    python benchmarks/db_load.py --readers 8 --writers 4 --duration 15
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+for path in (ROOT, ROOT / "benchmarks"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from async_load import _percentile
+
+MODES = {"untuned": "false", "tuned": "true"}
+
+
+def _summary(values: List[float], elapsed: float) -> Dict[str, float]:
+    return {
+        "ops": len(values),
+        "ops_per_second": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(values, 50) * 1000, 2),
+        "p99_ms": round(_percentile(values, 99) * 1000, 2),
+    }
+
+
+def _worker(args: argparse.Namespace) -> Dict:
+    """Runs inside the per-mode subprocess, after DATABASE_URL/SQLITE_TUNED are set."""
+    from sqlalchemy.exc import OperationalError
+
+    from catalog import get_retailer_page
+    from db import ReadSessionLocal, WriteSessionLocal
+    from models import CodeAttempt
+    from ranking import rank_codes
+    from synthetic import SCALES, code_vocabulary, domain_names
+
+    scale = SCALES[args.scale]
+    domains = domain_names(scale["domains"])
+    retailers = domain_names(scale["retailers"])
+    codes = code_vocabulary(random.Random(args.seed), scale["codes_per_domain"])
+    stop_at = time.perf_counter() + args.duration
+    lock = threading.Lock()
+    reads: List[float] = []
+    writes: List[float] = []
+    errors = {"read": 0, "write": 0}
+
+    def reader(index: int) -> None:
+        rng = random.Random(args.seed + index)
+        while time.perf_counter() < stop_at:
+            db = ReadSessionLocal()
+            started = time.perf_counter()
+            try:
+                if rng.random() < 0.5:
+                    rank_codes(db, rng.choice(domains), rng.sample(codes, 12))
+                else:
+                    get_retailer_page(db, rng.choice(retailers), limit=100)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    reads.append(elapsed)
+            except OperationalError:
+                with lock:
+                    errors["read"] += 1
+            finally:
+                db.close()
+
+    def writer(index: int) -> None:
+        rng = random.Random(args.seed * 1000 + index)
+        while time.perf_counter() < stop_at:
+            db = WriteSessionLocal()
+            started = time.perf_counter()
+            try:
+                db.add(CodeAttempt(domain=rng.choice(domains), code=rng.choice(codes), success=rng.random() < 0.3, saved=5.0))
+                db.commit()
+                elapsed = time.perf_counter() - started
+                with lock:
+                    writes.append(elapsed)
+            except OperationalError:
+                db.rollback()
+                with lock:
+                    errors["write"] += 1
+            finally:
+                db.close()
+            if args.write_interval_ms:
+                time.sleep(args.write_interval_ms / 1000.0)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {"reads": _summary(reads, elapsed), "writes": _summary(writes, elapsed), "lock_errors": errors}
+
+
+def _seed(workdir: Path, scale: str, seed: int) -> Path:
+    base = workdir / f"db-load-{scale}-{seed}.db"
+    if not base.exists():
+        subprocess.run(
+            [sys.executable, "-c", f"from db import engine; from synthetic import SCALES, build_database; build_database(engine, SCALES[{scale!r}], {seed})"],
+            cwd=str(ROOT / "benchmarks"),
+            env=dict(os.environ, DATABASE_URL=f"sqlite:///{base}", SQLITE_TUNED="false", PYTHONPATH=str(ROOT)),
+            check=True,
+        )
+    return base
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mixed read/write database load, SQLite tuned vs untuned.")
+    parser.add_argument("--scale", choices=("smoke", "full"), default="smoke")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--write-interval-ms", type=float, default=0.0, help="Pause between a writer's commits")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated subset of: " + ", ".join(MODES))
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "disco-bench"))
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(_worker(args), sys.stdout)
+        return
+
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    base = _seed(workdir, args.scale, args.seed)
+    results = {}
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        copy = workdir / f"db-load-{mode}.db"
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{copy}{suffix}").unlink(missing_ok=True)
+        shutil.copyfile(base, copy)
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{copy}", SQLITE_TUNED=MODES[mode], CODE_EVENT_RETENTION_DAYS="0")
+        out = subprocess.run(
+            [sys.executable, __file__, *sys.argv[1:], "--worker", mode],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results[mode] = json.loads(out)
+        print(f"{mode}: {results[mode]}", file=sys.stderr)
+    json.dump(
+        {
+            "config": {"scale": args.scale, "readers": args.readers, "writers": args.writers, "duration": args.duration},
+            "modes": results,
+        },
+        sys.stdout,
+        indent=2,
+        sort_keys=True,
+    )
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":  # pragma: no cover - CLI entry point
+    main()
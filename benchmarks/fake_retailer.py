@@ -0,0 +1,225 @@
+"""Stand-in retailer web server for exercising the scrape pipeline offline.
+
+Serves ``/<domain>/<path>`` (or ``/<path>`` with the domain taken from the Host header)
+as deterministic promo pages built by ``synthetic.html_page``. Latency, page size, error
+and throttling rates, the share of pages without codes, redirects, ETag/Last-Modified
+validators and robots.txt are all configurable, and ``/__stats`` reports how many requests of each kind were served.
+Point the API at it with ``SCRAPE_ORIGIN=http://127.0.0.1:<port>/{domain}``.
+
+    python benchmarks/fake_retailer.py --port 8900 --latency-ms 80 --error-rate 0.02
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from synthetic import html_page
+
+PAGE_CACHE_SIZE = 512
+
+
+class RetailerConfig(NamedTuple):
+    latency_ms: float = 50.0
+    page_bytes: int = 64 * 1024
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    redirect_rate: float = 0.0
+    change_every: float = 0.0
+    etags: bool = True
+    crawl_delay: float = 0.0
+    empty_rate: float = 0.0
+    seed: int = 7
+
+
+def _empty_page(size_bytes: int) -> bytes:
+    filler = "<p>No deal on at all now.</p>"
+    return f"<html><body>{filler * max(1, size_bytes // len(filler))}</body></html>".encode()
+
+
+class _State:
+    def __init__(self, config: RetailerConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.pages: "OrderedDict[Tuple[str, str, int], bytes]" = OrderedDict()
+        self.rng = random.Random(config.seed)
+
+    def bump(self, key: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def roll(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+    def page(self, domain: str, path: str, epoch: int) -> bytes:
+        key = (domain, path, epoch)
+        with self.lock:
+            body = self.pages.get(key)
+            if body is not None:
+                self.pages.move_to_end(key)
+                return body
+        seed = zlib.crc32(f"{domain}|{path}|{epoch}".encode()) ^ self.config.seed
+        # A fixed share of (domain, path) pairs never mention a code, like most real retailer pages.
+        if zlib.crc32(f"{domain}|{path}".encode()) % 1000 < self.config.empty_rate * 1000:
+            body = _empty_page(self.config.page_bytes)
+        else:
+            body = html_page(self.config.page_bytes, seed)[0].encode()
+        with self.lock:
+            self.pages[key] = body
+            while len(self.pages) > PAGE_CACHE_SIZE:
+                self.pages.popitem(last=False)
+        return body
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counters)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeRetailer/1.0"
+    protocol_version = "HTTP/1.1"
+    state: _State
+
+    def log_message(self, format, *args):  # noqa: A002 - BaseHTTPRequestHandler signature
+        pass
+
+    def _send(self, status: int, body: bytes = b"", headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+        self.state.bump("requests")
+        self.state.bump(f"status_{status}")
+        self.state.bump("bytes_sent", len(body))
+
+    def _route(self) -> Tuple[str, str, str]:
+        parts = urlsplit(self.path)
+        segments = [s for s in parts.path.split("/") if s]
+        if segments and "." in segments[0] and segments[0] != "robots.txt":
+            domain, rest = segments[0], "/" + "/".join(segments[1:])
+        else:
+            domain, rest = (self.headers.get("Host") or "unknown").split(":")[0], parts.path or "/"
+        return domain.lower(), rest, parts.query
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        config = self.state.config
+        if self.path == "/__stats":
+            body = json.dumps(self.state.snapshot(), sort_keys=True).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        domain, path, query = self._route()
+        if config.latency_ms > 0:
+            time.sleep(config.latency_ms / 1000.0 * (0.5 + self.state.roll()))
+        if path == "/robots.txt":
+            robots = "User-agent: *\nDisallow: /private\n"
+            if config.crawl_delay:
+                robots += f"Crawl-delay: {config.crawl_delay:g}\n"
+            self._send(200, robots.encode(), {"Content-Type": "text/plain"})
+            return
+        roll = self.state.roll()
+        if roll < config.error_rate:
+            self._send(503, b"upstream unavailable", {"Content-Type": "text/plain"})
+            return
+        roll -= config.error_rate
+        if roll < config.throttle_rate:
+            self._send(429, b"slow down", {"Content-Type": "text/plain", "Retry-After": "2"})
+            return
+        roll -= config.throttle_rate
+        if roll < config.redirect_rate and "via=redirect" not in query:
+            self._send(302, b"", {"Location": f"{self.path}{'&' if query else '?'}via=redirect"})
+            return
+
+        epoch = int(time.time() // config.change_every) if config.change_every > 0 else 0
+        headers = {"Content-Type": "text/html; charset=utf-8"}
+        if config.etags:
+            etag = f'"{zlib.crc32(f"{domain}|{path}|{epoch}".encode()):08x}"'
+            headers["ETag"] = etag
+            headers["Last-Modified"] = formatdate(epoch * config.change_every if config.change_every else 0, usegmt=True)
+            if self.headers.get("If-None-Match") == etag:
+                self.state.bump("conditional_hits")
+                self._send(304, b"", {"ETag": etag})
+                return
+        self._send(200, self.state.page(domain, path, epoch), headers)
+
+
+def start_server(config: RetailerConfig, host: str = "127.0.0.1", port: int = 0):
+    """Start the server on a daemon thread; returns ``(server, base_url)``."""
+    handler = type("RetailerHandler", (_Handler,), {"state": _State(config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-retailer", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def stats(server) -> Dict[str, int]:
+    return server.RequestHandlerClass.state.snapshot()
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Mean response delay (uniform +/-50%%)")
+    parser.add_argument("--page-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of pages answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction answered with 429")
+    parser.add_argument("--redirect-rate", type=float, default=0.0, help="Fraction answered with a 302 first")
+    parser.add_argument("--change-every", type=float, default=0.0, help="Seconds between page content changes (0: never)")
+    parser.add_argument("--no-etags", action="store_true", help="Send no validators and ignore conditional requests")
+    parser.add_argument("--crawl-delay", type=float, default=0.0, help="Crawl-delay advertised in robots.txt")
+    parser.add_argument("--empty-rate", type=float, default=0.0, help="Fraction of (domain, path) pages without codes")
+
+
+def config_from_args(args: argparse.Namespace, seed: int = 7) -> RetailerConfig:
+    return RetailerConfig(
+        latency_ms=args.latency_ms,
+        page_bytes=args.page_bytes,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        redirect_rate=args.redirect_rate,
+        change_every=args.change_every,
+        etags=not args.no_etags,
+        crawl_delay=args.crawl_delay,
+        empty_rate=args.empty_rate,
+        seed=seed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve fake retailer promo pages.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--seed", type=int, default=7)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server, base = start_server(config_from_args(args, args.seed), args.host, args.port)
+    print(f"serving on {base}; set SCRAPE_ORIGIN={base}/{{domain}}", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":  # pragma: no cover - CLI entry point
+    main()
@@ -0,0 +1,163 @@
+"""Drive /suggest and /scrape at a target QPS against the fake retailer server.
+
+Starts ``fake_retailer`` in-process and the API under uvicorn with ``SCRAPE_ORIGIN``
+pointed at it and a fresh SQLite database, then issues requests open-loop (on a fixed
+schedule, regardless of how fast responses come back) so queueing shows up in tail
+latency instead of silently lowering the offered load. Prints one JSON document with
+throughput, p50/p95/p99 per endpoint, outbound retailer requests by status, and the
+API's own /scrape/stats snapshot.
+
+    python benchmarks/scrape_load.py --qps 40 --duration 30 --latency-ms 120 --error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+for path in (ROOT, ROOT / "benchmarks"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from async_load import _free_port, _percentile, _wait_ready
+from fake_retailer import add_arguments, config_from_args, start_server, stats
+from synthetic import domain_names
+
+
+def _start_api(target: str, port: int, db_path: str, origin: str, negative_ttl: int, scrape_ttl: int):
+    import subprocess
+
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{db_path}",
+        SCRAPE_ORIGIN=f"{origin}/{{domain}}",
+        # Caps the politeness backoff, so one unlucky 503 streak does not bench a fake domain for the whole run.
+        SCRAPE_NEGATIVE_TTL_SECONDS=str(negative_ttl),
+        SCRAPE_TTL_SECONDS=str(scrape_ttl),
+        CODE_EVENT_RETENTION_DAYS="0",
+    )
+    env.pop("DISCO_API_KEY", None)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+        cwd=str(ROOT),
+        env=env,
+    )
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "requests": len(values),
+        "p50_ms": round(_percentile(values, 50) * 1000, 2),
+        "p95_ms": round(_percentile(values, 95) * 1000, 2),
+        "p99_ms": round(_percentile(values, 99) * 1000, 2),
+    }
+
+
+async def _drive(base: str, domains: List[str], args: argparse.Namespace) -> Dict:
+    import httpx
+
+    rng = random.Random(args.seed)
+    latencies: Dict[str, List[float]] = {}
+    statuses: Dict[str, int] = {}
+    codes_returned = 0
+    dropped = 0
+    inflight = set()
+    limits = httpx.Limits(max_connections=args.max_inflight, max_keepalive_connections=args.max_inflight)
+    async with httpx.AsyncClient(limits=limits, timeout=60.0) as client:
+        await _wait_ready(client, base)
+
+        async def one(name: str, body: Dict) -> None:
+            nonlocal codes_returned
+            started = time.perf_counter()
+            try:
+                resp = await client.post(f"{base}/{name}", json=body)
+                key = str(resp.status_code)
+                if name == "scrape" and resp.status_code == 200:
+                    codes_returned += len(resp.json().get("codes") or [])
+            except httpx.HTTPError as exc:
+                key = type(exc).__name__
+            elapsed = time.perf_counter() - started
+            statuses[key] = statuses.get(key, 0) + 1
+            if key == "200":
+                latencies.setdefault(name, []).append(elapsed)
+
+        total = int(args.qps * args.duration)
+        started = time.monotonic()
+        for i in range(total):
+            delay = started + i / args.qps - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(inflight) >= args.max_inflight:
+                dropped += 1
+                continue
+            domain = rng.choice(domains)
+            if rng.random() < args.suggest_share:
+                task = asyncio.create_task(one("suggest", {"domain": domain, "limit": 25}))
+            else:
+                task = asyncio.create_task(one("scrape", {"domain": domain}))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+        if inflight:
+            await asyncio.gather(*inflight)
+        elapsed = time.monotonic() - started
+        scrape_stats = (await client.get(f"{base}/scrape/stats")).json()
+
+    completed = [v for values in latencies.values() for v in values]
+    return {
+        "offered_qps": args.qps,
+        "achieved_qps": round(len(completed) / elapsed, 2) if elapsed else 0.0,
+        "dropped": dropped,
+        "scrape_codes_returned": codes_returned,
+        "statuses": statuses,
+        "overall": _summary(completed),
+        "endpoints": {name: _summary(values) for name, values in sorted(latencies.items())},
+        "api_scrape_stats": scrape_stats,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test the scrape pipeline against a fake retailer.")
+    parser.add_argument("--target", default="app:app", help="ASGI app to serve (e.g. app_async:app)")
+    parser.add_argument("--qps", type=float, default=20.0)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--domains", type=int, default=50)
+    parser.add_argument("--suggest-share", type=float, default=0.5, help="Fraction of requests sent to /suggest")
+    parser.add_argument("--max-inflight", type=int, default=256, help="Requests beyond this many in flight are dropped")
+    parser.add_argument("--negative-ttl", type=int, default=5, help="SCRAPE_NEGATIVE_TTL_SECONDS for the API")
+    parser.add_argument("--scrape-ttl", type=int, default=600, help="SCRAPE_TTL_SECONDS for the API")
+    parser.add_argument("--seed", type=int, default=7)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, origin = start_server(config_from_args(args, args.seed))
+    db_path = os.path.join(tempfile.mkdtemp(prefix="disco-scrape-load-"), "load.db")
+    port = _free_port()
+    proc = _start_api(args.target, port, db_path, origin, args.negative_ttl, args.scrape_ttl)
+    try:
+        result = asyncio.run(_drive(f"http://127.0.0.1:{port}", domain_names(args.domains), args))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        server.shutdown()
+    outbound = stats(server)
+    result["outbound"] = outbound
+    result["outbound_per_request"] = round(outbound.get("requests", 0) / max(1, result["overall"]["requests"]), 3)
+    result["outbound_per_scrape_code"] = round(outbound.get("requests", 0) / max(1, result["scrape_codes_returned"]), 3)
+    result["config"] = {
+        "target": args.target,
+        "domains": args.domains,
+        "fake_retailer": config_from_args(args, args.seed)._asdict(),
+    }
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":  # pragma: no cover - CLI entry point
+    main()
@@ -0,0 +1,135 @@
+"""Event write throughput against 1..N SQLite attempt shards.
+
+For each shard count, starts ``--processes`` writer processes (like several API workers)
+with ``ATTEMPT_SHARDS`` pointing at that many fresh SQLite files. Each writer commits one
+``CodeAttempt`` per transaction through ``attempt_write_session``, as ``/event`` does,
+for random domains. Prints one JSON document with throughput, latency percentiles,
+busy errors and rows per shard for every shard count.
+
+    python benchmarks/shard_load.py --shards 1,2,4 --processes 4 --duration 10
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+for path in (ROOT, ROOT / "benchmarks"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from async_load import _percentile
+
+
+def _writer(index: int, duration: float, domains: int) -> Dict:
+    from sqlalchemy.exc import OperationalError
+
+    from db import WriteSessionLocal
+    from models import CodeAttempt
+    from shards import attempt_write_session
+
+    rng = random.Random(index)
+    names = [f"shop{i}.example" for i in range(domains)]
+    latencies: List[float] = []
+    errors = 0
+    stop_at = time.perf_counter() + duration
+    while time.perf_counter() < stop_at:
+        domain = rng.choice(names)
+        db = WriteSessionLocal()
+        started = time.perf_counter()
+        try:
+            with attempt_write_session(domain, db) as shard_db:
+                shard_db.add(CodeAttempt(domain=domain, code=f"CODE{rng.randrange(50)}", success=rng.random() < 0.3, saved=5.0))
+                try:
+                    shard_db.commit()
+                except OperationalError:
+                    shard_db.rollback()
+                    errors += 1
+                    continue
+            latencies.append(time.perf_counter() - started)
+        finally:
+            db.close()
+    return {"latencies": latencies, "errors": errors}
+
+
+def _worker(args: argparse.Namespace) -> Dict:
+    """Runs inside the per-shard-count subprocess, after ATTEMPT_SHARDS is set."""
+    from shards import create_attempt_tables, shard_row_counts
+
+    create_attempt_tables()
+    started = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(args.processes) as pool:
+        results = pool.starmap(_writer, [(i, args.duration, args.domains) for i in range(args.processes)])
+    elapsed = time.perf_counter() - started
+    latencies = [value for result in results for value in result["latencies"]]
+    return {
+        "writes": len(latencies),
+        "writes_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "busy_errors": sum(result["errors"] for result in results),
+        "rows_per_shard": [entry["rows"] for entry in shard_row_counts()],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Event write throughput by attempt shard count.")
+    parser.add_argument("--shards", default="1,2,4", help="Comma-separated shard counts to compare")
+    parser.add_argument("--processes", type=int, default=4, help="Writer processes")
+    parser.add_argument("--domains", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "disco-bench"))
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(_worker(args), sys.stdout)
+        return
+
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    for count in [int(n) for n in args.shards.split(",") if n.strip()]:
+        urls = []
+        for index in range(count):
+            path = workdir / f"shard-load-{count}-{index}.db"
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{path}{suffix}").unlink(missing_ok=True)
+            urls.append(f"sqlite:///{path}")
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{workdir / 'shard-load-main.db'}",
+            ATTEMPT_SHARDS=",".join(urls),
+            PYTHONPATH=str(ROOT),
+        )
+        out = subprocess.run(
+            [sys.executable, __file__, *sys.argv[1:], "--worker", str(count)],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results[str(count)] = json.loads(out)
+        print(f"{count} shards: {results[str(count)]}", file=sys.stderr)
+    json.dump(
+        {
+            "config": {"processes": args.processes, "domains": args.domains, "duration": args.duration},
+            "shards": results,
+        },
+        sys.stdout,
+        indent=2,
+        sort_keys=True,
+    )
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":  # pragma: no cover - CLI entry point
+    main()
@@ -0,0 +1,261 @@
+"""Micro and endpoint benchmarks for the ranking, telemetry, parsing and catalog hot paths.
+
+Seeds a SQLite database from ``benchmarks/synthetic.py`` (reused across runs in
+``--workdir``), times each benchmark, and writes one JSON document of per-benchmark
+statistics. With ``--baseline`` the medians are compared against a stored run and the
+process exits non-zero when any benchmark is slower than its allowed threshold.
+
+    python benchmarks/suite.py --scale smoke --baseline benchmarks/baseline.json
+    python benchmarks/suite.py --scale smoke --output benchmarks/baseline.json   # refresh
+    python benchmarks/suite.py --scale full --workdir /var/tmp/disco-bench --only rank
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+ROOT = Path(__file__).resolve().parents[1]
+for path in (ROOT, ROOT / "benchmarks"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+DEFAULT_THRESHOLD = 0.3
+
+
+def _stats(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "iterations": len(ordered),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+    }
+
+
+def _measure(fn: Callable[[], object], iterations: int, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return _stats(samples)
+
+
+def _prepare(workdir: Path, scale_name: str, seed: int) -> Path:
+    """Point DATABASE_URL at a seeded database for this scale/seed, building it if needed."""
+    workdir.mkdir(parents=True, exist_ok=True)
+    db_path = workdir / f"bench-{scale_name}-{seed}.db"
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("CODE_EVENT_RETENTION_DAYS", "0")
+    ready = db_path.with_suffix(".ready")
+    if not ready.exists():
+        from db import engine
+        from synthetic import SCALES, build_database
+
+        if db_path.exists():
+            db_path.unlink()
+        started = time.perf_counter()
+        build_database(engine, SCALES[scale_name], seed)
+        ready.write_text(json.dumps({"seconds": round(time.perf_counter() - started, 1)}))
+    return db_path
+
+
+def micro_benchmarks(scale: Dict, seed: int, iterations: int) -> Dict[str, Callable[[], Dict]]:
+    from catalog import upsert_retailer_profile
+    from db import SessionLocal
+    from parsing import scrape_from_html
+    from ranking import rank_codes
+    from scraper import _scrape_config
+    from synthetic import code_vocabulary, domain_names, hot_domain, html_page, retailer_payload
+    from telemetry import aggregate_success_metrics
+
+    with open(ROOT / "adapters.json") as fh:
+        adapters = json.load(fh)
+    token_re, keywords, stop, _ = _scrape_config(adapters, None)
+    domain = hot_domain(scale["domains"])
+    candidates = code_vocabulary(random.Random(seed), scale["codes_per_domain"])[:50]
+    page, _ = html_page(scale["html_bytes"], seed)
+
+    def with_session(fn):
+        def run():
+            db = SessionLocal()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+        return run
+
+    def rank():
+        return _measure(with_session(lambda db: rank_codes(db, domain, candidates)), iterations)
+
+    def aggregate():
+        return _measure(with_session(lambda db: aggregate_success_metrics(db, domain=domain)), iterations)
+
+    def parse():
+        return _measure(lambda: scrape_from_html(page, token_re, keywords, stop), max(3, iterations // 5))
+
+    def upsert():
+        rng = random.Random(seed)
+        names = domain_names(scale["retailers"])
+
+        def once(db):
+            # Update path: an existing retailer whose inventory is mostly replaced.
+            upsert_retailer_profile(db, retailer_payload(rng, rng.choice(names), scale["inventory"]))
+            db.flush()
+            db.rollback()
+
+        return _measure(with_session(once), max(3, iterations // 2))
+
+    return {
+        "micro.rank_codes": rank,
+        "micro.aggregate_success_metrics": aggregate,
+        "micro.scrape_from_html": parse,
+        "micro.upsert_retailer_profile": upsert,
+    }
+
+
+def endpoint_benchmarks(scale: Dict, seed: int, iterations: int) -> Dict[str, Callable[[], Dict]]:
+    from synthetic import code_vocabulary, domain_names, hot_domain, html_page
+
+    domain = hot_domain(scale["domains"])
+    vocabulary = code_vocabulary(random.Random(seed), scale["codes_per_domain"])
+    codes = vocabulary[:12]
+    rank_domains = domain_names(scale["domains"])[:8]
+    small_page, _ = html_page(4 * 1024, seed)
+
+    def rank_body(i: int) -> Dict:
+        # Rotate domains and candidate lists so the run measures ranking, not _rank_cache hits.
+        start = (i * 7) % max(1, len(vocabulary) - len(codes))
+        return {"domain": rank_domains[i % len(rank_domains)], "context": {"codes": vocabulary[start:start + len(codes)]}}
+
+    # A body is a dict, or a callable taking the request index.
+    requests = {
+        "endpoint.rank": ("POST", "/rank", rank_body),
+        "endpoint.suggest": ("POST", "/suggest", {"domain": domain, "html": small_page, "limit": 25}),
+        "endpoint.catalog_detail": ("GET", f"/catalog/{domain}", None),
+        "endpoint.catalog_page": ("GET", f"/catalog/{domain}?limit=100&fields=domain,inventory.code,inventory.expires_at", None),
+        "endpoint.event": ("POST", "/event", {"domain": domain, "code": codes[0], "success": True, "saved": 5}),
+    }
+
+    async def drive(method: str, path: str, body: Union[None, Dict, Callable[[int], Dict]]) -> Dict:
+        import httpx
+
+        from app import app
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            samples = []
+            for i in range(iterations + 1):
+                started = time.perf_counter()
+                resp = await client.request(method, path, json=body(i) if callable(body) else body)
+                elapsed = time.perf_counter() - started
+                if resp.status_code >= 400:
+                    raise RuntimeError(f"{method} {path} returned {resp.status_code}: {resp.text[:200]}")
+                if i:  # first request is warmup
+                    samples.append(elapsed)
+        return _stats(samples)
+
+    return {name: (lambda spec=spec: asyncio.run(drive(*spec))) for name, spec in requests.items()}
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[Dict]:
+    """Benchmarks whose median regressed past their threshold relative to ``baseline``."""
+    overrides = baseline.get("thresholds", {})
+    regressions = []
+    for name, current in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if not previous or not previous.get("median_ms"):
+            continue
+        allowed = overrides.get(name, threshold)
+        ratio = current["median_ms"] / previous["median_ms"]
+        if ratio > 1.0 + allowed:
+            regressions.append(
+                {
+                    "benchmark": name,
+                    "baseline_ms": previous["median_ms"],
+                    "current_ms": current["median_ms"],
+                    "ratio": round(ratio, 3),
+                    "allowed": allowed,
+                }
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the Disco benchmark suite.")
+    parser.add_argument("--scale", choices=("smoke", "full"), default="smoke")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "disco-bench"))
+    parser.add_argument("--only", default=None, help="Run benchmarks whose name contains this")
+    parser.add_argument("--output", default=None, help="Write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="Compare medians against this results file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Allowed median slowdown vs baseline, as a fraction (default: 0.3)",
+    )
+    args = parser.parse_args()
+
+    from synthetic import SCALES
+
+    scale = SCALES[args.scale]
+    _prepare(Path(args.workdir), args.scale, args.seed)
+
+    benchmarks = {}
+    benchmarks.update(micro_benchmarks(scale, args.seed, args.iterations))
+    benchmarks.update(endpoint_benchmarks(scale, args.seed, args.iterations))
+    results = {
+        "meta": {
+            "scale": args.scale,
+            "seed": args.seed,
+            "iterations": args.iterations,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "benchmarks": {},
+    }
+    for name, run in benchmarks.items():
+        if args.only and args.only not in name:
+            continue
+        results["benchmarks"][name] = run()
+        print(f"{name}: median {results['benchmarks'][name]['median_ms']} ms", file=sys.stderr)
+
+    text = json.dumps(results, indent=2, sort_keys=True) + "\n"
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        sys.stdout.write(text)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if baseline.get("meta", {}).get("scale") != args.scale:
+            print(f"baseline was recorded at scale {baseline.get('meta', {}).get('scale')!r}; not comparing", file=sys.stderr)
+            return
+        regressions = compare(results, baseline, args.threshold)
+        for item in regressions:
+            print(
+                f"REGRESSION {item['benchmark']}: {item['baseline_ms']} ms -> {item['current_ms']} ms "
+                f"(x{item['ratio']}, allowed +{item['allowed']:.0%})",
+                file=sys.stderr,
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":  # pragma: no cover - CLI entry point
+    main()
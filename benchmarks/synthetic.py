@@ -0,0 +1,220 @@
+"""Seeded synthetic data for benchmarks: attempts, retailer catalogs and HTML pages.
+
+Everything is derived from one ``random.Random(seed)`` so two runs at the same scale
+produce identical databases and fixtures. Rows are written with Core ``executemany``
+inserts in chunks, which keeps seeding millions of ``CodeAttempt`` rows practical.
+"""
+
+import json
+import random
+import string
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy import insert, select
+
+SCALES = {
+    # Quick enough for CI and for the stored baseline.
+    "smoke": {
+        "domains": 50,
+        "attempts": 50_000,
+        "codes_per_domain": 200,
+        "retailers": 200,
+        "inventory": 200,
+        "html_bytes": 256 * 1024,
+    },
+    # Production-sized: run before merging changes to the hot paths.
+    "full": {
+        "domains": 2_000,
+        "attempts": 2_000_000,
+        "codes_per_domain": 400,
+        "retailers": 2_000,
+        "inventory": 2_000,
+        "html_bytes": 4 * 1024 * 1024,
+    },
+}
+
+CHUNK = 10_000
+WORDS = (
+    "free delivery on orders over today only members save extra off selected lines "
+    "sign up newsletter exclusive student discount voucher checkout basket summer "
+    "winter clearance sale bundle gift card terms apply while stocks last"
+).split()
+
+
+def domain_names(count: int) -> List[str]:
+    return [f"shop{i:05d}.example" for i in range(count)]
+
+
+def code_vocabulary(rng: random.Random, size: int) -> List[str]:
+    alphabet = string.ascii_uppercase + string.digits
+    prefixes = ("SAVE", "WELCOME", "SPRING", "EXTRA", "VIP", "FREESHIP", "TAKE")
+    codes = set()
+    while len(codes) < size:
+        if rng.random() < 0.6:
+            codes.add(f"{rng.choice(prefixes)}{rng.randrange(5, 75)}")
+        else:
+            codes.add("".join(rng.choice(alphabet) for _ in range(rng.randrange(6, 11))))
+    return sorted(codes)
+
+
+def domain_weights(count: int) -> List[float]:
+    # Zipf-like: a handful of retailers get most of the traffic, like production.
+    return [1.0 / (rank + 1) for rank in range(count)]
+
+
+def hot_domain(count: int) -> str:
+    return domain_names(count)[0]
+
+
+def seed_attempts(engine, *, domains: int, attempts: int, codes_per_domain: int, seed: int) -> None:
+    from models import CodeAttempt
+
+    rng = random.Random(seed)
+    names = domain_names(domains)
+    weights = domain_weights(domains)
+    vocab = {name: code_vocabulary(rng, codes_per_domain) for name in names}
+    now = datetime.utcnow()
+    table = CodeAttempt.__table__
+    written = 0
+    with engine.begin() as conn:
+        while written < attempts:
+            batch = []
+            for domain in rng.choices(names, weights=weights, k=min(CHUNK, attempts - written)):
+                codes = vocab[domain]
+                # Earlier codes in the vocabulary are tried (and work) more often.
+                code = codes[min(len(codes) - 1, int(rng.expovariate(8.0 / len(codes))))]
+                before = round(rng.uniform(15, 250), 2)
+                success = rng.random() < 0.35
+                saved = round(before * rng.uniform(0.05, 0.3), 2) if success else 0.0
+                batch.append(
+                    {
+                        "domain": domain,
+                        "code": code,
+                        "success": success,
+                        "saved": saved,
+                        "before_total": before,
+                        "after_total": round(before - saved, 2),
+                        "created_at": now - timedelta(seconds=rng.randrange(120 * 86400)),
+                    }
+                )
+            conn.execute(insert(table), batch)
+            written += len(batch)
+
+
+def retailer_payload(rng: random.Random, domain: str, inventory: int) -> Dict:
+    """One catalog entry in the shape ``upsert_retailer_profile`` accepts."""
+    now = datetime.utcnow()
+    return {
+        "domain": domain,
+        "name": domain.split(".")[0].title(),
+        "platform": "generic",
+        "checkoutHints": ["checkout", "basket"],
+        "scrape": {"paths": ["/", "/sale", "/offers", "/promo"]},
+        "inventory": [
+            {
+                "code": code,
+                "source": rng.choice(("catalog", "affiliate", "scrape")),
+                "tags": rng.sample(WORDS, 2),
+                "metadata": {"min_spend": rng.choice((0, 20, 50)), "percent": rng.randrange(5, 40)},
+                "expires_at": (now + timedelta(days=rng.randrange(-10, 90))).isoformat(),
+            }
+            for code in code_vocabulary(rng, inventory)
+        ],
+    }
+
+
+def seed_catalog(engine, *, retailers: int, inventory: int, seed: int) -> None:
+    from models import RetailerInventory, RetailerProfile
+
+    rng = random.Random(seed + 1)
+    names = domain_names(retailers)
+    now = datetime.utcnow()
+    profiles = RetailerProfile.__table__
+    with engine.begin() as conn:
+        for start in range(0, len(names), CHUNK):
+            conn.execute(
+                insert(profiles),
+                [
+                    {
+                        "domain": name,
+                        "retailer_name": name.split(".")[0].title(),
+                        "active": True,
+                        "selectors": "{}",
+                        "heuristics": "{}",
+                        "metadata": json.dumps({"aliases": [name], "platform": "generic"}),
+                        "last_synced": now,
+                    }
+                    for name in names[start:start + CHUNK]
+                ],
+            )
+        ids = dict(conn.execute(select(profiles.c.domain, profiles.c.id)).all())
+        batch = []
+        for name in names:
+            for item in retailer_payload(rng, name, inventory)["inventory"]:
+                batch.append(
+                    {
+                        "retailer_id": ids[name],
+                        "code": item["code"],
+                        "source": item["source"],
+                        "tags": json.dumps(item["tags"]),
+                        "attributes": json.dumps(item["metadata"]),
+                        "first_seen": now,
+                        "last_seen": now - timedelta(seconds=rng.randrange(30 * 86400)),
+                        "expires_at": datetime.fromisoformat(item["expires_at"]),
+                    }
+                )
+                if len(batch) >= CHUNK:
+                    conn.execute(insert(RetailerInventory.__table__), batch)
+                    batch = []
+        if batch:
+            conn.execute(insert(RetailerInventory.__table__), batch)
+
+
+def seed_codes(engine, *, domains: int, seed: int, per_domain: int = 10) -> None:
+    from models import CodeSeed
+
+    rng = random.Random(seed + 2)
+    rows = [
+        {"domain": name, "code": code, "source": "seed"}
+        for name in domain_names(domains)
+        for code in rng.sample(code_vocabulary(rng, per_domain * 3), per_domain)
+    ]
+    with engine.begin() as conn:
+        for start in range(0, len(rows), CHUNK):
+            conn.execute(insert(CodeSeed.__table__), rows[start:start + CHUNK])
+
+
+def html_page(size_bytes: int, seed: int, codes: int = 40) -> Tuple[str, List[str]]:
+    """A retailer-like page of roughly ``size_bytes`` with ``codes`` promo codes mentioned."""
+    rng = random.Random(seed + 3)
+    promo = code_vocabulary(rng, codes)
+    parts = ["<html><head><title>Offers</title></head><body><nav>Home Sale Offers</nav>"]
+    size = sum(len(p) for p in parts)
+    while size < size_bytes:
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randrange(8, 30)))
+        if rng.random() < 0.15:
+            chunk = f"<div class='promo'><h3>Use code {rng.choice(promo)}</h3><p>{words}</p></div>"
+        else:
+            chunk = f"<p class='copy'>{words}</p>"
+        parts.append(chunk)
+        size += len(chunk)
+    parts.append("</body></html>")
+    return "".join(parts), promo
+
+
+def build_database(engine, scale: Dict, seed: int) -> None:
+    """Create the schema and seed attempts, catalog and seed codes for ``scale``."""
+    import models  # noqa: F401 - registers the tables on Base
+    from db import Base
+
+    Base.metadata.create_all(bind=engine)
+    seed_attempts(
+        engine,
+        domains=scale["domains"],
+        attempts=scale["attempts"],
+        codes_per_domain=scale["codes_per_domain"],
+        seed=seed,
+    )
+    seed_catalog(engine, retailers=scale["retailers"], inventory=scale["inventory"], seed=seed)
+    seed_codes(engine, domains=scale["domains"], seed=seed)
@@ -1,14 +1,46 @@
+import base64
 import json
-from datetime import datetime
-from typing import Any, Dict, Iterable, List, Optional
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
+from sqlalchemy import and_, delete, func, or_, select, union, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from models import RetailerProfile, RetailerInventory
-
-
-def normalize_domain(domain: str) -> str:
-    return (domain or "").strip().lower().replace("https://", "").replace("http://", "").replace("www.", "")
+from domains import canonical_domain, clean_domain
+from metrics import counter, histogram
+from models import CatalogState, CatalogTombstone, RetailerProfile, RetailerInventory, SuggestionSet
+
+# Expired codes stay in the table (but are never served) for this long before the sweeper
+# deletes them, so a late catalog sync that still lists a code does not churn first_seen.
+SWEEP_GRACE_SECONDS = int(os.getenv("INVENTORY_SWEEP_GRACE_SECONDS", "86400"))
+SWEEP_BATCH = int(os.getenv("INVENTORY_SWEEP_BATCH", "500"))
+SWEEP_INTERVAL_SECONDS = float(os.getenv("INVENTORY_SWEEP_INTERVAL_SECONDS", "900"))
+# Clients whose last sync predates pruned tombstones are told to resync from /adapters.
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("CATALOG_TOMBSTONE_RETENTION_DAYS", "30"))
+CHANGES_MAX_VERSIONS = int(os.getenv("CATALOG_CHANGES_MAX_VERSIONS", "500"))
+
+CATALOG_BUNDLE_SECONDS = histogram(
+    "disco_catalog_bundle_seconds",
+    "Time spent loading a retailer profile plus inventory bundle.",
+)
+INVENTORY_SWEPT_ROWS = counter(
+    "disco_inventory_swept_rows_total",
+    "Expired retailer inventory rows deleted by the sweeper.",
+)
+INVENTORY_SWEEP_SECONDS = histogram(
+    "disco_inventory_sweep_seconds",
+    "Duration of one expired-inventory sweep.",
+)
+INVENTORY_SWEEP_FAILURES = counter(
+    "disco_inventory_sweep_failures_total",
+    "Background inventory sweeps that raised.",
+)
+
+_sweeper: Optional[threading.Thread] = None
+_sweeper_lock = threading.Lock()
 
 
 def _loads(text: Optional[str], fallback):
@@ -54,9 +86,43 @@ def _coerce_datetime(value: Any) -> Optional[datetime]:
     return None
 
 
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _catalog_state(db: Session, lock: bool = False) -> CatalogState:
+    stmt = select(CatalogState).where(CatalogState.id == 1)
+    state = db.execute(stmt.with_for_update() if lock else stmt).scalars().first()
+    if state is None:
+        state = CatalogState(id=1, version=0, pruned_through=0)
+        db.add(state)
+        db.flush()
+    return state
+
+
+def current_catalog_version(db: Session) -> int:
+    state = db.execute(select(CatalogState.version).where(CatalogState.id == 1)).scalar()
+    return int(state or 0)
+
+
+def next_catalog_version(db: Session) -> int:
+    """Allocate the next catalog version inside the caller's transaction.
+
+    The counter row stays locked until that transaction commits, so versions become
+    visible in order and a client that has seen version N never misses a change <= N.
+    """
+    state = _catalog_state(db, lock=True)
+    state.version = (state.version or 0) + 1
+    db.flush()
+    return state.version
+
+
 def upsert_retailer_profile(db: Session, payload: Dict[str, Any]) -> RetailerProfile:
     domains = payload.get("domains") or [payload.get("domain")]
-    domains = [normalize_domain(d) for d in domains if d]
+    # Stored as given (cleaned), not alias-resolved: the catalog is what defines the aliases.
+    domains = [clean_domain(d) for d in domains if d]
     if not domains:
         raise ValueError("retailer payload missing domain")
     canonical = domains[0]
@@ -66,9 +132,19 @@ def upsert_retailer_profile(db: Session, payload: Dict[str, Any]) -> RetailerPro
         .filter(RetailerProfile.domain == canonical)
         .first()
     )
+    version: Optional[int] = None
+
+    def changed() -> int:
+        # One version per upsert, allocated only when something actually changed.
+        nonlocal version
+        if version is None:
+            version = next_catalog_version(db)
+        return version
+
     if not profile:
         profile = RetailerProfile(domain=canonical, retailer_name=payload.get("name") or canonical)
         db.add(profile)
+    before = (profile.retailer_name, profile.active, profile.selectors, profile.heuristics, profile.meta_json)
 
     profile.retailer_name = payload.get("name") or profile.retailer_name
     profile.active = bool(payload.get("active", True))
@@ -84,8 +160,10 @@ def upsert_retailer_profile(db: Session, payload: Dict[str, Any]) -> RetailerPro
 
     profile.selectors = _dumps(selectors)
     profile.heuristics = _dumps(heuristics)
-    profile.metadata = _dumps(metadata)
+    profile.meta_json = _dumps(metadata)
     profile.last_synced = datetime.utcnow()
+    if profile.version is None or before != (profile.retailer_name, profile.active, profile.selectors, profile.heuristics, profile.meta_json):
+        profile.version = changed()
 
     existing = {inv.code.upper(): inv for inv in profile.inventory}
     seen_codes = set()
@@ -103,11 +181,14 @@ def upsert_retailer_profile(db: Session, payload: Dict[str, Any]) -> RetailerPro
         source = item.get("source") or "catalog"
         expires = _coerce_datetime(item.get("expires_at") or item.get("expiresAt"))
         if record:
+            before = (record.source, record.tags, record.attributes, _naive_utc(record.expires_at))
             record.source = source
             record.tags = _dumps(tags)
             record.attributes = _dumps(attributes)
             record.last_seen = now
             record.expires_at = expires
+            if before != (record.source, record.tags, record.attributes, _naive_utc(expires)):
+                record.version = changed()
         else:
             db.add(
                 RetailerInventory(
@@ -119,11 +200,13 @@ def upsert_retailer_profile(db: Session, payload: Dict[str, Any]) -> RetailerPro
                     first_seen=now,
                     last_seen=now,
                     expires_at=expires,
+                    version=changed(),
                 )
             )
 
     for code, record in list(existing.items()):
         if code not in seen_codes:
+            db.add(CatalogTombstone(domain=canonical, code=record.code, version=changed()))
             db.delete(record)
 
     return profile
@@ -138,22 +221,35 @@ def ingest_catalog_entries(db: Session, entries: Iterable[Dict[str, Any]], drop_
         count += 1
         if count % 100 == 0:
             db.flush()
+    if seen:
+        # Materialized /suggest results embed catalog inventory; have them recomputed.
+        db.execute(update(SuggestionSet).where(SuggestionSet.domain.in_(seen)).values(stale=True))
     db.commit()
     if drop_missing and seen:
-        (
-            db.query(RetailerProfile)
-            .filter(~RetailerProfile.domain.in_(seen))
-            .update({"active": False}, synchronize_session=False)
-        )
+        deactivate_missing_retailers(db, seen)
         db.commit()
     return count
 
 
+def deactivate_missing_retailers(db: Session, keep: Iterable[str]) -> int:
+    """Deactivate active retailers not in ``keep`` under one new catalog version."""
+    query = db.query(RetailerProfile).filter(~RetailerProfile.domain.in_(set(keep)), RetailerProfile.active == True)
+    if not db.query(query.exists()).scalar():
+        return 0
+    return query.update({"active": False, "version": next_catalog_version(db)}, synchronize_session=False)
+
+
+def _unexpired(now: Optional[datetime] = None):
+    """Inventory rows with no expiry or one still in the future."""
+    now = now or datetime.utcnow()
+    return or_(RetailerInventory.expires_at.is_(None), RetailerInventory.expires_at > now)
+
+
 def list_supported_domains(db: Session) -> List[Dict[str, Any]]:
     rows = db.query(RetailerProfile).filter(RetailerProfile.active == True).all()
     result: List[Dict[str, Any]] = []
     for row in rows:
-        metadata = _loads(row.metadata, {})
+        metadata = _loads(row.meta_json, {})
         entry = {
             "domain": row.domain,
             "name": row.retailer_name,
@@ -166,7 +262,7 @@ def list_supported_domains(db: Session) -> List[Dict[str, Any]]:
         }
         entry["inventory_count"] = (
             db.query(RetailerInventory)
-            .filter(RetailerInventory.retailer_id == row.id)
+            .filter(RetailerInventory.retailer_id == row.id, _unexpired())
             .count()
         )
         result.append(entry)
@@ -174,7 +270,12 @@ def list_supported_domains(db: Session) -> List[Dict[str, Any]]:
 
 
 def get_retailer_bundle(db: Session, domain: str) -> Optional[Dict[str, Any]]:
-    dom = normalize_domain(domain)
+    with CATALOG_BUNDLE_SECONDS.time():
+        return _load_bundle(db, domain)
+
+
+def _load_bundle(db: Session, domain: str) -> Optional[Dict[str, Any]]:
+    dom = canonical_domain(domain)
     if not dom:
         return None
     profile = (
@@ -184,15 +285,47 @@ def get_retailer_bundle(db: Session, domain: str) -> Optional[Dict[str, Any]]:
     )
     if not profile:
         return None
-    metadata = _loads(profile.metadata, {})
-    selectors = _loads(profile.selectors, {})
-    heuristics = _loads(profile.heuristics, {})
     inventory_rows = (
         db.query(RetailerInventory)
-        .filter(RetailerInventory.retailer_id == profile.id)
+        .filter(RetailerInventory.retailer_id == profile.id, _unexpired())
         .order_by(RetailerInventory.last_seen.desc())
         .all()
     )
+    return _bundle_from_rows(profile, inventory_rows)
+
+
+async def get_retailer_bundle_async(db: AsyncSession, domain: str) -> Optional[Dict[str, Any]]:
+    with CATALOG_BUNDLE_SECONDS.time():
+        return await _load_bundle_async(db, domain)
+
+
+async def _load_bundle_async(db: AsyncSession, domain: str) -> Optional[Dict[str, Any]]:
+    dom = canonical_domain(domain)
+    if not dom:
+        return None
+    profile = (
+        await db.execute(
+            select(RetailerProfile)
+            .where(RetailerProfile.domain == dom, RetailerProfile.active == True)
+            .limit(1)
+        )
+    ).scalars().first()
+    if not profile:
+        return None
+    inventory_rows = (
+        await db.execute(
+            select(RetailerInventory)
+            .where(RetailerInventory.retailer_id == profile.id, _unexpired())
+            .order_by(RetailerInventory.last_seen.desc())
+        )
+    ).scalars().all()
+    return _bundle_from_rows(profile, inventory_rows)
+
+
+def _bundle_from_rows(profile: RetailerProfile, inventory_rows: Iterable[RetailerInventory]) -> Dict[str, Any]:
+    metadata = _loads(profile.meta_json, {})
+    selectors = _loads(profile.selectors, {})
+    heuristics = _loads(profile.heuristics, {})
     inventory: List[Dict[str, Any]] = []
     for row in inventory_rows:
         inventory.append(
@@ -222,8 +355,126 @@ def get_retailer_bundle(db: Session, domain: str) -> Optional[Dict[str, Any]]:
     }
 
 
+INVENTORY_COLUMNS = ("code", "source", "tags", "attributes", "first_seen", "last_seen", "expires_at")
+
+
+def encode_inventory_cursor(last_seen: Optional[datetime], row_id: int) -> str:
+    raw = f"{last_seen.isoformat() if last_seen else ''}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_inventory_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """Inverse of ``encode_inventory_cursor``; raises ValueError for anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        seen, row_id = raw.rsplit("|", 1)
+        return (datetime.fromisoformat(seen) if seen else None), int(row_id)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("invalid inventory cursor") from exc
+
+
+def _active_profile_query(dom: str):
+    return select(RetailerProfile).where(RetailerProfile.domain == dom, RetailerProfile.active == True).limit(1)
+
+
+def _inventory_page_query(profile_id: int, columns: Sequence[str], after: Optional[Tuple[Optional[datetime], int]], limit: Optional[int]):
+    """Unexpired inventory newest-first on (last_seen, id), starting after the ``after`` key.
+
+    Only ``columns`` are selected, so unrequested tags/attributes blobs are never read.
+    """
+    inv = RetailerInventory
+    stmt = select(inv.id, inv.last_seen, *(getattr(inv, c) for c in columns if c != "last_seen"))
+    stmt = stmt.where(inv.retailer_id == profile_id, _unexpired())
+    if after is not None:
+        seen, row_id = after
+        if seen is None:
+            stmt = stmt.where(inv.last_seen.is_(None), inv.id < row_id)
+        else:
+            stmt = stmt.where(
+                or_(inv.last_seen < seen, and_(inv.last_seen == seen, inv.id < row_id), inv.last_seen.is_(None))
+            )
+    stmt = stmt.order_by(inv.last_seen.desc().nulls_last(), inv.id.desc())
+    if limit is not None:
+        stmt = stmt.limit(limit + 1)
+    return stmt
+
+
+def _inventory_count_query(profile_id: int):
+    return select(func.count()).select_from(RetailerInventory).where(
+        RetailerInventory.retailer_id == profile_id, _unexpired()
+    )
+
+
+def get_retailer_page(
+    db: Session,
+    domain: str,
+    columns: Sequence[str] = INVENTORY_COLUMNS,
+    after: Optional[Tuple[Optional[datetime], int]] = None,
+    limit: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
+    """A bundle holding one page of inventory (``limit`` rows after ``after``; all rows without
+    ``limit``) restricted to ``columns``, plus ``next_cursor`` when more rows follow."""
+    with CATALOG_BUNDLE_SECONDS.time():
+        dom = canonical_domain(domain)
+        profile = db.execute(_active_profile_query(dom)).scalars().first() if dom else None
+        if not profile:
+            return None
+        rows = db.execute(_inventory_page_query(profile.id, columns, after, limit)).all()
+        total = db.execute(_inventory_count_query(profile.id)).scalar_one() if limit is not None or after else None
+        return _page_from_rows(profile, rows, columns, limit, total)
+
+
+async def get_retailer_page_async(
+    db: AsyncSession,
+    domain: str,
+    columns: Sequence[str] = INVENTORY_COLUMNS,
+    after: Optional[Tuple[Optional[datetime], int]] = None,
+    limit: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
+    with CATALOG_BUNDLE_SECONDS.time():
+        dom = canonical_domain(domain)
+        profile = (await db.execute(_active_profile_query(dom))).scalars().first() if dom else None
+        if not profile:
+            return None
+        rows = (await db.execute(_inventory_page_query(profile.id, columns, after, limit))).all()
+        total = (await db.execute(_inventory_count_query(profile.id))).scalar_one() if limit is not None or after else None
+        return _page_from_rows(profile, rows, columns, limit, total)
+
+
+def _page_from_rows(profile: RetailerProfile, rows, columns: Sequence[str], limit: Optional[int], total: Optional[int]) -> Dict[str, Any]:
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_inventory_cursor(rows[-1].last_seen, rows[-1].id)
+    inventory: List[Dict[str, Any]] = []
+    for row in rows:
+        entry = {}
+        for column in columns:
+            value = getattr(row, column)
+            if column == "tags":
+                value = _loads(value, [])
+            elif column == "attributes":
+                value = _loads(value, {})
+            elif column == "source":
+                value = value or "catalog"
+            entry[column] = value
+        inventory.append(entry)
+    bundle = _bundle_from_rows(profile, ())
+    bundle["inventory"] = inventory
+    bundle["inventory_count"] = len(inventory) if total is None else total
+    bundle["next_cursor"] = next_cursor
+    return bundle
+
+
 def get_retailer_overrides(db: Session, domain: str) -> Dict[str, Any]:
-    bundle = get_retailer_bundle(db, domain)
+    return _overrides_from_bundle(get_retailer_bundle(db, domain))
+
+
+async def get_retailer_overrides_async(db: AsyncSession, domain: str) -> Dict[str, Any]:
+    return _overrides_from_bundle(await get_retailer_bundle_async(db, domain))
+
+
+def _overrides_from_bundle(bundle: Optional[Dict[str, Any]]) -> Dict[str, Any]:
     if not bundle:
         return {}
     return {
@@ -235,7 +486,14 @@ def get_retailer_overrides(db: Session, domain: str) -> Dict[str, Any]:
 
 
 def get_retailer_inventory(db: Session, domain: str, limit: int = 50) -> List[Dict[str, Any]]:
-    bundle = get_retailer_bundle(db, domain)
+    return _inventory_from_bundle(get_retailer_bundle(db, domain), limit)
+
+
+async def get_retailer_inventory_async(db: AsyncSession, domain: str, limit: int = 50) -> List[Dict[str, Any]]:
+    return _inventory_from_bundle(await get_retailer_bundle_async(db, domain), limit)
+
+
+def _inventory_from_bundle(bundle: Optional[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
     if not bundle:
         return []
     inventory: List[Dict[str, Any]] = []
@@ -256,8 +514,201 @@ def get_retailer_inventory(db: Session, domain: str, limit: int = 50) -> List[Di
     return inventory
 
 
+def sweep_expired_inventory(db: Session, grace_seconds: int = SWEEP_GRACE_SECONDS, batch_size: int = SWEEP_BATCH) -> int:
+    """Delete inventory that expired more than ``grace_seconds`` ago, ``batch_size`` rows per commit.
+
+    Serving already skips expired rows; sweeping keeps the table and bundles from growing
+    without bound. Each batch is one catalog version: swept codes get tombstones and their
+    retailers are bumped, so ``/catalog/changes`` clients drop them too. Suggestion sets for
+    the affected retailers are marked stale.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=max(0, grace_seconds))
+    swept = 0
+    with INVENTORY_SWEEP_SECONDS.time():
+        while True:
+            rows = db.execute(
+                select(RetailerInventory.id, RetailerInventory.retailer_id, RetailerInventory.code)
+                .where(RetailerInventory.expires_at < cutoff)
+                .order_by(RetailerInventory.expires_at)
+                .limit(max(1, batch_size))
+            ).all()
+            if not rows:
+                break
+            retailer_ids = {row.retailer_id for row in rows}
+            domains = dict(
+                db.execute(select(RetailerProfile.id, RetailerProfile.domain).where(RetailerProfile.id.in_(retailer_ids))).all()
+            )
+            version = next_catalog_version(db)
+            db.add_all(
+                CatalogTombstone(domain=domains[row.retailer_id], code=row.code, version=version)
+                for row in rows
+                if row.retailer_id in domains
+            )
+            db.execute(
+                update(RetailerProfile)
+                .where(RetailerProfile.id.in_(retailer_ids))
+                .values(version=version)
+                .execution_options(synchronize_session=False)
+            )
+            db.execute(
+                delete(RetailerInventory)
+                .where(RetailerInventory.id.in_([row.id for row in rows]))
+                .execution_options(synchronize_session=False)
+            )
+            if domains:
+                db.execute(update(SuggestionSet).where(SuggestionSet.domain.in_(list(domains.values()))).values(stale=True))
+            db.commit()
+            swept += len(rows)
+            INVENTORY_SWEPT_ROWS.inc(len(rows))
+            if len(rows) < batch_size:
+                break
+    return swept
+
+
+def start_inventory_sweeper(session_factory, interval: float = SWEEP_INTERVAL_SECONDS) -> bool:
+    """Run ``sweep_expired_inventory`` every ``interval`` seconds on a daemon thread (0 disables)."""
+    global _sweeper
+    if interval <= 0:
+        return False
+    with _sweeper_lock:
+        if _sweeper is not None:
+            return False
+        _sweeper = threading.Thread(
+            target=_sweep_loop, args=(session_factory, interval), name="inventory-sweeper", daemon=True
+        )
+        _sweeper.start()
+    return True
+
+
+def _sweep_loop(session_factory, interval: float) -> None:
+    stop = threading.Event()
+    while not stop.wait(interval):
+        db = session_factory()
+        try:
+            sweep_expired_inventory(db)
+            prune_catalog_tombstones(db)
+        except Exception:
+            db.rollback()
+            INVENTORY_SWEEP_FAILURES.inc()
+        finally:
+            db.close()
+
+
+def prune_catalog_tombstones(db: Session, retention_days: int = TOMBSTONE_RETENTION_DAYS) -> int:
+    """Drop tombstones older than ``retention_days`` and raise ``pruned_through`` past them."""
+    cutoff = datetime.utcnow() - timedelta(days=max(0, retention_days))
+    highest = db.execute(select(func.max(CatalogTombstone.version)).where(CatalogTombstone.created_at < cutoff)).scalar()
+    if highest is None:
+        return 0
+    state = _catalog_state(db, lock=True)
+    state.pruned_through = max(state.pruned_through or 0, highest)
+    removed = db.execute(delete(CatalogTombstone).where(CatalogTombstone.version <= highest)).rowcount
+    db.commit()
+    return removed
+
+
+def _retailer_change(profile: RetailerProfile, inventory_count: int) -> Dict[str, Any]:
+    # Same shape as a build_adapter_snapshot retailer, so clients can merge it in place.
+    metadata = _loads(profile.meta_json, {})
+    return {
+        "domain": profile.domain,
+        "name": profile.retailer_name,
+        "domains": metadata.get("aliases") or [profile.domain],
+        "platform": metadata.get("platform", "generic"),
+        "checkoutHints": metadata.get("checkout_hints", []),
+        "regions": metadata.get("regions", []),
+        "inventory": inventory_count,
+        "lastSynced": profile.last_synced.isoformat() if profile.last_synced else None,
+        "scrape": metadata.get("scrape", {}),
+        "active": bool(profile.active),
+        "version": profile.version,
+    }
+
+
+def catalog_changes(db: Session, since: int, max_versions: int = CHANGES_MAX_VERSIONS) -> Dict[str, Any]:
+    """Retailers, inventory rows and removals with a catalog version above ``since``.
+
+    At most ``max_versions`` versions are returned, always whole versions; ``version`` is
+    what the client should send as ``since`` next and ``has_more`` says whether to ask
+    again right away. ``reset`` means the client is too far behind (or ahead) for a
+    delta and must reload ``/adapters``.
+    """
+    state = db.execute(select(CatalogState).where(CatalogState.id == 1)).scalars().first()
+    current = state.version if state else 0
+    pruned = state.pruned_through if state else 0
+    result: Dict[str, Any] = {"version": current, "reset": False, "has_more": False, "retailers": [], "inventory": [], "removed": []}
+    if since < pruned or since > current:
+        result["reset"] = True
+        return result
+
+    changed = union(
+        select(RetailerProfile.version.label("version")).where(RetailerProfile.version > since),
+        select(RetailerInventory.version).where(RetailerInventory.version > since),
+        select(CatalogTombstone.version).where(CatalogTombstone.version > since),
+    ).subquery()
+    versions = db.execute(
+        select(changed.c.version).where(changed.c.version <= current).order_by(changed.c.version).limit(max_versions + 1)
+    ).scalars().all()
+    if not versions:
+        return result
+    upto = current
+    if len(versions) > max_versions:
+        upto = versions[max_versions - 1]
+        result["has_more"] = True
+    result["version"] = upto
+
+    profiles = db.execute(
+        select(RetailerProfile)
+        .where(RetailerProfile.version > since, RetailerProfile.version <= upto)
+        .order_by(RetailerProfile.version)
+    ).scalars().all()
+    counts = dict(
+        db.execute(
+            select(RetailerInventory.retailer_id, func.count())
+            .where(RetailerInventory.retailer_id.in_([p.id for p in profiles]), _unexpired())
+            .group_by(RetailerInventory.retailer_id)
+        ).all()
+    ) if profiles else {}
+    result["retailers"] = [_retailer_change(p, counts.get(p.id, 0)) for p in profiles]
+
+    rows = db.execute(
+        select(RetailerInventory, RetailerProfile.domain)
+        .join(RetailerProfile, RetailerProfile.id == RetailerInventory.retailer_id)
+        .where(RetailerInventory.version > since, RetailerInventory.version <= upto)
+        .order_by(RetailerInventory.version, RetailerInventory.id)
+    ).all()
+    present = set()
+    for row, domain in rows:
+        present.add((domain, row.code))
+        result["inventory"].append(
+            {
+                "domain": domain,
+                "code": row.code,
+                "source": row.source or "catalog",
+                "tags": _loads(row.tags, []),
+                "attributes": _loads(row.attributes, {}),
+                "expires_at": row.expires_at.isoformat() if row.expires_at else None,
+                "version": row.version,
+            }
+        )
+    tombstones = db.execute(
+        select(CatalogTombstone)
+        .where(CatalogTombstone.version > since, CatalogTombstone.version <= upto)
+        .order_by(CatalogTombstone.version)
+    ).scalars().all()
+    # A code removed and re-added within the window only needs its re-added row.
+    result["removed"] = [
+        {"domain": t.domain, "code": t.code, "version": t.version}
+        for t in tombstones
+        if (t.domain, t.code) not in present
+    ]
+    return result
+
+
 def build_adapter_snapshot(db: Session, base_adapters: Dict[str, Any]) -> Dict[str, Any]:
     snapshot = {
+        # Read first: changes racing this snapshot are replayed by the next /catalog/changes call.
+        "version": current_catalog_version(db),
         "platforms": base_adapters.get("platforms", {}),
         "retailers": [],
     }
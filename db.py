@@ -1,15 +1,112 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./disco.db")
+# Optional replica for read-only traffic (catalog, ranking stats); defaults to the primary.
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL") or None
+
+# Server databases: connection pool per engine (and per process).
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+
+# SQLite: WAL lets readers run alongside the writer; synchronous=NORMAL is durable across
+# application crashes in WAL mode and only risks the last commits on power loss. Reads get
+# their own query_only pool and /event and /seed writes share one dedicated writer connection,
+# so they queue in the pool instead of spinning in SQLite's busy handler. Longer writers (scrape
+# cache, catalog ingest, sweeper, suggestion sets, job queue) stay on SessionLocal and rely on
+# busy_timeout, so a slow one never blocks event ingestion behind the single writer.
+SQLITE_TUNED = os.getenv("SQLITE_TUNED", "true").strip().lower() not in ("0", "false", "no", "off")
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # negative: KiB, so 64 MB
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_WRITER_CONNECTIONS = int(os.getenv("SQLITE_WRITER_CONNECTIONS", "1"))
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_memory(url: str) -> bool:
+    return _is_sqlite(url) and (":memory:" in url or url.rstrip("/").endswith(":") or "mode=memory" in url)
+
+
+def _pool_kwargs(url: str, size: int = POOL_SIZE, overflow: int = MAX_OVERFLOW) -> dict:
+    if _is_memory(url):
+        return {}
+    kwargs = {"pool_size": size, "max_overflow": overflow, "pool_timeout": POOL_TIMEOUT}
+    if not _is_sqlite(url):
+        kwargs["pool_recycle"] = POOL_RECYCLE
+    return kwargs
+
+
+def _sqlite_pragmas(read_only: bool = False):
+    statements = [
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size={SQLITE_CACHE_SIZE}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if read_only:
+        statements.append("PRAGMA query_only=ON")
+
+    def apply(dbapi_connection, _record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    return apply
+
+
+def _tune(engine, url: str, read_only: bool = False):
+    if SQLITE_TUNED and _is_sqlite(url) and not _is_memory(url):
+        event.listen(engine, "connect", _sqlite_pragmas(read_only))
+    return engine
+
+
+def _build_engine(url: str, read_only: bool = False, **pool):
+    return _tune(
+        create_engine(
+            url,
+            connect_args={"check_same_thread": False} if _is_sqlite(url) else {},
+            pool_pre_ping=True,
+            **(pool or _pool_kwargs(url)),
+        ),
+        url,
+        read_only,
+    )
+
+
+def build_engines(url: str, read_url: str = None):
+    """(primary, read, write) engines for one database; read and write are the primary unless tuning splits them."""
+    primary = _build_engine(url)
+    split = SQLITE_TUNED and _is_sqlite(url) and not _is_memory(url)
+    if read_url:
+        read = _build_engine(read_url)
+    elif split:
+        read = _build_engine(url, read_only=True)
+    else:
+        read = primary
+    write = _build_engine(url, **_pool_kwargs(url, max(1, SQLITE_WRITER_CONNECTIONS), 0)) if split else primary
+    return primary, read, write
+
+
+engine, read_engine, write_engine = build_engines(DATABASE_URL, READ_DATABASE_URL)
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
-    pool_pre_ping=True,
-)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Read-only work (may hit a replica that lags the primary by a little).
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+# Short, write-only transactions (/event, /seed); never hold one across network I/O.
+WriteSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=write_engine)
 Base = declarative_base()
 
 def get_db():
@@ -18,3 +115,86 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_write_db():
+    db = WriteSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _async_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+ASYNC_READ_DATABASE_URL = os.getenv("ASYNC_READ_DATABASE_URL") or (_async_url(READ_DATABASE_URL) if READ_DATABASE_URL else None)
+# How long after a write a replica may still miss it; reads of a just-written domain go to the primary.
+REPLICA_LAG_SECONDS = float(
+    os.getenv("READ_REPLICA_LAG_SECONDS", "5" if READ_DATABASE_URL or ASYNC_READ_DATABASE_URL else "0")
+)
+
+# Built on first use so the sync service never needs aiosqlite/asyncpg installed.
+_async_engine = None
+_async_sessionmaker = None
+_async_read_sessionmaker = None
+
+def _build_async_engine(url: str, read_only: bool = False):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    # aiosqlite opens a connection per checkout (NullPool), so only server databases get pool sizing.
+    async_engine = create_async_engine(url, pool_pre_ping=True, **({} if _is_sqlite(url) else _pool_kwargs(url)))
+    _tune(async_engine.sync_engine, url, read_only)
+    return async_engine
+
+def build_async_engines(url: str, read_url: str = None):
+    """(primary, read) async engines for one database."""
+    primary = _build_async_engine(url)
+    if read_url:
+        read = _build_async_engine(read_url)
+    elif SQLITE_TUNED and _is_sqlite(url) and not _is_memory(url):
+        read = _build_async_engine(url, read_only=True)
+    else:
+        read = primary
+    return primary, read
+
+def get_async_engine():
+    global _async_engine, _async_sessionmaker, _async_read_sessionmaker
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        _async_engine, read = build_async_engines(ASYNC_DATABASE_URL, ASYNC_READ_DATABASE_URL)
+        _async_sessionmaker = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+        _async_read_sessionmaker = async_sessionmaker(read, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+def AsyncSessionLocal():
+    get_async_engine()
+    return _async_sessionmaker()
+
+def AsyncReadSessionLocal():
+    get_async_engine()
+    return _async_read_sessionmaker()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
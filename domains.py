@@ -0,0 +1,135 @@
+"""One canonical key per retailer domain, shared by stats, caches, seeds and catalog lookups.
+
+``clean_domain`` is the syntactic part: lowercase host with scheme, credentials, port,
+path and a leading ``www.`` removed. ``canonical_domain`` additionally resolves aliases
+and subdomains of known retailers (``asos.co.uk`` or ``m.asos.com`` -> ``asos.com``)
+through an in-memory index built from ``adapters.json`` and ``RetailerProfile`` aliases.
+Both are LRU-memoized; replacing the alias index clears the resolved memo.
+"""
+
+import json
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import RetailerProfile
+
+CACHE_SIZE = int(os.getenv("DOMAIN_CACHE_SIZE", "65536"))
+ALIAS_REFRESH_SECONDS = float(os.getenv("DOMAIN_ALIAS_REFRESH_SECONDS", "300"))
+
+_aliases: Dict[str, str] = {}
+_refresher: Optional[threading.Thread] = None
+_refresher_lock = threading.Lock()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def clean_domain(domain: Optional[str]) -> str:
+    host = (domain or "").strip().lower()
+    if "://" in host:
+        host = host.split("://", 1)[1]
+    for sep in ("/", "?", "#"):
+        host = host.split(sep, 1)[0]
+    host = host.rsplit("@", 1)[-1].split(":", 1)[0].strip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    try:
+        host = host.encode("idna").decode("ascii")
+    except UnicodeError:
+        pass
+    return host
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _resolve(host: str) -> str:
+    aliases = _aliases
+    canonical = aliases.get(host)
+    if canonical:
+        return canonical
+    labels = host.split(".")
+    # Subdomains of a known retailer fold into it; unknown hosts are left alone.
+    for i in range(1, len(labels) - 1):
+        canonical = aliases.get(".".join(labels[i:]))
+        if canonical:
+            return canonical
+    return host
+
+
+def canonical_domain(domain: Optional[str]) -> str:
+    host = clean_domain(domain)
+    return _resolve(host) if host else ""
+
+
+def alias_count() -> int:
+    return len(_aliases)
+
+
+def set_aliases(groups: Iterable[Iterable[str]]) -> int:
+    """Replace the alias index. Each group lists a canonical domain first, then its aliases.
+
+    When two groups claim the same alias the first one wins.
+    """
+    index: Dict[str, str] = {}
+    for group in groups:
+        names = [clean_domain(name) for name in group if name]
+        names = [name for name in names if name]
+        if not names:
+            continue
+        canonical = index.get(names[0], names[0])
+        for name in names:
+            index.setdefault(name, canonical)
+    global _aliases
+    _aliases = index
+    _resolve.cache_clear()
+    return len(index)
+
+
+def _alias_groups(db: Session, adapters: Optional[Dict]):
+    # Catalog profiles first: the synced catalog is authoritative over the bundled adapters.
+    for profile in db.execute(select(RetailerProfile).where(RetailerProfile.active == True)).scalars():
+        try:
+            aliases = json.loads(profile.meta_json or "{}").get("aliases") or []
+        except (ValueError, TypeError, AttributeError):
+            aliases = []
+        yield [profile.domain, *aliases]
+    for retailer in (adapters or {}).get("retailers") or []:
+        if isinstance(retailer, dict):
+            yield retailer.get("domains") or []
+
+
+def refresh_aliases(db: Session, adapters: Optional[Dict] = None) -> int:
+    """Rebuild the alias index from the catalog (and ``adapters`` retailers, if given)."""
+    return set_aliases(list(_alias_groups(db, adapters)))
+
+
+def start_alias_refresher(session_factory, adapters: Optional[Dict] = None, interval: float = ALIAS_REFRESH_SECONDS) -> bool:
+    """Load the alias index now, then reload it every ``interval`` seconds (0: load once)."""
+    global _refresher
+
+    def load() -> None:
+        db = session_factory()
+        try:
+            refresh_aliases(db, adapters)
+        except Exception:
+            db.rollback()
+        finally:
+            db.close()
+
+    load()
+    if interval <= 0:
+        return False
+    with _refresher_lock:
+        if _refresher is not None:
+            return False
+
+        def loop() -> None:
+            stop = threading.Event()
+            while not stop.wait(interval):
+                load()
+
+        _refresher = threading.Thread(target=loop, name="domain-alias-refresher", daemon=True)
+        _refresher.start()
+    return True
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, UniqueConstraint, Index, Text, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, Float, DateTime, Boolean, UniqueConstraint, Index, Text, ForeignKey
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from db import Base
@@ -24,7 +24,13 @@ class CodeAttempt(Base):
     user_agent = Column(String, nullable=True)
     anon_id = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    __table_args__ = (Index("ix_attempt_domain_code_time", "domain", "code", "created_at"),)
+    # Client-supplied or derived (see telemetry.event_idempotency_key); unique so retries land once.
+    idempotency_key = Column(String(64), nullable=True)
+    __table_args__ = (
+        Index("ix_attempt_domain_code_time", "domain", "code", "created_at"),
+        Index("ix_attempt_created_id", "created_at", "id"),
+        Index("ux_attempt_idempotency_key", "idempotency_key", unique=True),
+    )
 
 class ScrapeCache(Base):
     __tablename__ = "scrape_cache"
@@ -33,9 +39,33 @@ class ScrapeCache(Base):
     url = Column(String, index=True)
     codes_json = Column(Text)
     fetched_at = Column(DateTime, default=datetime.utcnow)
+    last_attempt_at = Column(DateTime, nullable=True)
+    last_fetch_ok = Column(Boolean, default=True)
+    last_error = Column(String, nullable=True)
+    failure_count = Column(Integer, default=0)
+    etag = Column(String, nullable=True)
+    last_modified = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True)
+    content_length = Column(Integer, nullable=True)
+    # Yield statistics for the scrape path planner: network fetches (including failures),
+    # fetches that produced at least one code, codes produced, and time spent fetching.
+    fetch_count = Column(Integer, default=0)
+    yield_count = Column(Integer, default=0)
+    codes_yielded = Column(Integer, default=0)
+    fetch_ms_total = Column(Float, default=0.0)
     __table_args__ = (UniqueConstraint("domain", "url", name="uq_scrape_domain_url"),)
 
 
+class SuggestionSet(Base):
+    __tablename__ = "suggestion_sets"
+    id = Column(Integer, primary_key=True, index=True)
+    domain = Column(String, unique=True, index=True, nullable=False)
+    ranked_json = Column(Text, default="[]")
+    sources_json = Column(Text, default="{}")
+    computed_at = Column(DateTime, default=datetime.utcnow)
+    stale = Column(Boolean, default=False)
+
+
 class RetailerProfile(Base):
     __tablename__ = "retailer_profiles"
     id = Column(Integer, primary_key=True, index=True)
@@ -44,8 +74,11 @@ class RetailerProfile(Base):
     active = Column(Boolean, default=True)
     selectors = Column(Text, default="{}")
     heuristics = Column(Text, default="{}")
-    metadata = Column(Text, default="{}")
+    # "metadata" is reserved on declarative classes; the column keeps its name.
+    meta_json = Column("metadata", Text, default="{}")
     last_synced = Column(DateTime, nullable=True)
+    # Catalog version of the last content change (see CatalogState).
+    version = Column(BigInteger, default=0, index=True)
     inventory = relationship("RetailerInventory", back_populates="retailer", cascade="all, delete-orphan")
 
 
@@ -60,8 +93,48 @@ class RetailerInventory(Base):
     first_seen = Column(DateTime, default=datetime.utcnow)
     last_seen = Column(DateTime, default=datetime.utcnow)
     expires_at = Column(DateTime, nullable=True)
+    version = Column(BigInteger, default=0, index=True)
     retailer = relationship("RetailerProfile", back_populates="inventory")
     __table_args__ = (
         UniqueConstraint("retailer_id", "code", name="uq_inventory_retailer_code"),
         Index("ix_inventory_retailer_last_seen", "retailer_id", "last_seen"),
+        Index("ix_inventory_retailer_expires", "retailer_id", "expires_at"),
+        Index("ix_inventory_expires", "expires_at"),
     )
+
+
+# Single row (id=1) holding the catalog version counter.
+class CatalogState(Base):
+    __tablename__ = "catalog_state"
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, default=0, nullable=False)
+    # Tombstones at or below this version have been pruned.
+    pruned_through = Column(BigInteger, default=0, nullable=False)
+
+
+# Inventory rows removed from the catalog, kept so delta clients can drop them.
+class CatalogTombstone(Base):
+    __tablename__ = "catalog_tombstones"
+    id = Column(Integer, primary_key=True, index=True)
+    domain = Column(String, nullable=False)
+    code = Column(String, nullable=False)
+    version = Column(BigInteger, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+# One recurring scrape job per domain, claimed by scrape workers under a lease.
+class ScrapeJob(Base):
+    __tablename__ = "scrape_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    domain = Column(String, unique=True, nullable=False)
+    priority = Column(Integer, default=0)
+    interval_seconds = Column(Integer, default=3600)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0)
+    last_run_at = Column(DateTime, nullable=True)
+    last_ok_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    codes_found = Column(Integer, default=0)
+    __table_args__ = (Index("ix_scrape_jobs_due", "run_after", "priority"),)
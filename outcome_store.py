@@ -0,0 +1,241 @@
+"""Columnar (Parquet / Arrow IPC) storage of promo outcome telemetry for training jobs.
+
+Exports are partitioned as ``day=YYYY-MM-DD/domain=<domain>/part-<run>-<n>.<ext>`` and
+are incremental: a watermark file records the last exported (created_at, id) so each
+run only appends rows that arrived since. ``load_partitions`` reads them back straight
+into NumPy arrays for the ranking feature pipeline.
+
+pyarrow and numpy are only needed by this module, so they are imported lazily.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+from sqlalchemy.orm import Session
+
+from telemetry import iter_training_rows
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+WATERMARK_FILE = "_watermark.json"
+# Buffered rows per partition before a file is flushed.
+FLUSH_ROWS = int(os.getenv("OUTCOME_EXPORT_FLUSH_ROWS", "50000"))
+# Buffered rows across all partitions; past it the largest buffer is flushed early.
+BUFFER_ROWS = int(os.getenv("OUTCOME_EXPORT_BUFFER_ROWS", "200000"))
+
+
+def _require_arrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:  # pragma: no cover - depends on the environment
+        raise RuntimeError("columnar export requires pyarrow: pip install pyarrow numpy") from exc
+    return pa, pq
+
+
+def arrow_schema():
+    pa, _ = _require_arrow()
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("code", pa.string()),
+            ("success", pa.bool_()),
+            ("saved", pa.float64()),
+            ("before_total", pa.float64()),
+            ("after_total", pa.float64()),
+            ("created_at", pa.timestamp("us")),
+        ]
+    )
+
+
+def read_watermark(path: Path) -> Optional[Tuple[datetime, int]]:
+    try:
+        data = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return None
+    if not data.get("created_at") or data.get("id") is None:
+        return None
+    return datetime.fromisoformat(data["created_at"]), int(data["id"])
+
+
+def write_watermark(path: Path, created_at: datetime, row_id: int, rows: int) -> None:
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(
+        json.dumps(
+            {
+                "created_at": created_at.isoformat(),
+                "id": row_id,
+                "rows": rows,
+                "updated_at": datetime.utcnow().isoformat(),
+            },
+            sort_keys=True,
+        )
+    )
+    os.replace(tmp, path)
+
+
+class _PartitionWriter:
+    """Buffers rows per (day, domain) partition and writes them out as part files.
+
+    Rows arrive in ascending ``created_at`` order, so when the day changes every earlier
+    day's partitions are complete and are flushed. Together with ``BUFFER_ROWS`` that keeps
+    memory bounded by about one day of rows, however long the export.
+    """
+
+    def __init__(self, root: Path, fmt: str, run_id: str):
+        self.root = root
+        self.fmt = fmt
+        self.run_id = run_id
+        self.buffers: Dict[Tuple[str, str], Dict[str, List[Any]]] = {}
+        self.files: List[str] = []
+        self.rows = 0
+        self.buffered = 0
+        self.day: Optional[str] = None
+
+    def add(self, row: Dict[str, Any]) -> None:
+        key = (row["created_at"][:10], row["domain"])
+        if key[0] != self.day:
+            for done in [k for k in self.buffers if k[0] < key[0]]:
+                self._flush(done)
+            self.day = key[0]
+        buf = self.buffers.get(key)
+        if buf is None:
+            buf = self.buffers[key] = {name: [] for name in ("id", "code", "success", "saved", "before_total", "after_total", "created_at")}
+        for name, values in buf.items():
+            values.append(row[name])
+        self.rows += 1
+        self.buffered += 1
+        if len(buf["id"]) >= FLUSH_ROWS:
+            self._flush(key)
+        elif self.buffered >= BUFFER_ROWS:
+            self._flush(max(self.buffers, key=lambda k: len(self.buffers[k]["id"])))
+
+    def close(self) -> List[str]:
+        for key in list(self.buffers):
+            self._flush(key)
+        return self.files
+
+    def _flush(self, key: Tuple[str, str]) -> None:
+        pa, pq = _require_arrow()
+        buf = self.buffers.pop(key)
+        self.buffered -= len(buf["id"])
+        schema = arrow_schema()
+        arrays = [
+            pa.array(buf[field.name], type=field.type) if field.name != "created_at"
+            else pa.array(buf["created_at"], type=pa.string()).cast(field.type)
+            for field in schema
+        ]
+        table = pa.Table.from_arrays(arrays, schema=schema)
+        day, domain = key
+        directory = self.root / f"day={day}" / f"domain={quote(domain, safe='')}"
+        directory.mkdir(parents=True, exist_ok=True)
+        target = directory / f"part-{self.run_id}-{len(self.files):05d}{FORMATS[self.fmt]}"
+        if self.fmt == "parquet":
+            pq.write_table(table, target, compression="zstd")
+        else:
+            with pa.OSFile(str(target), "wb") as sink:
+                with pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd")) as writer:
+                    writer.write_table(table)
+        self.files.append(str(target))
+
+
+def export_partitions(
+    db: Session,
+    root: str,
+    *,
+    fmt: str = "parquet",
+    domain: Optional[str] = None,
+    days: int = 180,
+    full: bool = False,
+    lag_seconds: int = 60,
+    page_size: int = 5000,
+    watermark_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Append new ``CodeAttempt`` rows to a partitioned columnar dataset.
+
+    Rows newer than ``lag_seconds`` are left for the next run so that slow in-flight
+    inserts with earlier timestamps are not skipped past by the watermark. The watermark
+    covers every domain, so a ``domain`` export must be ``full`` and never moves it.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown columnar format: {fmt}")
+    if domain and not full:
+        raise ValueError("incremental exports cover every domain; pass full=True to export one domain")
+    out = Path(root)
+    out.mkdir(parents=True, exist_ok=True)
+    mark_path = Path(watermark_path) if watermark_path else out / WATERMARK_FILE
+    after = None if full else read_watermark(mark_path)
+    writer = _PartitionWriter(out, fmt, uuid.uuid4().hex[:12])
+    last: Optional[Dict[str, Any]] = None
+    rows = iter_training_rows(
+        db,
+        domain=domain,
+        days=0 if after else days,
+        page_size=page_size,
+        ascending=True,
+        after=after,
+        before=datetime.utcnow() - timedelta(seconds=max(0, lag_seconds)),
+    )
+    for row in rows:
+        writer.add(row)
+        last = row
+    files = writer.close()
+    if last is not None and not domain:
+        write_watermark(mark_path, datetime.fromisoformat(last["created_at"]), int(last["id"]), writer.rows)
+    return {
+        "rows": writer.rows,
+        "files": files,
+        "watermark": {"created_at": last["created_at"], "id": last["id"]} if last else (
+            {"created_at": after[0].isoformat(), "id": after[1]} if after else None
+        ),
+    }
+
+
+def load_partitions(
+    root: str,
+    *,
+    domains: Optional[Sequence[str]] = None,
+    start_day: Optional[str] = None,
+    end_day: Optional[str] = None,
+    columns: Optional[Iterable[str]] = None,
+) -> Dict[str, Any]:
+    """Load exported partitions into a dict of NumPy arrays, one per column.
+
+    ``domain`` and ``day`` come from the partition paths. Nullable float columns use
+    NaN, ``created_at`` is ``datetime64[us]`` and string columns are object arrays.
+    """
+    pa, _ = _require_arrow()
+    import pyarrow.dataset as ds
+
+    paths = sorted(str(p) for ext in FORMATS.values() for p in Path(root).rglob(f"*{ext}"))
+    if not paths:
+        return {}
+    fmt = "parquet" if paths[0].endswith(".parquet") else "ipc"
+    partitioning = ds.partitioning(
+        pa.schema([("day", pa.string()), ("domain", pa.string())]), flavor="hive"
+    )
+    dataset = ds.dataset(paths, format=fmt, partitioning=partitioning, partition_base_dir=str(root))
+    expr = None
+    if domains:
+        expr = ds.field("domain").isin(list(domains))
+    if start_day:
+        clause = ds.field("day") >= start_day
+        expr = clause if expr is None else expr & clause
+    if end_day:
+        clause = ds.field("day") <= end_day
+        expr = clause if expr is None else expr & clause
+    table = dataset.to_table(columns=list(columns) if columns else None, filter=expr)
+    arrays: Dict[str, Any] = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if pa.types.is_boolean(column.type):
+            column = column.fill_null(False)
+        arrays[name] = column.to_numpy(zero_copy_only=False)
+    return arrays
@@ -0,0 +1,249 @@
+"""HTML code extraction, with large documents offloaded to a bounded process pool.
+
+lxml parsing and the token regexes hold the GIL, so one multi-megabyte page parsed in
+a request thread stalls every other request on that worker. Documents above
+``HTML_INLINE_MAX_BYTES`` are parsed in separate processes instead, each job under a
+CPU-time budget, and the number of queued jobs is capped so overload is rejected early.
+
+The CPU timer only fires between bytecodes, so it cannot stop one long lxml or regex
+call. A job still running at ``HTML_PARSE_TIMEOUT_SECONDS`` gets its pool's workers
+killed instead, and the next job starts a fresh pool.
+"""
+
+import multiprocessing
+import os
+import re
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from lxml import html as lh
+
+from metrics import histogram, register_collector
+
+HTML_MAX_BYTES = int(os.getenv("HTML_MAX_BYTES", str(2 * 1024 * 1024)))
+HTML_INLINE_MAX_BYTES = int(os.getenv("HTML_INLINE_MAX_BYTES", str(64 * 1024)))
+PARSE_WORKERS = int(os.getenv("HTML_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+PARSE_MAX_PENDING = int(os.getenv("HTML_PARSE_MAX_PENDING", "32"))
+PARSE_CPU_SECONDS = float(os.getenv("HTML_PARSE_CPU_SECONDS", "2"))
+PARSE_TIMEOUT_SECONDS = float(os.getenv("HTML_PARSE_TIMEOUT_SECONDS", "10"))
+
+
+class PayloadTooLarge(ValueError):
+    pass
+
+
+class ParserBusy(RuntimeError):
+    pass
+
+
+class ParseTimeout(RuntimeError):
+    pass
+
+
+class _CpuBudgetExceeded(BaseException):
+    # BaseException so scrape_from_html's blanket ``except Exception`` cannot swallow it.
+    pass
+
+
+def _extract_tokens(text: str, token_re: str) -> List[str]:
+    tokens = re.findall(token_re, text.upper())
+    uniq = []
+    for t in tokens:
+        tt = t.strip().upper()
+        if tt and tt not in uniq:
+            uniq.append(tt)
+    return uniq
+
+def _filter_tokens(tokens: List[str], stop: List[str]) -> List[str]:
+    stopset = set(stop or [])
+    return [t for t in tokens if t not in stopset]
+
+def scrape_from_html(html: str, token_re: str, keywords: List[str], stop: List[str]) -> List[str]:
+    try:
+        root = lh.fromstring(html)
+        texts = root.xpath("//text()")
+        joined = "\n".join([t.strip() for t in texts if t and t.strip()])
+        toks = _extract_tokens(joined, token_re)
+        upper = joined.upper()
+        near = []
+        for kw in keywords:
+            i = upper.find(kw.upper())
+            while i >= 0:
+                excerpt = upper[max(0, i-160): i+160]
+                near.extend(_extract_tokens(excerpt, token_re))
+                i = upper.find(kw.upper(), i+1)
+        merged = list(dict.fromkeys(near + toks))
+        return _filter_tokens(merged, stop)
+    except Exception:
+        return []
+
+
+def _on_cpu_budget(signum, frame):
+    raise _CpuBudgetExceeded()
+
+
+def _parse_job(html: str, token_re: str, keywords: List[str], stop: List[str], cpu_seconds: float) -> List[str]:
+    # Runs inside a pool process; ITIMER_PROF counts CPU time, not time spent queued.
+    timed = cpu_seconds > 0 and hasattr(signal, "setitimer")
+    if timed:
+        signal.signal(signal.SIGPROF, _on_cpu_budget)
+        signal.setitimer(signal.ITIMER_PROF, cpu_seconds)
+    try:
+        return scrape_from_html(html, token_re, keywords, stop)
+    except _CpuBudgetExceeded:
+        raise ParseTimeout(f"parse exceeded {cpu_seconds}s of CPU")
+    finally:
+        if timed:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_pending = 0
+_counters: Dict[str, int] = {"inline": 0, "offloaded": 0, "rejected": 0, "too_large": 0, "timeouts": 0, "errors": 0}
+
+HTML_PARSE_SECONDS = histogram(
+    "disco_html_parse_seconds",
+    "Wall time to extract codes from one HTML document, parsed inline or in the process pool.",
+    labels=("mode",),
+)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        ctx = multiprocessing.get_context(os.getenv("HTML_PARSE_START_METHOD", "spawn"))
+        _pool = ProcessPoolExecutor(max_workers=max(1, PARSE_WORKERS), mp_context=ctx)
+    return _pool
+
+
+def _recycle(pool: ProcessPoolExecutor) -> None:
+    """Kill ``pool``'s workers; a job past its wall timeout may be stuck where the CPU timer cannot reach."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    # Jobs still queued or running in this pool fail with BrokenProcessPool and yield no codes.
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _job_done(_future) -> None:
+    global _pending
+    with _pool_lock:
+        _pending -= 1
+
+
+def _bump(counter: str) -> None:
+    with _pool_lock:
+        _counters[counter] += 1
+
+
+def html_bytes(html: Optional[str]) -> int:
+    """UTF-8 size of ``html``; ASCII pages, the common case, are measured without encoding."""
+    if not html:
+        return 0
+    return len(html) if html.isascii() else len(html.encode("utf-8"))
+
+
+def extract_codes(
+    html: str,
+    token_re: str,
+    keywords: List[str],
+    stop: List[str],
+    max_bytes: Optional[int] = HTML_MAX_BYTES,
+    reject_when_busy: bool = True,
+) -> List[str]:
+    """Extract candidate codes from ``html``, inline for small documents and in the pool otherwise.
+
+    Raises ``PayloadTooLarge`` above ``max_bytes`` and, when ``reject_when_busy`` is set,
+    ``ParserBusy`` once ``HTML_PARSE_MAX_PENDING`` jobs are queued; otherwise a full queue
+    falls back to parsing inline. A job that runs out of CPU time yields no codes.
+    """
+    global _pool, _pending
+    size = html_bytes(html)
+    if max_bytes is not None and size > max_bytes:
+        _bump("too_large")
+        raise PayloadTooLarge(f"html payload is {size} bytes; limit is {max_bytes}")
+    if size <= HTML_INLINE_MAX_BYTES or PARSE_WORKERS <= 0:
+        _bump("inline")
+        with HTML_PARSE_SECONDS.time(mode="inline"):
+            return scrape_from_html(html, token_re, keywords, stop)
+    with _pool_lock:
+        busy = _pending >= PARSE_MAX_PENDING
+        if busy:
+            _counters["rejected"] += 1
+        else:
+            _pending += 1
+            _counters["offloaded"] += 1
+            pool = _get_pool()
+    if busy:
+        if reject_when_busy:
+            raise ParserBusy("html parser queue is full")
+        with HTML_PARSE_SECONDS.time(mode="inline"):
+            return scrape_from_html(html, token_re, keywords, stop)
+    try:
+        future = pool.submit(_parse_job, html, token_re, keywords, stop, PARSE_CPU_SECONDS)
+    except BrokenProcessPool:
+        # A worker died and took the pool with it; the next job starts a fresh one.
+        _bump("errors")
+        with _pool_lock:
+            _pending -= 1
+            if _pool is pool:
+                _pool = None
+        with HTML_PARSE_SECONDS.time(mode="inline"):
+            return scrape_from_html(html, token_re, keywords, stop)
+    future.add_done_callback(_job_done)
+    try:
+        with HTML_PARSE_SECONDS.time(mode="pool"):
+            return future.result(timeout=PARSE_TIMEOUT_SECONDS)
+    except ParseTimeout:
+        _bump("timeouts")
+        return []
+    except FuturesTimeout:
+        _bump("timeouts")
+        _recycle(pool)
+        return []
+    except BrokenProcessPool:
+        _bump("errors")
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        return []
+
+
+def parse_pool_stats() -> Dict[str, int]:
+    """Queue depth and outcome counters for sizing the parse pool."""
+    with _pool_lock:
+        stats = dict(_counters)
+        stats.update(
+            workers=max(0, PARSE_WORKERS),
+            max_pending=PARSE_MAX_PENDING,
+            pending=_pending,
+            inline_max_bytes=HTML_INLINE_MAX_BYTES,
+            max_bytes=HTML_MAX_BYTES,
+        )
+    return stats
+
+
+def _collect_pool_metrics():
+    stats = parse_pool_stats()
+    yield (
+        "disco_html_parse_jobs_total",
+        "counter",
+        "HTML parse jobs by outcome (inline, offloaded, rejected, too_large, timeouts, errors).",
+        [("disco_html_parse_jobs_total", {"outcome": name}, stats[name]) for name in _counters],
+    )
+    yield (
+        "disco_html_parse_pending",
+        "gauge",
+        "HTML parse jobs queued or running in the process pool.",
+        [("disco_html_parse_pending", {}, stats["pending"])],
+    )
+
+
+register_collector(_collect_pool_metrics)
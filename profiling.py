@@ -0,0 +1,191 @@
+"""Opt-in cProfile capture of individual production requests.
+
+Disabled unless ``REQUEST_PROFILING`` is set, in which case ``ProfilingMiddleware``
+marks a request for profiling when it carries ``X-Disco-Profile: <DISCO_API_KEY>`` or
+wins the ``REQUEST_PROFILE_SAMPLE_RATE`` draw, and handlers wrapped with ``profiled``
+run under cProfile. Only the ``REQUEST_PROFILE_KEEP`` slowest profiles per endpoint are
+kept. When disabled, ``profiled`` returns the handler unchanged and the middleware is
+not installed, so requests pay nothing.
+
+cProfile only sees the thread it runs in: work a handler fans out to other threads or
+processes shows up as time spent waiting on their futures.
+"""
+
+import cProfile
+import functools
+import heapq
+import hmac
+import inspect
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+ENABLED = os.getenv("REQUEST_PROFILING", "false").strip().lower() in ("1", "true", "yes", "on")
+SAMPLE_RATE = float(os.getenv("REQUEST_PROFILE_SAMPLE_RATE", "0"))
+KEEP = int(os.getenv("REQUEST_PROFILE_KEEP", "10"))
+TOP_FUNCTIONS = int(os.getenv("REQUEST_PROFILE_TOP", "40"))
+HEADER = b"x-disco-profile"
+
+_requested: ContextVar[Optional[str]] = ContextVar("profile_requested", default=None)
+_slowest: Dict[str, List[Tuple[float, int, Dict[str, Any]]]] = {}
+_by_id: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+# Threads with a profiler running. cProfile has one hook per thread, and async handlers all
+# share the event loop's thread, so a second profile there would replace the first one's hook.
+_active: Set[int] = set()
+_seq = itertools.count(1)
+
+
+def _header_authorized(value: str) -> bool:
+    expected = os.getenv("DISCO_API_KEY", "").strip()
+    if not expected:
+        return bool(value)
+    return hmac.compare_digest(value.encode(), expected.encode())
+
+
+class ProfilingMiddleware:
+    """ASGI middleware deciding, per request, whether ``profiled`` handlers should profile."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        reason = None
+        for name, value in scope.get("headers") or ():
+            if name == HEADER and _header_authorized(value.decode("latin-1").strip()):
+                reason = "header"
+                break
+        if reason is None and SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+            reason = "sampled"
+        token = _requested.set(reason)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _requested.reset(token)
+
+
+def _store(endpoint: str, reason: str, started_at: datetime, elapsed: float, profiler: cProfile.Profile) -> None:
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    seq = next(_seq)
+    record = {
+        "id": f"{seq}",
+        "endpoint": endpoint,
+        "reason": reason,
+        "started_at": started_at,
+        "duration_ms": round(elapsed * 1000, 2),
+        "text": stream.getvalue(),
+        "pstats": marshal.dumps(stats.stats),
+    }
+    with _lock:
+        heap = _slowest.setdefault(endpoint, [])
+        entry = (elapsed, seq, record)
+        if len(heap) < max(1, KEEP):
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            evicted = heapq.heapreplace(heap, entry)
+            _by_id.pop(evicted[2]["id"], None)
+        else:
+            return
+        _by_id[record["id"]] = record
+
+
+def _start() -> Optional[cProfile.Profile]:
+    """A running profiler for this thread, or None when one is already active here."""
+    thread = threading.get_ident()
+    with _lock:
+        if thread in _active:
+            return None
+        _active.add(thread)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+: a profiler that is not ours holds this thread's hook.
+        with _lock:
+            _active.discard(thread)
+        return None
+    return profiler
+
+
+def _stop(profiler: cProfile.Profile) -> None:
+    profiler.disable()
+    with _lock:
+        _active.discard(threading.get_ident())
+
+
+def profiled(endpoint: str) -> Callable[[Callable], Callable]:
+    """Wrap a route handler (sync or async) so requests marked by the middleware are profiled."""
+
+    def decorate(fn: Callable) -> Callable:
+        if not ENABLED:
+            return fn
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                reason = _requested.get()
+                if reason is None:
+                    return await fn(*args, **kwargs)
+                # Other coroutines interleaved on the loop are captured too.
+                started_at, started = datetime.utcnow(), time.perf_counter()
+                profiler = _start()
+                if profiler is None:
+                    return await fn(*args, **kwargs)
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    _stop(profiler)
+                    _store(endpoint, reason, started_at, time.perf_counter() - started, profiler)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            reason = _requested.get()
+            if reason is None:
+                return fn(*args, **kwargs)
+            started_at, started = datetime.utcnow(), time.perf_counter()
+            profiler = _start()
+            if profiler is None:
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _stop(profiler)
+                _store(endpoint, reason, started_at, time.perf_counter() - started, profiler)
+
+        return wrapper
+
+    return decorate
+
+
+def list_profiles() -> Dict[str, Any]:
+    """Summaries of the kept profiles, slowest first per endpoint."""
+    with _lock:
+        endpoints = {
+            endpoint: [
+                {key: record[key] for key in ("id", "reason", "started_at", "duration_ms")}
+                for _, _, record in sorted(heap, reverse=True)
+            ]
+            for endpoint, heap in _slowest.items()
+        }
+    return {"enabled": ENABLED, "sample_rate": SAMPLE_RATE, "keep": KEEP, "endpoints": endpoints}
+
+
+def get_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        return _by_id.get(profile_id)
@@ -1,22 +1,298 @@
+import os
+import threading
+import time
 from datetime import datetime
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Set, Tuple, Union
+from cachetools import TTLCache
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from models import CodeSeed
-from telemetry import aggregate_success_metrics
+from db import REPLICA_LAG_SECONDS
+from domains import canonical_domain
+from metrics import counter, histogram, register_collector
+from models import CodeAttempt, CodeSeed
+from shards import attempt_sessions, shard_for
+from stats_store import DomainStats, domain_stats, domain_stats_async, store
 
-def _domain_key(domain: str) -> str:
-    return (domain or "").lower().replace("www.", "")
+# Per-code stats: the resident column store, or a plain dict of dicts from a caller.
+CodeStats = Union[DomainStats, Dict[str, Dict[str, float]]]
 
-def _success_stats(db: Session, domain: str) -> Dict[str, Dict[str, float]]:
-    return aggregate_success_metrics(db, domain=_domain_key(domain))
+RANK_STAGE_SECONDS = histogram(
+    "disco_rank_stage_seconds",
+    "Time spent loading ranking inputs (stats, seeds) and scoring candidates.",
+    labels=("stage",),
+)
 
-def rank_codes(db: Session, domain: str, candidates: List[str]) -> List[Tuple[str, float, Dict]]:
-    dom = _domain_key(domain)
-    stats = _success_stats(db, dom)
+# Ranked results per (domain, stats version, candidate set), bounded by approximate bytes.
+# The TTL bounds recency-boost drift; writes from other processes bump the version through
+# the poller below.
+RANK_CACHE_BYTES = int(os.getenv("RANK_CACHE_BYTES", str(32 * 1024 * 1024)))
+RANK_CACHE_TTL = int(os.getenv("RANK_CACHE_TTL_SECONDS", "300"))
+# How often new attempt and seed rows are polled for domains other processes wrote to (0: off).
+VERSION_POLL_SECONDS = float(os.getenv("RANK_VERSION_POLL_SECONDS", "2"))
+# Ids behind the high-water mark that each poll reads again. Postgres hands out ids before
+# commit, so a row can become visible after higher ids were already polled.
+POLL_RESCAN_IDS = max(0, int(os.getenv("RANK_VERSION_POLL_RESCAN_IDS", "1000")))
+RANK_CACHE_REQUESTS = counter(
+    "disco_rank_cache_requests_total",
+    "Ranking result cache lookups by result (hit, miss).",
+    labels=("result",),
+)
+
+def _ranked_size(ranked: List[Tuple[str, float, Dict]]) -> int:
+    # Rough footprint: tuple, code string and the reasons dict per ranked code.
+    return 256 + 640 * len(ranked)
+
+_rank_cache: TTLCache = TTLCache(maxsize=max(1, RANK_CACHE_BYTES), ttl=max(1, RANK_CACHE_TTL), getsizeof=_ranked_size)
+_rank_cache_lock = threading.Lock()
+_domain_versions: Dict[str, int] = {}
+# Domain -> when this process last wrote to it, while a replica read could still miss that write.
+_written_at: Dict[str, float] = {}
+# Poller state: (highest id, ids seen within the rescan window) for attempts per shard and for
+# seeds, and (domain, id) of events this process stored that the poller has not passed yet, so
+# they are not taken for remote ones.
+_polled_attempts: Dict[int, Tuple[int, Set[int]]] = {}
+_polled_seeds: Optional[Tuple[int, Set[int]]] = None
+_local_events: Set[Tuple[str, int]] = set()
+_poller: Optional[threading.Thread] = None
+
+def _success_stats(db: Session, domain: str) -> DomainStats:
+    return domain_stats(db, canonical_domain(domain))
+
+def _seed_counts(db: Session, domain: str) -> Dict[str, int]:
+    return _count_seeds(db.execute(_seed_query(domain)).scalars())
+
+async def _seed_counts_async(db: AsyncSession, domain: str) -> Dict[str, int]:
+    return _count_seeds((await db.execute(_seed_query(domain))).scalars())
+
+def _seed_query(domain: str):
+    return select(CodeSeed.code).where(CodeSeed.domain == canonical_domain(domain))
+
+def _count_seeds(codes) -> Dict[str, int]:
     seed_counts: Dict[str, int] = {}
-    for s in db.query(CodeSeed).filter(CodeSeed.domain == dom).all():
-        seed_counts[s.code] = seed_counts.get(s.code, 0) + 1
+    for code in codes:
+        seed_counts[code] = seed_counts.get(code, 0) + 1
+    return seed_counts
+
+def load_rank_inputs(db: Session, domain: str) -> Tuple[DomainStats, Dict[str, int]]:
+    """Load the per-code success stats and seed priors once so callers can score several lists.
+
+    The stats come from the resident store (stats_store.py); they are looked up per code,
+    never copied into a dict.
+    """
+    dom = canonical_domain(domain)
+    with RANK_STAGE_SECONDS.time(stage="stats"):
+        stats = _success_stats(db, dom)
+    with RANK_STAGE_SECONDS.time(stage="seeds"):
+        seed_counts = _seed_counts(db, dom)
+    return stats, seed_counts
+
+async def load_rank_inputs_async(db: AsyncSession, domain: str) -> Tuple[DomainStats, Dict[str, int]]:
+    dom = canonical_domain(domain)
+    with RANK_STAGE_SECONDS.time(stage="stats"):
+        stats = await domain_stats_async(db, dom)
+    with RANK_STAGE_SECONDS.time(stage="seeds"):
+        seed_counts = await _seed_counts_async(db, dom)
+    return stats, seed_counts
+
+def rank_codes(
+    db: Session,
+    domain: str,
+    candidates: List[str],
+    stats: Optional[CodeStats] = None,
+    seed_counts: Optional[Dict[str, int]] = None,
+) -> List[Tuple[str, float, Dict]]:
+    if stats is None or seed_counts is None:
+        loaded_stats, loaded_seeds = load_rank_inputs(db, domain)
+        stats = loaded_stats if stats is None else stats
+        seed_counts = loaded_seeds if seed_counts is None else seed_counts
+    return score_candidates(candidates, stats, seed_counts)
+
+async def rank_codes_async(
+    db: AsyncSession,
+    domain: str,
+    candidates: List[str],
+    stats: Optional[CodeStats] = None,
+    seed_counts: Optional[Dict[str, int]] = None,
+) -> List[Tuple[str, float, Dict]]:
+    if stats is None or seed_counts is None:
+        loaded_stats, loaded_seeds = await load_rank_inputs_async(db, domain)
+        stats = loaded_stats if stats is None else stats
+        seed_counts = loaded_seeds if seed_counts is None else seed_counts
+    return score_candidates(candidates, stats, seed_counts)
+
+def domain_version(domain: str) -> int:
+    return _domain_versions.get(canonical_domain(domain), 0)
+
+def bump_domain_version(domain: str, event_id: Optional[int] = None) -> int:
+    """Invalidate cached rankings for ``domain``; call after its attempts or seeds change.
+
+    Pass the id of a stored event so the version poller does not count it as another
+    process's write.
+    """
+    dom = canonical_domain(domain)
+    with _rank_cache_lock:
+        version = _domain_versions[dom] = _domain_versions.get(dom, 0) + 1
+        if event_id is not None and VERSION_POLL_SECONDS > 0:
+            _local_events.add((dom, event_id))
+        if REPLICA_LAG_SECONDS > 0:
+            now = time.monotonic()
+            _written_at[dom] = now
+            if len(_written_at) > 10000:
+                for stale in [d for d, at in _written_at.items() if now - at >= REPLICA_LAG_SECONDS]:
+                    del _written_at[stale]
+    return version
+
+def read_primary(domain: str) -> bool:
+    """True while a replica read of ``domain`` could miss this process's last write to it."""
+    written = _written_at.get(canonical_domain(domain))
+    return written is not None and time.monotonic() - written < REPLICA_LAG_SECONDS
+
+def _poll_rows(db: Session, model, state: Optional[Tuple[int, Set[int]]]) -> Tuple[List[Tuple[int, str]], Tuple[int, Set[int]]]:
+    """(id, domain) rows of ``model`` not seen by earlier polls, and the state for the next one.
+
+    Each poll reads ``POLL_RESCAN_IDS`` ids behind the high-water mark again, so rows that
+    commit out of id order are still picked up. With no state, only records where the table ends.
+    """
+    last = state[0] if state is not None else db.execute(select(func.max(model.id))).scalar() or 0
+    rows = db.execute(select(model.id, model.domain).where(model.id > last - POLL_RESCAN_IDS)).all()
+    mark = max([last] + [row_id for row_id, _domain in rows])
+    seen = {row_id for row_id, _domain in rows if row_id > mark - POLL_RESCAN_IDS}
+    if state is None:
+        return [], (mark, seen)
+    return [(row_id, domain) for row_id, domain in rows if row_id not in state[1]], (mark, seen)
+
+def poll_remote_writes(db: Session) -> int:
+    """Bump the version of every domain another process stored attempts or seeds for since the last poll.
+
+    Domains with new attempts are also marked stale in the stats store. The first call only
+    records where the tables end. Returns the number of domains bumped.
+    """
+    global _polled_seeds
+    attempted: Set[str] = set()
+    with attempt_sessions(db) as sessions:
+        for index, shard_db in enumerate(sessions):
+            rows, _polled_attempts[index] = _poll_rows(shard_db, CodeAttempt, _polled_attempts.get(index))
+            with _rank_cache_lock:
+                attempted.update(domain for event_id, domain in rows if domain and (domain, event_id) not in _local_events)
+    rows, _polled_seeds = _poll_rows(db, CodeSeed, _polled_seeds)
+    seeded = {domain for _seed_id, domain in rows if domain}
+    with _rank_cache_lock:
+        for dom in attempted | seeded:
+            _domain_versions[dom] = _domain_versions.get(dom, 0) + 1
+        passed = []
+        for dom, event_id in _local_events:
+            mark, seen = _polled_attempts.get(shard_for(dom), (0, set()))
+            if event_id in seen or event_id <= mark - POLL_RESCAN_IDS:
+                passed.append((dom, event_id))
+        _local_events.difference_update(passed)
+    for dom in attempted:
+        store.mark_stale(dom)
+    return len(attempted | seeded)
+
+def start_version_poller(session_factory, interval: float = VERSION_POLL_SECONDS) -> bool:
+    """Run ``poll_remote_writes`` every ``interval`` seconds on a daemon thread."""
+    global _poller
+    if interval <= 0:
+        return False
+    with _rank_cache_lock:
+        if _poller is not None:
+            return False
+
+        def loop() -> None:
+            stop = threading.Event()
+            while True:
+                db = session_factory()
+                try:
+                    poll_remote_writes(db)
+                except Exception:
+                    db.rollback()
+                finally:
+                    db.close()
+                if stop.wait(interval):
+                    return
+
+        _poller = threading.Thread(target=loop, name="rank-version-poller", daemon=True)
+        _poller.start()
+    return True
+
+def _rank_cache_key(domain: str, candidates: List[str]) -> Tuple[str, int, Tuple[str, ...]]:
+    normalized = tuple(sorted({c.strip().upper() for c in candidates if c and c.strip()}))
+    return canonical_domain(domain), domain_version(domain), normalized
+
+def _cached_ranking(key) -> Optional[List[Tuple[str, float, Dict]]]:
+    with _rank_cache_lock:
+        ranked = _rank_cache.get(key)
+    RANK_CACHE_REQUESTS.inc(result="miss" if ranked is None else "hit")
+    return ranked
+
+def _store_ranking(key, ranked: List[Tuple[str, float, Dict]]) -> None:
+    if _ranked_size(ranked) <= RANK_CACHE_BYTES:
+        with _rank_cache_lock:
+            _rank_cache[key] = ranked
+
+def _in_request_order(ranked: List[Tuple[str, float, Dict]], candidates: List[str]) -> List[Tuple[str, float, Dict]]:
+    """A cached ranking with equal scores in the client's candidate order, as ``rank_codes`` returns them."""
+    position: Dict[str, int] = {}
+    for code in candidates:
+        c = code.strip().upper() if code else ""
+        if c:
+            position.setdefault(c, len(position))
+    return sorted(ranked, key=lambda item: (-item[1], position.get(item[0], 0)))
+
+def rank_codes_cached(db: Session, domain: str, candidates: List[str]) -> Tuple[List[Tuple[str, float, Dict]], bool]:
+    """``rank_codes`` through the result cache; returns (ranked, served_from_cache).
+
+    The cache is keyed on the sorted candidate set so the same set hits regardless of how
+    the client ordered it; ties are then put back in the client's order. The version is read before the inputs are loaded, so a write that
+    lands mid-computation leaves the stored result under an already superseded key. A
+    result scored from stats still waiting to reload is not cached.
+    """
+    key = _rank_cache_key(domain, candidates)
+    ranked = _cached_ranking(key)
+    if ranked is not None:
+        return _in_request_order(ranked, candidates), True
+    stats, seed_counts = load_rank_inputs(db, domain)
+    ranked = rank_codes(db, domain, list(key[2]), stats, seed_counts)
+    if not stats.stale:
+        _store_ranking(key, ranked)
+    return _in_request_order(ranked, candidates), False
+
+async def rank_codes_cached_async(db: AsyncSession, domain: str, candidates: List[str]) -> Tuple[List[Tuple[str, float, Dict]], bool]:
+    key = _rank_cache_key(domain, candidates)
+    ranked = _cached_ranking(key)
+    if ranked is not None:
+        return _in_request_order(ranked, candidates), True
+    stats, seed_counts = await load_rank_inputs_async(db, domain)
+    ranked = await rank_codes_async(db, domain, list(key[2]), stats, seed_counts)
+    if not stats.stale:
+        _store_ranking(key, ranked)
+    return _in_request_order(ranked, candidates), False
+
+def _collect_rank_cache_metrics():
+    with _rank_cache_lock:
+        entries, used = len(_rank_cache), _rank_cache.currsize
+    yield (
+        "disco_rank_cache_entries",
+        "gauge",
+        "Ranked results held in the ranking result cache.",
+        [("disco_rank_cache_entries", {}, entries)],
+    )
+    yield (
+        "disco_rank_cache_bytes",
+        "gauge",
+        "Approximate bytes used by the ranking result cache (limit RANK_CACHE_BYTES).",
+        [("disco_rank_cache_bytes", {}, used)],
+    )
+
+register_collector(_collect_rank_cache_metrics)
 
+def score_candidates(
+    candidates: List[str],
+    stats: CodeStats,
+    seed_counts: Dict[str, int],
+) -> List[Tuple[str, float, Dict]]:
+    started = time.perf_counter()
     ranked = []
     now_ts = datetime.utcnow().timestamp()
     for code in candidates:
@@ -72,4 +348,5 @@ def rank_codes(db: Session, domain: str, candidates: List[str]) -> List[Tuple[st
             }
         }))
     ranked.sort(key=lambda x: x[1], reverse=True)
+    RANK_STAGE_SECONDS.observe(time.perf_counter() - started, stage="score")
     return ranked
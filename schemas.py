@@ -10,9 +10,6 @@ class SuggestRequest(BaseModel):
     html: Optional[str] = None
     limit: int = 25
 
-class SuggestResponse(BaseModel):
-    codes: List[str]
-
 class RankRequest(BaseModel):
     domain: str
     context: Dict[str, Any]
@@ -22,6 +19,11 @@ class RankedCode(BaseModel):
     score: float
     reasons: Dict[str, Any] = {}
 
+class SuggestResponse(BaseModel):
+    codes: List[str]
+    ranked: List[RankedCode] = []
+    metadata: Dict[str, Any] = {}
+
 class RankResponse(BaseModel):
     codes: List[RankedCode]
     metadata: Dict[str, Any] = {}
@@ -40,6 +42,7 @@ class EventRequest(BaseModel):
     after_total: Optional[float] = None
     anon_id: Optional[str] = None
     opt_out: Optional[bool] = False
+    idempotency_key: Optional[str] = Field(None, max_length=200)
 
 class ScrapeRequest(BaseModel):
     domain: str
@@ -51,6 +54,7 @@ class ScrapeResponse(BaseModel):
     codes: List[str]
 
 class AdaptersResponse(BaseModel):
+    version: int = 0
     platforms: Dict[str, Any]
     retailers: List[Dict[str, Any]]
 
@@ -88,6 +92,16 @@ class CatalogRetailerResponse(BaseModel):
     inventory: List[CatalogInventoryEntry] = []
     inventory_count: int = 0
     last_synced: Optional[str] = None
+    next_cursor: Optional[str] = None
+
+
+class CatalogChangesResponse(BaseModel):
+    version: int
+    reset: bool = False
+    has_more: bool = False
+    retailers: List[Dict[str, Any]] = []
+    inventory: List[Dict[str, Any]] = []
+    removed: List[Dict[str, Any]] = []
 
 
 class CatalogCoverageResponse(BaseModel):
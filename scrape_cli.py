@@ -7,7 +7,9 @@ from db import get_db
 from ranking import rank_codes
 from scraper import scrape_pipeline
 from schemas import ScrapeRequest
-from catalog import build_adapter_snapshot, get_retailer_overrides
+from adapter_snapshot import load_adapters
+from catalog import get_retailer_overrides
+from domains import clean_domain, refresh_aliases
 from urllib.robotparser import RobotFileParser
 from urllib.parse import urljoin
 
@@ -42,9 +44,9 @@ def main():
     except Exception:
         ADAPTERS = None
 
-    allowlist = [s.strip().lower() for s in (os.getenv('ALLOWLIST_DOMAINS','').split(',')) if s.strip()]
+    allowlist = [clean_domain(s) for s in (os.getenv('ALLOWLIST_DOMAINS','').split(',')) if s.strip()]
     if op in ('codes','rank'):
-        dom = (payload.get('domain') or '').lower().replace('www.','')
+        dom = clean_domain(payload.get('domain'))
         if allowlist and dom not in allowlist:
             print(json.dumps({'error': f'domain not allowlisted: {dom}'}))
             sys.exit(1)
@@ -54,7 +56,8 @@ def main():
 
     db_gen = get_db(); db: Session = next(db_gen)
     try:
-        adapters_snapshot = build_adapter_snapshot(db, ADAPTERS or {"platforms": {}, "retailers": []})
+        refresh_aliases(db, ADAPTERS)
+        adapters_snapshot = load_adapters(db, ADAPTERS)
 
         if op == 'codes':
             domain = (payload.get('domain') or '')
@@ -0,0 +1,303 @@
+"""Durable, DB-backed queue of recurring per-domain scrape jobs.
+
+Each domain has one ``ScrapeJob`` row that says when it is next due. Workers claim due
+rows by stamping them with a lease (``FOR UPDATE SKIP LOCKED`` on Postgres, a single
+conditional UPDATE under SQLite's write lock), scrape the domain through
+``scrape_pipeline`` so results land in ``ScrapeCache``, and then release the lease by
+rescheduling the row. A worker that dies keeps its rows only until the lease expires.
+Because a domain has at most one live lease, no two workers hit the same retailer at
+once, however many processes run.
+"""
+
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from catalog import get_retailer_overrides
+from db import SessionLocal
+from domains import canonical_domain
+from metrics import counter, histogram
+from models import ScrapeJob
+from scraper import host_backoff, robots_allowed, scrape_pipeline
+
+DEFAULT_INTERVAL_SECONDS = int(os.getenv("SCRAPE_JOB_INTERVAL_SECONDS", "1800"))
+LEASE_SECONDS = int(os.getenv("SCRAPE_JOB_LEASE_SECONDS", "300"))
+# A running job extends its lease this often, so a slow retailer is never taken over mid-run.
+HEARTBEAT_SECONDS = float(os.getenv("SCRAPE_JOB_HEARTBEAT_SECONDS", str(max(1, LEASE_SECONDS // 3))))
+# Releasing a lease is retried this many times on lock contention before it is left to expire.
+COMPLETE_ATTEMPTS = 5
+MAX_ATTEMPTS = int(os.getenv("SCRAPE_JOB_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.getenv("SCRAPE_JOB_RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_SECONDS = float(os.getenv("SCRAPE_JOB_RETRY_MAX_SECONDS", "1800"))
+# Spread reschedules so a tier enqueued at once does not stay in lockstep forever.
+JITTER = float(os.getenv("SCRAPE_JOB_JITTER", "0.1"))
+LIMIT = int(os.getenv("SCRAPE_LIMIT", "50"))
+# Batch jobs are not latency-bound, so they queue for a host's politeness slot much longer than requests do.
+HOST_WAIT_SECONDS = float(os.getenv("SCRAPE_JOB_HOST_WAIT_SECONDS", "30"))
+
+SCRAPE_JOBS = counter(
+    "disco_scrape_jobs_total",
+    "Scrape jobs finished by workers, by outcome.",
+    labels=("outcome",),
+)
+SCRAPE_JOB_SECONDS = histogram(
+    "disco_scrape_job_seconds",
+    "Wall time of one domain scrape job.",
+)
+
+
+def _due(now: datetime):
+    return (ScrapeJob.run_after <= now) & or_(ScrapeJob.lease_expires_at.is_(None), ScrapeJob.lease_expires_at < now)
+
+
+def enqueue_domains(
+    db: Session,
+    domains: Iterable[str],
+    interval_seconds: int = DEFAULT_INTERVAL_SECONDS,
+    priority: int = 0,
+    run_now: bool = False,
+) -> int:
+    """Create or retune the job for each domain; returns how many jobs were created.
+
+    Existing jobs keep their place in the queue unless ``run_now`` is set.
+    """
+    now = datetime.utcnow()
+    wanted = {}
+    for name in domains:
+        dom = canonical_domain(name)
+        if dom:
+            wanted[dom] = True
+    existing = {
+        job.domain: job
+        for job in db.execute(select(ScrapeJob).where(ScrapeJob.domain.in_(list(wanted)))).scalars()
+    } if wanted else {}
+    created = 0
+    for dom in wanted:
+        job = existing.get(dom)
+        if job is None:
+            job = ScrapeJob(domain=dom, run_after=now, attempts=0, codes_found=0)
+            db.add(job)
+            created += 1
+        elif run_now:
+            job.run_after = now
+        job.interval_seconds = int(interval_seconds)
+        job.priority = int(priority)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another enqueuer inserted some of the same domains; their rows are as good as ours.
+        db.rollback()
+        return enqueue_domains(db, wanted, interval_seconds, priority, run_now)
+    return created
+
+
+def enqueue_schedule(db: Session, schedule: Dict[str, Any]) -> int:
+    """Enqueue every tier of an ``adapters/schedule.json`` document.
+
+    Tiers are ``{"name": {"domains": [...], "interval_ms": N}}``; tiers listed first get
+    the higher priority.
+    """
+    created = 0
+    tiers = list((schedule.get("tiers") or {}).values())
+    for rank, tier in enumerate(tiers):
+        interval = int(tier.get("interval_ms") or 0) // 1000
+        if tier.get("domains") and interval > 0:
+            created += enqueue_domains(db, tier["domains"], interval, priority=len(tiers) - rank)
+    return created
+
+
+def claim_jobs(db: Session, worker_id: str, limit: int = 1, lease_seconds: int = LEASE_SECONDS) -> List[ScrapeJob]:
+    """Lease up to ``limit`` due jobs to ``worker_id``, highest priority and most overdue first."""
+    now = datetime.utcnow()
+    token = f"{worker_id}:{uuid.uuid4().hex[:12]}"
+    # Postgres skips rows another worker is claiming; SQLite renders no locking clause and
+    # instead runs the whole UPDATE under its database write lock, which is just as exclusive.
+    due_ids = (
+        select(ScrapeJob.id)
+        .where(_due(now))
+        .order_by(ScrapeJob.priority.desc(), ScrapeJob.run_after)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    db.execute(
+        update(ScrapeJob)
+        .where(ScrapeJob.id.in_(due_ids.scalar_subquery()), _due(now))
+        .values(
+            lease_owner=token,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            attempts=ScrapeJob.attempts + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    jobs = list(db.execute(select(ScrapeJob).where(ScrapeJob.lease_owner == token)).scalars())
+    # Detached, so the lease token we compare on later cannot be refreshed to a new owner's.
+    for job in jobs:
+        db.expunge(job)
+    return jobs
+
+
+def _retry_delay(attempts: int) -> float:
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def _jittered(seconds: float) -> timedelta:
+    return timedelta(seconds=seconds * (1.0 + random.uniform(-JITTER, JITTER)))
+
+
+def complete_job(
+    db: Session,
+    job: ScrapeJob,
+    codes: Optional[int] = None,
+    error: Optional[str] = None,
+    not_before: float = 0.0,
+) -> bool:
+    """Release ``job``'s lease and schedule its next run.
+
+    Success waits a full interval, or ``not_before`` seconds if that is longer; failure retries with exponential backoff and, after
+    ``SCRAPE_JOB_MAX_ATTEMPTS``, falls back to the regular interval. Returns False when
+    the lease had already expired and been taken over, in which case nothing is written.
+    """
+    now = datetime.utcnow()
+    values: Dict[str, Any] = {"lease_owner": None, "lease_expires_at": None, "last_run_at": now}
+    if error is None:
+        values.update(
+            attempts=0,
+            last_ok_at=now,
+            last_error=None,
+            codes_found=codes or 0,
+            run_after=now + max(_jittered(job.interval_seconds or DEFAULT_INTERVAL_SECONDS), timedelta(seconds=not_before)),
+        )
+    elif job.attempts >= MAX_ATTEMPTS:
+        values.update(attempts=0, last_error=error[:500], run_after=now + _jittered(job.interval_seconds or DEFAULT_INTERVAL_SECONDS))
+    else:
+        values.update(last_error=error[:500], run_after=now + _jittered(_retry_delay(job.attempts)))
+    result = db.execute(
+        update(ScrapeJob)
+        .where(ScrapeJob.id == job.id, ScrapeJob.lease_owner == job.lease_owner)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def renew_lease(db: Session, job: ScrapeJob, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """Push ``job``'s lease out to ``lease_seconds`` from now; False once it is no longer ours."""
+    result = db.execute(
+        update(ScrapeJob)
+        .where(ScrapeJob.id == job.id, ScrapeJob.lease_owner == job.lease_owner)
+        .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+@contextmanager
+def lease_heartbeat(job: ScrapeJob, interval: float = HEARTBEAT_SECONDS):
+    """Renew ``job``'s lease every ``interval`` seconds, on its own session, while the block runs."""
+    stop = threading.Event()
+
+    def beat() -> None:
+        while not stop.wait(interval):
+            db = SessionLocal()
+            try:
+                if not renew_lease(db, job):
+                    return
+            except OperationalError:
+                # Contention; the lease still has time left, so try again next beat.
+                db.rollback()
+            finally:
+                db.close()
+
+    thread = threading.Thread(target=beat, name=f"lease-{job.id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _complete(db: Session, job: ScrapeJob, codes: int, error: Optional[str], not_before: float = 0.0) -> Optional[bool]:
+    """``complete_job`` with retries on lock contention; None if the lease could not be released."""
+    for attempt in range(COMPLETE_ATTEMPTS):
+        try:
+            return complete_job(db, job, codes=codes, error=error, not_before=not_before)
+        except OperationalError:
+            db.rollback()
+            time.sleep(min(5.0, 0.2 * 2 ** attempt))
+    return None
+
+
+def run_job(db: Session, adapters: Optional[Dict], job: ScrapeJob, limit: int = LIMIT) -> Dict[str, Any]:
+    """Scrape one leased job and reschedule it; returns a small summary.
+
+    The lease is renewed while the scrape runs. If releasing it keeps failing, the job is
+    left to expire and be claimed again.
+    """
+    started = time.perf_counter()
+    codes: List[str] = []
+    error = None
+    backoff = 0.0
+    try:
+        if not robots_allowed(job.domain):
+            error = "robots.txt disallows scraping"
+        else:
+            with lease_heartbeat(job):
+                # Scheduled runs exist to refresh the cache, so never settle for a stale row.
+                codes = scrape_pipeline(
+                    db,
+                    adapters,
+                    domain=job.domain,
+                    limit=limit,
+                    overrides=get_retailer_overrides(db, job.domain),
+                    stale_while_revalidate=False,
+                    max_wait=HOST_WAIT_SECONDS,
+                )
+            # The retailer pushed back (429/5xx/timeouts) mid-run; keep what was found, but
+            # don't come back before the host is willing to talk to us again.
+            backoff = host_backoff(job.domain)
+    except Exception as exc:
+        db.rollback()
+        error = f"{type(exc).__name__}: {exc}"
+    owned = _complete(db, job, len(codes), error, backoff)
+    if owned is None:
+        outcome = "release_failed"
+    else:
+        outcome = "lost_lease" if not owned else ("ok" if error is None else "error")
+    SCRAPE_JOBS.inc(outcome=outcome)
+    SCRAPE_JOB_SECONDS.observe(time.perf_counter() - started)
+    return {"domain": job.domain, "codes": len(codes), "error": error, "outcome": outcome}
+
+
+def queue_stats(db: Session) -> Dict[str, Any]:
+    now = datetime.utcnow()
+    leased = (ScrapeJob.lease_expires_at.isnot(None)) & (ScrapeJob.lease_expires_at >= now)
+    row = db.execute(
+        select(
+            func.count(ScrapeJob.id),
+            func.sum(case((_due(now), 1), else_=0)),
+            func.sum(case((leased, 1), else_=0)),
+            func.sum(case((ScrapeJob.last_error.isnot(None), 1), else_=0)),
+            func.min(case((_due(now), ScrapeJob.run_after), else_=None)),
+        )
+    ).one()
+    oldest = row[4]
+    return {
+        "jobs": row[0] or 0,
+        "due": int(row[1] or 0),
+        "leased": int(row[2] or 0),
+        "failing": int(row[3] or 0),
+        "oldest_due_seconds": round((now - oldest).total_seconds(), 1) if oldest else 0.0,
+    }
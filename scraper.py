@@ -1,92 +1,656 @@
-import os, re, json
-from typing import List, Dict, Optional, Any
+import os, json, time, random, asyncio, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, NamedTuple, Optional, Any, Tuple
 from urllib.parse import urljoin
+from urllib.robotparser import RobotFileParser
+from email.utils import parsedate_to_datetime
 import requests
-from lxml import html as lh
+from cachetools import LRUCache, TTLCache
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from db import SessionLocal
+from domains import canonical_domain, clean_domain
+from metrics import counter, histogram, register_collector
 from models import ScrapeCache
+from parsing import extract_codes, scrape_from_html
 from datetime import datetime, timedelta
 
 UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124 Safari/537.36 DiscoBot/1.0"
 TIMEOUT = float(os.getenv("SCRAPE_TIMEOUT_SECONDS", "7"))
 TTL = int(os.getenv("SCRAPE_TTL_SECONDS", "600"))
+# Expired rows younger than TTL + MAX_STALE are served immediately while a background refresh runs.
+STALE_WHILE_REVALIDATE = os.getenv("SCRAPE_STALE_WHILE_REVALIDATE", "true").strip().lower() not in ("0", "false", "no", "off")
+MAX_STALE = int(os.getenv("SCRAPE_MAX_STALE_SECONDS", "86400"))
+NEGATIVE_TTL = int(os.getenv("SCRAPE_NEGATIVE_TTL_SECONDS", "300"))
+REFRESH_WORKERS = int(os.getenv("SCRAPE_REFRESH_WORKERS", "4"))
+# Where a domain's pages live; point at a stand-in server (benchmarks/fake_retailer.py) offline.
+SCRAPE_ORIGIN = os.getenv("SCRAPE_ORIGIN", "https://{domain}")
+# Path planner: at most MAX_URLS pages per scrape, best expected codes per second first.
+# Paths fetched fewer than MIN_TRIALS times are always tried; paths that yielded nothing in
+# PRUNE_AFTER fetches are dropped, except that each scrape re-tries one of them with
+# probability EXPLORE_RATE so a page that starts carrying codes is noticed.
+MAX_URLS = int(os.getenv("SCRAPE_MAX_URLS", "6"))
+PLANNER_MIN_TRIALS = int(os.getenv("SCRAPE_PLANNER_MIN_TRIALS", "2"))
+PLANNER_PRUNE_AFTER = int(os.getenv("SCRAPE_PLANNER_PRUNE_AFTER", "4"))
+PLANNER_EXPLORE_RATE = float(os.getenv("SCRAPE_PLANNER_EXPLORE_RATE", "0.1"))
+# Per-retailer politeness: a token bucket of HOST_RATE fetches/second (HOST_BURST at once),
+# never faster than robots.txt Crawl-delay. A fetch waits at most MAX_WAIT for its slot and
+# at most HOST_MAX_QUEUE fetches wait per host, so one busy retailer cannot tie up the
+# fetch threads every other retailer needs. 429/5xx/timeouts halve the host's rate and bench
+# it for HOST_BACKOFF seconds, doubling per consecutive failure up to NEGATIVE_TTL (or the
+# server's Retry-After, if longer); successes restore the rate gradually.
+HOST_RATE = float(os.getenv("SCRAPE_HOST_RATE", "2"))
+HOST_BURST = int(os.getenv("SCRAPE_HOST_BURST", "3"))
+HOST_MAX_WAIT = float(os.getenv("SCRAPE_HOST_MAX_WAIT_SECONDS", "1"))
+HOST_MAX_QUEUE = int(os.getenv("SCRAPE_HOST_MAX_QUEUE", "4"))
+HOST_BACKOFF = float(os.getenv("SCRAPE_HOST_BACKOFF_SECONDS", "5"))
+HOST_MAX_SLOWDOWN = 16.0
+# The rate and Crawl-delay are enforced per process. RATE_SHARE processes that may fetch the
+# same retailer at once (uvicorn workers, plus one when scrape workers run: job leases keep
+# worker processes off each other's domains) each take an equal share of them.
+RATE_SHARE = max(1, int(os.getenv("SCRAPE_RATE_SHARE", os.getenv("WEB_CONCURRENCY", "1")) or 1))
+ROBOTS_TTL = int(os.getenv("SCRAPE_ROBOTS_TTL_SECONDS", "3600"))
+# An unreachable robots.txt blocks fetching, but only until it is retried after this long.
+ROBOTS_ERROR_TTL = int(os.getenv("SCRAPE_ROBOTS_ERROR_TTL_SECONDS", "60"))
+# robots.txt groups match on the product token; RobotFileParser would read "Mozilla" from UA.
+ROBOTS_AGENT = "DiscoBot"
 
-def normalize_domain(domain: str) -> str:
-    return (domain or "").lower().replace("www.", "")
+_hosts: LRUCache = LRUCache(maxsize=8192)
+_hosts_lock = threading.Lock()
+_robots: TTLCache = TTLCache(maxsize=8192, ttl=max(1, ROBOTS_TTL))
+_robots_failed: TTLCache = TTLCache(maxsize=8192, ttl=max(1, ROBOTS_ERROR_TTL))
+_robots_lock = threading.Lock()
+_refreshing = set()
+_refresh_lock = threading.Lock()
+_refresh_pool = ThreadPoolExecutor(max_workers=max(1, REFRESH_WORKERS), thread_name_prefix="scrape-refresh")
 
-def _extract_tokens(text: str, token_re: str) -> List[str]:
-    import re
-    tokens = re.findall(token_re, text.upper())
-    uniq = []
-    for t in tokens:
-        tt = t.strip().upper()
-        if tt and tt not in uniq:
-            uniq.append(tt)
-    return uniq
+REVALIDATION_FIELDS = ("fetches", "not_modified", "unchanged_body", "parsed", "parses_skipped", "bytes_downloaded", "bytes_saved")
+_revalidation_stats: Dict[str, Dict[str, int]] = {}
+_revalidation_lock = threading.Lock()
+_async_client = None
+_refresh_listeners: List[Callable[[str], Any]] = []
 
-def _filter_tokens(tokens: List[str], stop: List[str]) -> List[str]:
-    stopset = set(stop or [])
-    return [t for t in tokens if t not in stopset]
+SCRAPE_LOOKUPS = counter(
+    "disco_scrape_cache_lookups_total",
+    "Scrape cache lookups by result (fresh, skip, revalidate, fetch).",
+    labels=("result",),
+)
+SCRAPE_FETCH_SECONDS = histogram(
+    "disco_scrape_fetch_seconds",
+    "Outbound retailer page fetch latency by outcome.",
+    labels=("outcome",),
+)
+SCRAPE_FETCH_BYTES = counter(
+    "disco_scrape_fetch_bytes_total",
+    "Response body bytes downloaded from retailer pages.",
+)
+SCRAPE_PLANNED_PATHS = counter(
+    "disco_scrape_planned_paths_total",
+    "Scrape path planner decisions per candidate path (planned, explored, pruned, over_budget).",
+    labels=("decision",),
+)
+SCRAPE_HOST_WAIT_SECONDS = histogram(
+    "disco_scrape_host_wait_seconds",
+    "Time outbound fetches waited for their host's politeness slot.",
+)
+SCRAPE_HOST_THROTTLED = counter(
+    "disco_scrape_host_throttled_total",
+    "Outbound fetches not sent because of host politeness (backoff, over_wait, queue_full, robots).",
+    labels=("reason",),
+)
+_planner_rng = random.Random()
 
-def scrape_from_html(html: str, token_re: str, keywords: List[str], stop: List[str]) -> List[str]:
+class FetchError(Exception):
+    """A page could not be fetched; ``host_level`` marks failures that say the whole host is unhealthy."""
+
+    def __init__(self, message: str, host_level: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.host_level = host_level
+        self.retry_after = retry_after
+
+
+class FetchedPage(NamedTuple):
+    status: int
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: Optional[str]
+    nbytes: int
+
+
+def _fetch_page(url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> FetchedPage:
+    headers = {"User-Agent": UA, "Accept": "text/html"}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    started = time.perf_counter()
+    try:
+        resp = requests.get(url, headers=headers, timeout=TIMEOUT, allow_redirects=True)
+    except requests.RequestException as exc:
+        _observe_fetch(started, "error")
+        raise FetchError(f"{type(exc).__name__}: {exc}", host_level=True) from exc
+    return _observed_page(started, resp.status_code, resp.headers, resp.content, resp.text, etag, last_modified)
+
+async def _fetch_page_async(url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> FetchedPage:
+    import httpx
+
+    headers = {"User-Agent": UA, "Accept": "text/html"}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    started = time.perf_counter()
+    try:
+        resp = await _get_async_client().get(url, headers=headers)
+    except httpx.HTTPError as exc:
+        _observe_fetch(started, "error")
+        raise FetchError(f"{type(exc).__name__}: {exc}", host_level=True) from exc
+    return _observed_page(started, resp.status_code, resp.headers, resp.content, resp.text, etag, last_modified)
+
+def _get_async_client():
+    global _async_client
+    if _async_client is None:
+        import httpx
+
+        _async_client = httpx.AsyncClient(timeout=TIMEOUT, follow_redirects=True)
+    return _async_client
+
+def _observe_fetch(started: float, outcome: str, nbytes: int = 0) -> None:
+    SCRAPE_FETCH_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+    if nbytes:
+        SCRAPE_FETCH_BYTES.inc(nbytes)
+
+def _observed_page(started: float, status: int, headers, content: Optional[bytes], text: str, etag: Optional[str], last_modified: Optional[str]) -> FetchedPage:
     try:
-        root = lh.fromstring(html)
-        texts = root.xpath("//text()")
-        joined = "\n".join([t.strip() for t in texts if t and t.strip()])
-        toks = _extract_tokens(joined, token_re)
-        upper = joined.upper()
-        near = []
-        for kw in keywords:
-            i = upper.find(kw.upper())
-            while i >= 0:
-                excerpt = upper[max(0, i-160): i+160]
-                near.extend(_extract_tokens(excerpt, token_re))
-                i = upper.find(kw.upper(), i+1)
-        merged = list(dict.fromkeys(near + toks))
-        return _filter_tokens(merged, stop)
+        page = _page_from_response(status, headers, content, text, etag, last_modified)
+    except FetchError:
+        _observe_fetch(started, "error", len(content or b""))
+        raise
+    _observe_fetch(started, "not_modified" if page.status == 304 else "ok", page.nbytes)
+    return page
+
+def _page_from_response(status: int, headers, content: Optional[bytes], text: str, etag: Optional[str], last_modified: Optional[str]) -> FetchedPage:
+    if status == 304:
+        return FetchedPage(304, "", headers.get("ETag") or etag, headers.get("Last-Modified") or last_modified, None, 0)
+    if not (200 <= status < 300):
+        host_level = status == 429 or status >= 500
+        raise FetchError(f"HTTP {status}", host_level=host_level, retry_after=_retry_after(headers) if host_level else None)
+    body = content or b""
+    return FetchedPage(
+        status,
+        text,
+        headers.get("ETag"),
+        headers.get("Last-Modified"),
+        hashlib.sha256(body).hexdigest(),
+        len(body),
+    )
+
+def _retry_after(headers) -> Optional[float]:
+    value = (headers.get("Retry-After") or "").strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value).timestamp() - time.time()))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def fetch_and_scrape(domain: str, url: str, token_re: str, keywords: List[str], stop: List[str]) -> List[str]:
+    if _robots_blocked(domain, url) or not polite_wait(domain):
+        return []
+    try:
+        page = _fetch_page(url)
+    except FetchError as exc:
+        _host_feedback(domain, exc)
+        return []
+    _host_feedback(domain, None)
+    try:
+        return scrape_from_html(page.text, token_re, keywords, stop)
     except Exception:
         return []
 
-def fetch_and_scrape(domain: str, url: str, token_re: str, keywords: List[str], stop: List[str]) -> List[str]:
+def _record_revalidation(domain: str, **deltas: int) -> None:
+    with _revalidation_lock:
+        entry = _revalidation_stats.setdefault(domain, dict.fromkeys(REVALIDATION_FIELDS, 0))
+        for key, value in deltas.items():
+            entry[key] += value
+
+def revalidation_stats() -> Dict[str, Dict[str, int]]:
+    """Per-domain counters for conditional fetches: bytes saved by 304s and parses skipped."""
+    with _revalidation_lock:
+        return {domain: dict(entry) for domain, entry in _revalidation_stats.items()}
+
+def _collect_revalidation_metrics():
+    totals = dict.fromkeys(REVALIDATION_FIELDS, 0)
+    for entry in revalidation_stats().values():
+        for key, value in entry.items():
+            totals[key] += value
+    yield (
+        "disco_scrape_revalidation_total",
+        "counter",
+        "Conditional fetch outcomes summed over domains (see /scrape/stats for the per-domain view).",
+        [("disco_scrape_revalidation_total", {"field": key}, value) for key, value in totals.items()],
+    )
+    with _refresh_lock:
+        inflight = len(_refreshing)
+    yield (
+        "disco_scrape_refresh_inflight",
+        "gauge",
+        "Background stale-while-revalidate refreshes queued or running.",
+        [("disco_scrape_refresh_inflight", {}, inflight)],
+    )
+
+register_collector(_collect_revalidation_metrics)
+
+class _HostState:
+    __slots__ = ("tat", "slowdown", "strikes", "blocked_until", "waiting", "last_error")
+
+    def __init__(self):
+        self.tat = 0.0  # theoretical arrival time of the next fetch (GCRA)
+        self.slowdown = 1.0
+        self.strikes = 0
+        self.blocked_until = 0.0
+        self.waiting = 0
+        self.last_error: Optional[str] = None
+
+def _host_state(domain: str) -> _HostState:
+    state = _hosts.get(domain)
+    if state is None:
+        state = _hosts[domain] = _HostState()
+    return state
+
+def _parse_crawl_delay(lines: List[str]) -> float:
+    """Crawl-delay for our bot (or ``*``); RobotFileParser only understands whole seconds."""
+    delays: Dict[str, float] = {}
+    agents: List[str] = []
+    in_rules = False
+    for line in lines:
+        field, _, value = line.split("#", 1)[0].partition(":")
+        field, value = field.strip().lower(), value.strip()
+        if field == "user-agent":
+            if in_rules:
+                agents, in_rules = [], False
+            agents.append(value.lower())
+        elif field == "crawl-delay":
+            in_rules = True
+            try:
+                for agent in agents:
+                    delays.setdefault(agent, max(0.0, float(value)))
+            except ValueError:
+                pass
+        elif field:
+            in_rules = True
+    return delays.get(ROBOTS_AGENT.lower(), delays.get("*", 0.0))
+
+def _load_robots(domain: str) -> Tuple[Optional[RobotFileParser], float]:
+    with _robots_lock:
+        if domain in _robots:
+            return _robots[domain]
+        if domain in _robots_failed:
+            return _robots_failed[domain]
+    url = _origin(domain) + "robots.txt"
+    rules: Optional[RobotFileParser] = RobotFileParser(url)
+    delay = 0.0
     try:
-        headers = {"User-Agent": UA, "Accept": "text/html"}
-        resp = requests.get(url, headers=headers, timeout=TIMEOUT, allow_redirects=True)
-        if not (200 <= resp.status_code < 300):
-            return []
-        html = resp.text
-        return scrape_from_html(html, token_re, keywords, stop)
+        resp = requests.get(url, headers={"User-Agent": UA}, timeout=TIMEOUT)
+        if resp.status_code in (401, 403):
+            rules.disallow_all = True
+        elif resp.status_code == 429 or resp.status_code >= 500:
+            rules = None
+        elif resp.status_code >= 400:
+            rules.allow_all = True
+        else:
+            lines = resp.text.splitlines()
+            rules.parse(lines)
+            delay = _parse_crawl_delay(lines)
+    except requests.RequestException:
+        rules = None
+    with _robots_lock:
+        (_robots if rules is not None else _robots_failed)[domain] = (rules, delay)
+    return rules, delay
+
+def robots_rules(domain: str) -> Optional[RobotFileParser]:
+    """The retailer's parsed robots.txt (cached ``SCRAPE_ROBOTS_TTL_SECONDS``); None when unreadable.
+
+    Unreadable (network error, 429 or 5xx) is remembered for ``SCRAPE_ROBOTS_ERROR_TTL_SECONDS``.
+    """
+    return _load_robots(domain)[0]
+
+def _robots_known(domain: str) -> bool:
+    with _robots_lock:
+        return domain in _robots or domain in _robots_failed
+
+def robots_allowed(domain: str, url: Optional[str] = None) -> bool:
+    """Whether robots.txt lets us fetch ``url`` (default: the root) on ``domain``; unreadable robots means no."""
+    rules = robots_rules(domain)
+    # Match on the path relative to the origin, which also holds under a SCRAPE_ORIGIN prefix.
+    return rules is not None and rules.can_fetch(ROBOTS_AGENT, _path_of(domain, url) if url else "/")
+
+def _robots_blocked(domain: str, url: str) -> bool:
+    if robots_allowed(domain, url):
+        return False
+    SCRAPE_HOST_THROTTLED.inc(reason="robots")
+    return True
+
+def _crawl_delay(domain: str) -> float:
+    return _load_robots(domain)[1]
+
+def _reserve_fetch(domain: str, max_wait: float, crawl_delay: float) -> Optional[float]:
+    """Book ``domain``'s next fetch slot; seconds to wait for it, or None to not fetch at all."""
+    now = time.monotonic()
+    with _hosts_lock:
+        state = _host_state(domain)
+        if state.blocked_until > now:
+            reason = "backoff"
+        else:
+            interval = max(1.0 / HOST_RATE if HOST_RATE > 0 else 0.0, crawl_delay) * state.slowdown * RATE_SHARE
+            burst = 1 if crawl_delay or state.slowdown > 1.0 else max(1, HOST_BURST // RATE_SHARE)
+            start = max(now, state.tat - (burst - 1) * interval)
+            wait = start - now
+            if wait > max_wait:
+                reason = "over_wait"
+            elif wait > 0 and state.waiting >= HOST_MAX_QUEUE:
+                reason = "queue_full"
+            else:
+                state.tat = max(state.tat, start) + interval
+                if wait > 0:
+                    state.waiting += 1
+                return wait
+    SCRAPE_HOST_THROTTLED.inc(reason=reason)
+    return None
+
+def _waited(domain: str, wait: float) -> None:
+    SCRAPE_HOST_WAIT_SECONDS.observe(wait)
+    if wait > 0:
+        with _hosts_lock:
+            state = _host_state(domain)
+            state.waiting = max(0, state.waiting - 1)
+
+def polite_wait(domain: str, max_wait: Optional[float] = None) -> bool:
+    """Block until ``domain`` may be fetched again; False when the fetch should be skipped."""
+    wait = _reserve_fetch(domain, HOST_MAX_WAIT if max_wait is None else max_wait, _crawl_delay(domain))
+    if wait is None:
+        return False
+    if wait > 0:
+        time.sleep(wait)
+    _waited(domain, wait)
+    return True
+
+async def polite_wait_async(domain: str, max_wait: Optional[float] = None) -> bool:
+    # robots.txt is fetched with the blocking client, once per ROBOTS_TTL, off the event loop.
+    delay = _crawl_delay(domain) if _robots_known(domain) else await asyncio.to_thread(_crawl_delay, domain)
+    wait = _reserve_fetch(domain, HOST_MAX_WAIT if max_wait is None else max_wait, delay)
+    if wait is None:
+        return False
+    if wait > 0:
+        await asyncio.sleep(wait)
+    _waited(domain, wait)
+    return True
+
+def _host_feedback(domain: str, exc: Optional[FetchError]) -> None:
+    """Adapt ``domain``'s rate to a fetch outcome: back off on host-level failures, recover on success."""
+    with _hosts_lock:
+        state = _host_state(domain)
+        if exc is None or not exc.host_level:
+            state.strikes = 0
+            state.slowdown = max(1.0, state.slowdown * 0.75)
+            return
+        state.strikes += 1
+        state.slowdown = min(HOST_MAX_SLOWDOWN, state.slowdown * 2.0)
+        backoff = min(float(NEGATIVE_TTL), HOST_BACKOFF * 2 ** (state.strikes - 1))
+        state.blocked_until = time.monotonic() + max(backoff, exc.retry_after or 0.0)
+        state.last_error = str(exc)[:255]
+
+def host_backoff(domain: str) -> float:
+    """Seconds until ``domain`` may be fetched again after a host-level failure (0: not backing off)."""
+    with _hosts_lock:
+        state = _hosts.get(domain)
+        return max(0.0, state.blocked_until - time.monotonic()) if state is not None else 0.0
+
+def host_stats() -> Dict[str, Dict[str, Any]]:
+    """Politeness state of hosts that are currently slowed down, backing off or queued on."""
+    now = time.monotonic()
+    with _hosts_lock:
+        items = list(_hosts.items())
+        return {
+            domain: {
+                "slowdown": round(state.slowdown, 2),
+                "strikes": state.strikes,
+                "backoff_seconds": round(max(0.0, state.blocked_until - now), 1),
+                "waiting": state.waiting,
+                "last_error": state.last_error,
+            }
+            for domain, state in items
+            if state.slowdown > 1.0 or state.blocked_until > now or state.waiting
+        }
+
+def _cached_codes(row: Optional[ScrapeCache]) -> List[str]:
+    if not row or not row.codes_json:
+        return []
+    try:
+        return json.loads(row.codes_json) or []
     except Exception:
         return []
 
-def cached_fetch(db: Session, domain: str, url: str, token_re: str, keywords: List[str], stop: List[str]) -> List[str]:
-    now = datetime.utcnow()
-    row = db.query(ScrapeCache).filter(ScrapeCache.domain==domain, ScrapeCache.url==url).first()
-    if row and row.fetched_at and (now - row.fetched_at) < timedelta(seconds=TTL):
-        try:
-            return json.loads(row.codes_json) or []
-        except Exception:
-            pass
-    codes = fetch_and_scrape(domain, url, token_re, keywords, stop)
-    payload = json.dumps(codes[:50])
-    if row:
-        row.codes_json = payload
-        row.fetched_at = now
-    else:
-        row = ScrapeCache(domain=domain, url=url, codes_json=payload, fetched_at=now)
+def _refresh_row(db: Session, row: Optional[ScrapeCache], domain: str, url: str, token_re: str, keywords: List[str], stop: List[str], max_wait: Optional[float] = None, host: Optional[str] = None) -> Optional[List[str]]:
+    """Fetch ``url`` and persist the outcome; returns None when the fetch failed or was not sent.
+
+    ``domain`` keys the cache row; ``host`` (default ``domain``) is the site actually
+    fetched, which politeness and backoff are tracked for. A failed fetch only records the
+    error on the row so previously scraped codes survive it.
+    """
+    host = host or domain
+    if _robots_blocked(host, url) or not polite_wait(host, max_wait):
+        return None
+    if row is None:
+        row = ScrapeCache(domain=domain, url=url, codes_json="[]", fetched_at=None)
         db.add(row)
+    row.last_attempt_at = datetime.utcnow()
+    started = time.perf_counter()
+    try:
+        page = _fetch_page(url, etag=row.etag, last_modified=row.last_modified)
+    except FetchError as exc:
+        _apply_failure(row, host, exc)
+        _record_yield(row, None, started)
+        db.commit()
+        return None
+    _host_feedback(host, None)
+    codes = _apply_page(row, page, domain, token_re, keywords, stop)
+    _record_yield(row, codes, started)
     db.commit()
     return codes
 
-def scrape_pipeline(
+async def _refresh_row_async(db: AsyncSession, row: Optional[ScrapeCache], domain: str, url: str, token_re: str, keywords: List[str], stop: List[str], max_wait: Optional[float] = None, host: Optional[str] = None) -> Optional[List[str]]:
+    host = host or domain
+    # robots.txt is fetched with the blocking client, once per ROBOTS_TTL, off the event loop.
+    blocked = _robots_blocked(host, url) if _robots_known(host) else await asyncio.to_thread(_robots_blocked, host, url)
+    if blocked or not await polite_wait_async(host, max_wait):
+        return None
+    if row is None:
+        row = ScrapeCache(domain=domain, url=url, codes_json="[]", fetched_at=None)
+        db.add(row)
+    row.last_attempt_at = datetime.utcnow()
+    started = time.perf_counter()
+    try:
+        page = await _fetch_page_async(url, etag=row.etag, last_modified=row.last_modified)
+    except FetchError as exc:
+        _apply_failure(row, host, exc)
+        _record_yield(row, None, started)
+        await db.commit()
+        return None
+    _host_feedback(host, None)
+    parsed = None
+    if not _page_unchanged(row, page):
+        # Parsing is CPU-bound, so it runs off the event loop; the ORM row is only touched here.
+        parsed = await asyncio.to_thread(
+            extract_codes, page.text, token_re, keywords, stop, max_bytes=None, reject_when_busy=False
+        )
+    codes = _apply_page(row, page, domain, token_re, keywords, stop, parsed=parsed)
+    _record_yield(row, codes, started)
+    await db.commit()
+    return codes
+
+def _record_yield(row: ScrapeCache, codes: Optional[List[str]], started: float) -> None:
+    """Count one network fetch of ``row`` for the path planner (``codes`` None: it failed)."""
+    row.fetch_count = (row.fetch_count or 0) + 1
+    row.fetch_ms_total = (row.fetch_ms_total or 0.0) + (time.perf_counter() - started) * 1000.0
+    if codes:
+        row.yield_count = (row.yield_count or 0) + 1
+        row.codes_yielded = (row.codes_yielded or 0) + len(codes)
+
+def _apply_failure(row: ScrapeCache, host: str, exc: FetchError) -> None:
+    _host_feedback(host, exc)
+    row.last_fetch_ok = False
+    row.last_error = str(exc)[:255]
+    row.failure_count = (row.failure_count or 0) + 1
+
+def _page_unchanged(row: ScrapeCache, page: FetchedPage) -> bool:
+    return row.fetched_at is not None and (
+        page.status == 304 or (page.content_hash is not None and page.content_hash == row.content_hash)
+    )
+
+def _apply_page(
+    row: ScrapeCache,
+    page: FetchedPage,
+    domain: str,
+    token_re: str,
+    keywords: List[str],
+    stop: List[str],
+    parsed: Optional[List[str]] = None,
+) -> List[str]:
+    """Store a fetched page on ``row``; ``parsed`` is its codes when the caller already extracted them."""
+    if _page_unchanged(row, page):
+        # Validators or the body hash say the page is identical: keep the parsed codes, extend freshness.
+        codes = _cached_codes(row)
+        if page.status == 304:
+            _record_revalidation(domain, fetches=1, not_modified=1, parses_skipped=1, bytes_saved=row.content_length or 0)
+        else:
+            _record_revalidation(domain, fetches=1, unchanged_body=1, parses_skipped=1, bytes_downloaded=page.nbytes)
+    else:
+        codes = parsed if parsed is not None else extract_codes(
+            page.text, token_re, keywords, stop, max_bytes=None, reject_when_busy=False
+        )
+        row.codes_json = json.dumps(codes[:50])
+        row.content_hash = page.content_hash
+        row.content_length = page.nbytes
+        _record_revalidation(domain, fetches=1, parsed=1, bytes_downloaded=page.nbytes)
+    row.etag = page.etag
+    row.last_modified = page.last_modified
+    row.fetched_at = datetime.utcnow()
+    row.last_fetch_ok = True
+    row.last_error = None
+    row.failure_count = 0
+    return codes
+
+def _background_refresh(key, token_re: str, keywords: List[str], stop: List[str], host: Optional[str] = None) -> None:
+    domain, url = key
+    db = SessionLocal()
+    try:
+        row = db.query(ScrapeCache).filter(ScrapeCache.domain==domain, ScrapeCache.url==url).first()
+        if row and row.fetched_at and (datetime.utcnow() - row.fetched_at) < timedelta(seconds=TTL):
+            return
+        before = _cached_codes(row)
+        codes = _refresh_row(db, row, domain, url, token_re, keywords, stop, host=host)
+        if codes is not None and codes[:50] != before:
+            for listener in list(_refresh_listeners):
+                listener(domain)
+    except Exception:
+        db.rollback()
+    finally:
+        db.close()
+        with _refresh_lock:
+            _refreshing.discard(key)
+
+def add_refresh_listener(fn: Callable[[str], Any]) -> None:
+    """Call ``fn(domain)`` whenever a background refresh changes a page's cached codes."""
+    _refresh_listeners.append(fn)
+
+def schedule_refresh(domain: str, url: str, token_re: str, keywords: List[str], stop: List[str], host: Optional[str] = None) -> bool:
+    """Queue a background refresh of one cached URL unless one is already in flight."""
+    key = (domain, url)
+    with _refresh_lock:
+        if key in _refreshing:
+            return False
+        _refreshing.add(key)
+    try:
+        _refresh_pool.submit(_background_refresh, key, token_re, keywords, stop, host)
+    except RuntimeError:
+        with _refresh_lock:
+            _refreshing.discard(key)
+        return False
+    return True
+
+def _plan_lookup(row: Optional[ScrapeCache], host: str, swr: bool) -> Tuple[str, bool]:
+    """Decide how to serve a cache lookup: ("fresh"|"skip"|"revalidate"|"fetch", stale codes usable)."""
+    action, usable_stale = _decide_lookup(row, host, swr)
+    SCRAPE_LOOKUPS.inc(result=action)
+    return action, usable_stale
+
+def _decide_lookup(row: Optional[ScrapeCache], host: str, swr: bool) -> Tuple[str, bool]:
+    age = (datetime.utcnow() - row.fetched_at) if row and row.fetched_at else None
+    if age is not None and age < timedelta(seconds=TTL):
+        return "fresh", True
+    usable_stale = age is not None and age < timedelta(seconds=TTL + MAX_STALE)
+    if host_backoff(host) > 0:
+        return "skip", usable_stale
+    if swr and usable_stale:
+        return "revalidate", True
+    return "fetch", usable_stale
+
+def cached_fetch(
     db: Session,
-    adapters: Optional[Dict],
     domain: str,
-    url: Optional[str]=None,
-    html: Optional[str]=None,
-    limit: int=50,
-    overrides: Optional[Dict[str, Any]] = None,
+    url: str,
+    token_re: str,
+    keywords: List[str],
+    stop: List[str],
+    stale_while_revalidate: Optional[bool] = None,
+    max_wait: Optional[float] = None,
+    host: Optional[str] = None,
+) -> List[str]:
+    swr = STALE_WHILE_REVALIDATE if stale_while_revalidate is None else stale_while_revalidate
+    row = db.query(ScrapeCache).filter(ScrapeCache.domain==domain, ScrapeCache.url==url).first()
+    action, usable_stale = _plan_lookup(row, host or domain, swr)
+    if action == "revalidate":
+        schedule_refresh(domain, url, token_re, keywords, stop, host)
+    if action != "fetch":
+        return _cached_codes(row) if usable_stale else []
+    codes = _refresh_row(db, row, domain, url, token_re, keywords, stop, max_wait, host)
+    if codes is None:
+        return _cached_codes(row) if usable_stale else []
+    return codes
+
+async def cached_fetch_async(
+    db: AsyncSession,
+    domain: str,
+    url: str,
+    token_re: str,
+    keywords: List[str],
+    stop: List[str],
+    stale_while_revalidate: Optional[bool] = None,
+    max_wait: Optional[float] = None,
+    host: Optional[str] = None,
 ) -> List[str]:
-    dom = normalize_domain(domain)
+    swr = STALE_WHILE_REVALIDATE if stale_while_revalidate is None else stale_while_revalidate
+    row = (
+        await db.execute(select(ScrapeCache).where(ScrapeCache.domain==domain, ScrapeCache.url==url).limit(1))
+    ).scalars().first()
+    action, usable_stale = _plan_lookup(row, host or domain, swr)
+    if action == "revalidate":
+        schedule_refresh(domain, url, token_re, keywords, stop, host)
+    if action != "fetch":
+        return _cached_codes(row) if usable_stale else []
+    codes = await _refresh_row_async(db, row, domain, url, token_re, keywords, stop, max_wait, host)
+    if codes is None:
+        return _cached_codes(row) if usable_stale else []
+    return codes
+
+def _scrape_config(adapters: Optional[Dict], overrides: Optional[Dict[str, Any]]) -> Tuple[str, List[str], List[str], List[str]]:
     overrides = overrides or {}
     platforms = (adapters or {}).get("platforms", {})
     platform_key = overrides.get("platform") or "generic"
@@ -96,25 +660,161 @@ def scrape_pipeline(
     token_re = domain_scrape.get("token_re") or sconf.get("token_re", r"[A-Z0-9][A-Z0-9\-]{4,14}")
     keywords = domain_scrape.get("keywords") or sconf.get("keywords", [])
     stop = domain_scrape.get("stop") or sconf.get("stop", [])
+    paths = domain_scrape.get("paths") or sconf.get("paths", ["/", "/sale", "/offers", "/promo", "/promotions", "/discount", "/voucher", "/vouchers"])
+    return token_re, keywords, stop, paths
+
+def _origin(dom: str) -> str:
+    return SCRAPE_ORIGIN.format(domain=dom).rstrip("/") + "/"
+
+def _path_of(dom: str, url: str) -> str:
+    base = _origin(dom)
+    return "/" + url[len(base):] if url.startswith(base) else url
+
+def _path_score(row: Optional[ScrapeCache]) -> Optional[float]:
+    """Smoothed codes per fetch divided by seconds per fetch; None while still unexplored."""
+    fetches = (row.fetch_count or 0) if row is not None else 0
+    if fetches < PLANNER_MIN_TRIALS:
+        return None
+    codes_per_fetch = ((row.codes_yielded or 0) + 1) / (fetches + 2)
+    seconds = (row.fetch_ms_total or 0.0) / fetches / 1000.0
+    return codes_per_fetch / (seconds + 0.05)
+
+def _pruned(row: Optional[ScrapeCache]) -> bool:
+    return row is not None and (row.fetch_count or 0) >= PLANNER_PRUNE_AFTER and not row.yield_count
+
+def plan_scrape_urls(host: str, url: Optional[str], paths: List[str], rows: Dict[str, ScrapeCache]) -> List[str]:
+    """Order and prune the URLs to scrape on ``host`` from the per-URL yield stats in ``rows``.
+
+    An explicit ``url`` always goes first. Paths with a track record come best-first,
+    then unexplored ones; dead paths are skipped apart from occasional exploration.
+    """
+    planned = [url] if url else []
+    scored, unexplored, pruned = [], [], []
+    for p in dict.fromkeys(paths):
+        candidate = urljoin(_origin(host), p.lstrip("/"))
+        if candidate == url:
+            continue
+        row = rows.get(candidate)
+        if _pruned(row):
+            pruned.append(candidate)
+            continue
+        score = _path_score(row)
+        if score is None:
+            unexplored.append(candidate)
+        else:
+            scored.append((score, candidate))
+    scored.sort(key=lambda item: -item[0])
+    ranked = [candidate for _, candidate in scored] + unexplored
+    budget = max(0, MAX_URLS - len(planned))
+    explored = None
+    if pruned and budget and _planner_rng.random() < PLANNER_EXPLORE_RATE:
+        explored = _planner_rng.choice(pruned)
+        budget -= 1
+    planned.extend(ranked[:budget])
+    SCRAPE_PLANNED_PATHS.inc(min(budget, len(ranked)), decision="planned")
+    SCRAPE_PLANNED_PATHS.inc(max(0, len(ranked) - budget), decision="over_budget")
+    SCRAPE_PLANNED_PATHS.inc(len(pruned) - (explored is not None), decision="pruned")
+    if explored is not None:
+        planned.append(explored)
+        SCRAPE_PLANNED_PATHS.inc(decision="explored")
+    return planned
+
+def _domain_rows_query(dom: str):
+    return select(ScrapeCache).where(ScrapeCache.domain == dom)
+
+def path_stats(db: Session, domain: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Planner yield statistics: a summary per domain, plus per-path detail for ``domain``."""
+    query = select(
+        ScrapeCache.domain,
+        func.sum(ScrapeCache.fetch_count),
+        func.sum(ScrapeCache.yield_count),
+        func.sum(ScrapeCache.codes_yielded),
+        func.sum(ScrapeCache.fetch_ms_total),
+    ).group_by(ScrapeCache.domain)
+    dom = canonical_domain(domain) if domain else None
+    if dom:
+        query = query.where(ScrapeCache.domain == dom)
+    result: Dict[str, Dict[str, Any]] = {}
+    for name, fetches, yields, codes, ms in db.execute(query):
+        fetches, codes = int(fetches or 0), int(codes or 0)
+        result[name] = {
+            "fetches": fetches,
+            "yielding_fetches": int(yields or 0),
+            "codes": codes,
+            "fetch_ms": round(float(ms or 0.0), 1),
+            "fetches_per_code": round(fetches / codes, 3) if codes else None,
+        }
+    if dom and dom in result:
+        result[dom]["paths"] = {
+            _path_of(dom, row.url): {
+                "fetches": row.fetch_count or 0,
+                "yielding_fetches": row.yield_count or 0,
+                "codes": row.codes_yielded or 0,
+                "avg_fetch_ms": round((row.fetch_ms_total or 0.0) / row.fetch_count, 1) if row.fetch_count else None,
+                "pruned": _pruned(row),
+            }
+            for row in db.execute(_domain_rows_query(dom)).scalars()
+        }
+    return result
+
+def _merge_found(found: List[str], codes: List[str]) -> None:
+    for c in codes:
+        if c not in found:
+            found.append(c)
+
+def scrape_pipeline(
+    db: Session,
+    adapters: Optional[Dict],
+    domain: str,
+    url: Optional[str]=None,
+    html: Optional[str]=None,
+    limit: int=50,
+    overrides: Optional[Dict[str, Any]] = None,
+    stale_while_revalidate: Optional[bool] = None,
+    max_wait: Optional[float] = None,
+) -> List[str]:
+    dom = canonical_domain(domain)
+    # Pages come from the host that was asked for, so a regional site keeps its own codes;
+    # the canonical domain only keys the cache rows and their stats.
+    host = clean_domain(domain) or dom
+    token_re, keywords, stop, paths = _scrape_config(adapters, overrides)
 
     if html:
-        return scrape_from_html(html, token_re, keywords, stop)[:limit]
+        return extract_codes(html, token_re, keywords, stop)[:limit]
 
-    roots = [f"https://{dom}"]
-    urls = []
-    if url:
-        urls.append(url)
-    paths = domain_scrape.get("paths") or sconf.get("paths", ["/", "/sale", "/offers", "/promo", "/promotions", "/discount", "/voucher", "/vouchers"])
-    for base in roots:
-        for p in paths:
-            urls.append(urljoin(base, p))
+    rows = {row.url: row for row in db.execute(_domain_rows_query(dom)).scalars()}
+    found: List[str] = []
+    for u in plan_scrape_urls(host, url, paths, rows):
+        _merge_found(found, cached_fetch(db, dom, u, token_re, keywords, stop, stale_while_revalidate, max_wait, host))
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+async def scrape_pipeline_async(
+    db: AsyncSession,
+    adapters: Optional[Dict],
+    domain: str,
+    url: Optional[str]=None,
+    html: Optional[str]=None,
+    limit: int=50,
+    overrides: Optional[Dict[str, Any]] = None,
+    stale_while_revalidate: Optional[bool] = None,
+    max_wait: Optional[float] = None,
+) -> List[str]:
+    dom = canonical_domain(domain)
+    # Pages come from the host that was asked for, so a regional site keeps its own codes;
+    # the canonical domain only keys the cache rows and their stats.
+    host = clean_domain(domain) or dom
+    token_re, keywords, stop, paths = _scrape_config(adapters, overrides)
+
+    if html:
+        codes = await asyncio.to_thread(extract_codes, html, token_re, keywords, stop)
+        return codes[:limit]
 
+    rows = {row.url: row for row in (await db.execute(_domain_rows_query(dom))).scalars()}
     found: List[str] = []
-    for u in urls[:6]:
-        codes = cached_fetch(db, dom, u, token_re, keywords, stop)
-        for c in codes:
-            if c not in found:
-                found.append(c)
+    for u in plan_scrape_urls(host, url, paths, rows):
+        _merge_found(found, await cached_fetch_async(db, dom, u, token_re, keywords, stop, stale_while_revalidate, max_wait, host))
         if len(found) >= limit:
             break
     return found[:limit]
@@ -0,0 +1,133 @@
+"""Rewrite rows stored under a retailer alias to its canonical domain (see domains.py).
+
+    python scripts/canonicalize_domains.py plan
+    python scripts/canonicalize_domains.py apply --batch-size 5000
+
+Rows written before canonicalization, or under a host that has since become an alias of
+a catalog retailer, keep their old key. That splits a retailer's history across keys and,
+with ``ATTEMPT_SHARDS``, leaves attempts on the alias's shard where reads never look.
+``apply`` renames ``code_seeds``, ``scrape_cache``, ``scrape_jobs`` and ``code_attempts``
+rows to the canonical key, moving attempts to the canonical domain's shard when it is a
+different one, and drops alias ``suggestion_sets`` (the canonical set is recomputed). An
+alias row whose seed code, cached URL or job already exists under the canonical key is
+dropped. Re-running is safe. Running API processes pick the merged history up when their
+ranking stats and caches next reload.
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import Table, delete, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from db import SessionLocal, _build_engine
+from domains import canonical_domain, refresh_aliases
+from models import CodeAttempt, CodeSeed, ScrapeCache, ScrapeJob, SuggestionSet
+from shards import move_domain_attempts, shard_index, shard_urls
+
+# Table, and the column that is unique together with the domain (None: the domain alone).
+RENAMED = ((CodeSeed.__table__, "code"), (ScrapeCache.__table__, "url"), (ScrapeJob.__table__, None))
+
+
+def _base_adapters() -> Optional[Dict]:
+    try:
+        with open(ROOT / "adapters.json", "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _aliased(db: Session, table: Table) -> Dict[str, str]:
+    """Stored domain -> canonical domain, for every key of ``table`` that is not canonical."""
+    keys = {}
+    for domain in db.execute(select(table.c.domain).distinct()).scalars():
+        canonical = canonical_domain(domain) if domain else ""
+        if canonical and canonical != domain:
+            keys[domain] = canonical
+    return keys
+
+
+def _count(db: Session, table: Table, domain: str) -> int:
+    return db.execute(select(func.count()).select_from(table).where(table.c.domain == domain)).scalar() or 0
+
+
+def _rename(db: Session, table: Table, unique: Optional[str], alias: str, canonical: str) -> None:
+    other = table.alias()
+    clash = select(other.c.id).where(other.c.domain == canonical)
+    if unique is not None:
+        clash = clash.where(other.c[unique] == table.c[unique])
+    db.execute(delete(table).where(table.c.domain == alias, clash.exists()))
+    db.execute(update(table).where(table.c.domain == alias).values(domain=canonical))
+
+
+def _main_tables(db: Session, apply: bool) -> Dict[str, Dict[str, int]]:
+    report = {}
+    for table, unique in (*RENAMED, (SuggestionSet.__table__, "")):
+        aliases = _aliased(db, table)
+        report[table.name] = {"domains": len(aliases), "rows": sum(_count(db, table, alias) for alias in aliases)}
+        if apply:
+            for alias, canonical in aliases.items():
+                if unique == "":
+                    db.execute(delete(table).where(table.c.domain == alias))
+                else:
+                    _rename(db, table, unique, alias, canonical)
+            db.commit()
+    return report
+
+
+def _attempts(apply: bool, batch_size: int):
+    sources = shard_urls()
+    engines = {url: _build_engine(url) for url in sources}
+    report = []
+    for source in sources:
+        if not inspect(engines[source]).has_table(CodeAttempt.__tablename__):
+            continue
+        src = Session(bind=engines[source])
+        try:
+            for alias, canonical in _aliased(src, CodeAttempt.__table__).items():
+                target = sources[shard_index(canonical, len(sources))]
+                entry = {"from": alias, "to": canonical, "rows": _count(src, CodeAttempt.__table__, alias)}
+                if target != source:
+                    entry["shard"] = target
+                if apply and target == source:
+                    src.execute(update(CodeAttempt).where(CodeAttempt.domain == alias).values(domain=canonical))
+                    src.commit()
+                elif apply:
+                    dst = Session(bind=engines[target])
+                    try:
+                        move_domain_attempts(src, dst, source, alias, batch_size, new_domain=canonical)
+                    finally:
+                        dst.close()
+                report.append(entry)
+        finally:
+            src.close()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rewrite rows keyed by a retailer alias to the canonical domain.")
+    parser.add_argument("command", choices=("plan", "apply"))
+    parser.add_argument("--batch-size", type=int, default=5000, help="Attempt rows moved per transaction across shards")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        refresh_aliases(db, _base_adapters())
+        tables = _main_tables(db, args.command == "apply")
+    finally:
+        db.close()
+    attempts = _attempts(args.command == "apply", max(1, args.batch_size))
+    print(json.dumps({"tables": tables, "attempts": attempts, "seconds": round(time.perf_counter() - started, 2)}, indent=2))
+
+
+if __name__ == "__main__":  # pragma: no cover - CLI entry point
+    main()
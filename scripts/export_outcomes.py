@@ -1,32 +1,72 @@
-"""Export sanitized promo outcome telemetry for offline ranking/training jobs."""
+"""Export sanitized promo outcome telemetry for offline ranking/training jobs.
+
+Rows are streamed from the database with keyset pagination and written as they
+arrive, so memory use does not grow with the amount of history exported.
+
+``--format parquet`` / ``--format arrow`` write a day/domain partitioned columnar
+dataset into the ``--output`` directory instead, appending only rows newer than the
+watermark left by the previous run (see outcome_store.py).
+"""
 
 import argparse
 import csv
 import json
 import sys
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List
+from typing import IO, Iterable, Iterator
 
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
 from db import SessionLocal
-from telemetry import build_training_rows
+from outcome_store import export_partitions
+from telemetry import TRAINING_COLUMNS, iter_training_rows
 
 
-def _write_csv(rows: List[dict]) -> None:
-    if not rows:
-        return
-    fieldnames = list(rows[0].keys())
-    writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
+def _write_csv(rows: Iterable[dict], out: IO[str]) -> int:
+    writer = csv.DictWriter(out, fieldnames=list(TRAINING_COLUMNS))
     writer.writeheader()
+    count = 0
     for row in rows:
         writer.writerow(row)
+        count += 1
+    return count
+
+
+def _write_ndjson(rows: Iterable[dict], out: IO[str]) -> int:
+    count = 0
+    for row in rows:
+        out.write(json.dumps(row, sort_keys=True))
+        out.write("\n")
+        count += 1
+    return count
+
+
+def _write_json(rows: Iterable[dict], out: IO[str]) -> int:
+    # A streamed JSON array: one element per line instead of one json.dump of the whole list.
+    out.write("[")
+    count = 0
+    for row in rows:
+        out.write(",\n  " if count else "\n  ")
+        out.write(json.dumps(row, sort_keys=True))
+        count += 1
+    out.write("\n]\n" if count else "]\n")
+    return count
 
 
-def _write_json(rows: List[dict]) -> None:
-    json.dump(rows, sys.stdout, indent=2, sort_keys=True)
+WRITERS = {"json": _write_json, "ndjson": _write_ndjson, "csv": _write_csv}
+COLUMNAR = ("parquet", "arrow")
+
+
+@contextmanager
+def _output(path: str) -> Iterator[IO[str]]:
+    if not path or path == "-":
+        yield sys.stdout
+        return
+    with open(path, "w", encoding="utf-8", newline="") as fh:
+        yield fh
 
 
 def main() -> None:
@@ -42,22 +82,78 @@ def main() -> None:
     )
     parser.add_argument(
         "--format",
-        choices=("json", "csv"),
+        choices=tuple(WRITERS) + COLUMNAR,
         default="json",
         help="Output format (default: json)",
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=5000,
+        help="Rows fetched per keyset page (default: 5000)",
+    )
+    parser.add_argument(
+        "--output",
+        default="-",
+        help="Output file (default: stdout); the dataset directory for parquet/arrow",
+    )
+    parser.add_argument(
+        "--state",
+        default=None,
+        help="Watermark file for parquet/arrow runs (default: <output>/_watermark.json)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the watermark and export the whole --days window (parquet/arrow)",
+    )
+    parser.add_argument(
+        "--lag-seconds",
+        type=int,
+        default=60,
+        help="Leave rows younger than this for the next incremental run (default: 60)",
+    )
     args = parser.parse_args()
 
+    if args.format in COLUMNAR:
+        if not args.output or args.output == "-":
+            parser.error("--output DIR is required for parquet/arrow exports")
+        if args.domain and not args.full:
+            parser.error("--domain needs --full for parquet/arrow exports; the watermark covers every domain")
+        session = SessionLocal()
+        try:
+            result = export_partitions(
+                session,
+                args.output,
+                fmt=args.format,
+                domain=args.domain,
+                days=args.days,
+                full=args.full,
+                lag_seconds=args.lag_seconds,
+                page_size=max(1, args.batch_size),
+                watermark_path=args.state,
+            )
+        finally:
+            session.close()
+        print(
+            f"Exported {result['rows']} rows into {len(result['files'])} files; watermark {result['watermark']}",
+            file=sys.stderr,
+        )
+        return
+
     session = SessionLocal()
     try:
-        rows = build_training_rows(session, domain=args.domain, days=args.days)
+        rows = iter_training_rows(
+            session,
+            domain=args.domain,
+            days=args.days,
+            page_size=max(1, args.batch_size),
+        )
+        with _output(args.output) as out:
+            count = WRITERS[args.format](rows, out)
     finally:
         session.close()
-
-    if args.format == "csv":
-        _write_csv(rows)
-    else:
-        _write_json(rows)
+    print(f"Exported {count} rows", file=sys.stderr)
 
 
 if __name__ == "__main__":  # pragma: no cover - CLI entry point
@@ -0,0 +1,90 @@
+"""Move ``code_attempts`` rows between shard layouts (see shards.py).
+
+    python scripts/reshard_attempts.py plan --to shards.json
+    python scripts/reshard_attempts.py move --to shards.json --batch-size 5000
+    python scripts/reshard_attempts.py move --from sqlite:///./disco.db --to "sqlite:///./a0.db,sqlite:///./a1.db"
+
+``--from`` defaults to the current ``ATTEMPT_SHARDS`` (the main database when unset) and
+``--to`` takes the same forms: a JSON shard map, inline JSON or comma-separated URLs.
+Shards are matched by URL, so domains whose shard URL does not change stay where they
+are; with jump hashing, going from N to N+1 shards only moves the domains that land on
+the new shard. ``move`` copies each domain in batches and deletes each batch from the
+source once the target has committed it. The target's ``attempt_moves`` table records
+the last copied id with every batch, so a re-run after an interruption resumes where it
+stopped without copying a row twice. Run it with writers stopped (or run it again after
+the config switch) so late events are moved too.
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import func, inspect, select
+from sqlalchemy.orm import Session
+
+from db import _build_engine
+from models import CodeAttempt
+from shards import load_shard_map, move_domain_attempts, shard_index, shard_urls
+
+
+def _urls(spec: str) -> List[str]:
+    return [shard["url"] for shard in load_shard_map(spec)] if spec else shard_urls()
+
+
+def _moves(db: Session, source: str, targets: List[str]) -> Dict[str, Dict[str, int]]:
+    """Domains on ``source`` that belong elsewhere under ``targets``: target url -> {domain: rows}."""
+    moves: Dict[str, Dict[str, int]] = {}
+    counts = db.execute(select(CodeAttempt.domain, func.count(CodeAttempt.id)).group_by(CodeAttempt.domain))
+    for domain, rows in counts:
+        target = targets[shard_index(domain or "", len(targets))]
+        if target != source:
+            moves.setdefault(target, {})[domain] = int(rows)
+    return moves
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebalance code_attempts across attempt shards.")
+    parser.add_argument("command", choices=("plan", "move"))
+    parser.add_argument("--from", dest="source", default="", help="Current shard map (default: ATTEMPT_SHARDS or DATABASE_URL)")
+    parser.add_argument("--to", dest="target", required=True, help="New shard map")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows copied per transaction")
+    args = parser.parse_args()
+
+    sources, targets = _urls(args.source), _urls(args.target)
+    engines = {url: _build_engine(url) for url in dict.fromkeys(sources + targets)}
+    if args.command == "move":
+        for url in targets:
+            CodeAttempt.__table__.create(bind=engines[url], checkfirst=True)
+
+    started = time.perf_counter()
+    report = []
+    for source in sources:
+        if not inspect(engines[source]).has_table(CodeAttempt.__tablename__):
+            continue
+        src = Session(bind=engines[source])
+        try:
+            for target, domains in _moves(src, source, targets).items():
+                entry = {"from": source, "to": target, "domains": len(domains), "rows": sum(domains.values())}
+                if args.command == "move":
+                    dst = Session(bind=engines[target])
+                    try:
+                        entry["moved"] = sum(
+                            move_domain_attempts(src, dst, source, domain, max(1, args.batch_size)) for domain in domains
+                        )
+                    finally:
+                        dst.close()
+                report.append(entry)
+        finally:
+            src.close()
+    print(json.dumps({"moves": report, "seconds": round(time.perf_counter() - started, 2)}, indent=2))
+
+
+if __name__ == "__main__":  # pragma: no cover - CLI entry point
+    main()
@@ -0,0 +1,176 @@
+"""Enqueue scheduled scrape jobs and run a pool of workers that drain them.
+
+    python scripts/scrape_worker.py enqueue --schedule adapters/schedule.json
+    python scripts/scrape_worker.py enqueue asos.com zalando.de --interval 3600 --run-now
+    python scripts/scrape_worker.py run --processes 4 --threads 4
+
+``run`` starts ``--processes`` worker processes with ``--threads`` claim loops each; every
+loop leases one due job at a time from ``scrape_jobs`` (see scrape_jobs.py), so workers
+on any number of hosts can share the queue. ``--drain`` exits once nothing is due, which
+is handy for cron and benchmarks. The worker deployments run ``enqueue`` and then ``run``.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy.exc import OperationalError
+
+from adapter_snapshot import current_snapshot, load_adapters, start_snapshot_refresher
+from db import Base, SessionLocal, engine
+from domains import refresh_aliases
+from scrape_jobs import DEFAULT_INTERVAL_SECONDS, claim_jobs, enqueue_domains, enqueue_schedule, queue_stats, run_job
+
+
+def _load_adapters() -> Optional[Dict]:
+    path = ROOT / "adapters.json"
+    try:
+        return json.loads(path.read_text()) if path.exists() else None
+    except ValueError:
+        return None
+
+
+def _enqueue(args: argparse.Namespace) -> None:
+    adapters = _load_adapters()
+    db = SessionLocal()
+    try:
+        refresh_aliases(db, adapters)
+        schedule_path = Path(args.schedule)
+        if args.domains:
+            created = enqueue_domains(db, args.domains, args.interval, args.priority, args.run_now)
+        elif schedule_path.exists():
+            created = enqueue_schedule(db, json.loads(schedule_path.read_text()))
+        else:
+            allowlist = [s for s in os.getenv("ALLOWLIST_DOMAINS", "").split(",") if s.strip()]
+            created = enqueue_domains(db, allowlist, args.interval, args.priority, args.run_now)
+        print(json.dumps({"created": created, "queue": queue_stats(db)}))
+    finally:
+        db.close()
+
+
+def _job_adapters(fallback: Optional[Dict], shared: bool) -> Optional[Dict]:
+    """The host's current adapter snapshot, so a long-running worker follows catalog changes."""
+    snapshot = current_snapshot() if shared else None
+    return snapshot.adapters() if snapshot is not None else fallback
+
+
+def _claim_loop(
+    worker_id: str,
+    adapters: Optional[Dict],
+    shared: bool,
+    args: argparse.Namespace,
+    totals: Dict[str, int],
+    lock: threading.Lock,
+) -> None:
+    db = SessionLocal()
+    try:
+        while True:
+            try:
+                jobs = claim_jobs(db, worker_id, limit=1)
+            except OperationalError:
+                # Lock contention (SQLite busy timeout); back off and try again.
+                db.rollback()
+                time.sleep(args.poll)
+                continue
+            if not jobs:
+                if args.drain:
+                    return
+                time.sleep(args.poll)
+                continue
+            for job in jobs:
+                try:
+                    result = run_job(db, _job_adapters(adapters, shared), job, limit=args.limit)
+                except Exception:
+                    # Never let one job end the loop; its lease expires and it is claimed again.
+                    db.rollback()
+                    result = {"outcome": "crashed", "codes": 0}
+                with lock:
+                    totals[result["outcome"]] = totals.get(result["outcome"], 0) + 1
+                    totals["codes"] = totals.get("codes", 0) + result["codes"]
+    finally:
+        db.close()
+
+
+def _worker(index: int, args: argparse.Namespace) -> Dict[str, int]:
+    adapters = _load_adapters()
+    db = SessionLocal()
+    try:
+        refresh_aliases(db, adapters)
+        snapshot = load_adapters(db, adapters)
+    finally:
+        db.close()
+    # Without adapters.json the snapshot is this process's own; never mix in the host's.
+    shared = adapters is not None
+    if shared:
+        start_snapshot_refresher(SessionLocal, adapters)
+    totals: Dict[str, int] = {}
+    lock = threading.Lock()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [
+        threading.Thread(target=_claim_loop, args=(f"{worker_id}:{i}", snapshot, shared, args, totals, lock), daemon=True)
+        for i in range(max(1, args.threads))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return totals
+
+
+def _run(args: argparse.Namespace) -> None:
+    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    processes = max(1, args.processes)
+    if processes == 1:
+        results = [_worker(0, args)]
+    else:
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            results = pool.starmap(_worker, [(i, args) for i in range(processes)])
+    totals: Dict[str, int] = {}
+    for result in results:
+        for key, value in result.items():
+            totals[key] = totals.get(key, 0) + value
+    elapsed = time.perf_counter() - started
+    jobs = sum(v for k, v in totals.items() if k != "codes")
+    print(json.dumps({"seconds": round(elapsed, 2), "jobs": jobs, "jobs_per_second": round(jobs / elapsed, 2) if elapsed else 0.0, **totals}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Durable scrape job queue.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = sub.add_parser("enqueue", help="Create or retune jobs for domains")
+    enqueue.add_argument("domains", nargs="*", help="Domains to enqueue (default: --schedule, then ALLOWLIST_DOMAINS)")
+    enqueue.add_argument("--schedule", default=str(ROOT / "adapters" / "schedule.json"))
+    enqueue.add_argument("--interval", type=int, default=DEFAULT_INTERVAL_SECONDS, help="Seconds between runs")
+    enqueue.add_argument("--priority", type=int, default=0)
+    enqueue.add_argument("--run-now", action="store_true", help="Make existing jobs due immediately")
+
+    run = sub.add_parser("run", help="Run workers until interrupted (or until idle with --drain)")
+    run.add_argument("--processes", type=int, default=int(os.getenv("SCRAPE_WORKER_PROCESSES", "1")))
+    run.add_argument("--threads", type=int, default=int(os.getenv("SCRAPE_WORKER_THREADS", "4")), help="Claim loops per process")
+    run.add_argument("--poll", type=float, default=5.0, help="Seconds to wait when nothing is due")
+    run.add_argument("--limit", type=int, default=int(os.getenv("SCRAPE_LIMIT", "50")), help="Codes kept per domain")
+    run.add_argument("--drain", action="store_true", help="Exit once no job is due")
+
+    args = parser.parse_args()
+    if args.command == "enqueue":
+        Base.metadata.create_all(bind=engine)
+        _enqueue(args)
+    else:
+        _run(args)
+
+
+if __name__ == "__main__":  # pragma: no cover - CLI entry point
+    main()
@@ -9,8 +9,9 @@ import requests
 from sqlalchemy.orm import Session
 
 from db import SessionLocal
-from catalog import ingest_catalog_entries, normalize_domain
-from models import RetailerProfile
+from adapter_snapshot import ENABLED as SNAPSHOT_ENABLED, ensure_snapshot
+from catalog import deactivate_missing_retailers, ingest_catalog_entries
+from domains import clean_domain
 
 
 def _read_manifest(path: str) -> List[Dict[str, Any]]:
@@ -53,15 +54,20 @@ def _batched(iterable: Iterable[Dict[str, Any]], size: int) -> Iterable[List[Dic
         yield batch
 
 
+def _base_adapters() -> Dict[str, Any]:
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "adapters.json")
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {"platforms": {}, "retailers": []}
+
+
 def _deactivate_missing(session: Session, keep_domains: Iterable[str]) -> None:
-    keep = {normalize_domain(domain) for domain in keep_domains if domain}
+    keep = {clean_domain(domain) for domain in keep_domains if domain}
     if not keep:
         return
-    (
-        session.query(RetailerProfile)
-        .filter(~RetailerProfile.domain.in_(keep))
-        .update({"active": False}, synchronize_session=False)
-    )
+    deactivate_missing_retailers(session, keep)
 
 
 def main(argv: List[str] | None = None) -> int:
@@ -84,6 +90,9 @@ def main(argv: List[str] | None = None) -> int:
         if args.drop_missing:
             _deactivate_missing(session, (payload.get("domain") for payload in entries))
         session.commit()
+        if SNAPSHOT_ENABLED:
+            # Hand the new catalog to every worker on this host now rather than at their next check.
+            ensure_snapshot(session, _base_adapters())
     finally:
         session.close()
 
@@ -0,0 +1,271 @@
+"""Hash-sharded storage for ``code_attempts``.
+
+``ATTEMPT_SHARDS`` names the databases that hold attempt rows: a path to a JSON shard
+map, inline JSON, or a comma-separated list of URLs. A map is either a list or
+``{"shards": [...]}`` whose entries are URLs or ``{"url": ..., "read_url": ...}``.
+Every row for a domain lives on one shard, picked by a jump consistent hash of the
+canonical domain, so per-domain reads (ranking stats, /suggest success codes) and
+/event writes touch exactly one database. Exports fan out to every shard and merge the
+streams in (created_at, id) order. Growing from N to N+1 shards only moves about
+1/(N+1) of the domains; ``scripts/reshard_attempts.py`` moves the rows.
+
+Unset, there is a single shard and every helper hands back the main database sessions,
+so nothing changes. Ids are per shard; (domain, id) identifies a row.
+"""
+
+import hashlib
+import json
+import os
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, func, insert, select, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from db import DATABASE_URL, ReadSessionLocal, WriteSessionLocal, _async_url, build_async_engines, build_engines
+from domains import canonical_domain
+from models import CodeAttempt
+
+
+def load_shard_map(spec: Optional[str]) -> List[Dict[str, Optional[str]]]:
+    """Parse a shard map (JSON file path, inline JSON or comma-separated URLs) into ordered entries."""
+    spec = (spec or "").strip()
+    if not spec:
+        return []
+    if spec[0] in "[{":
+        data = json.loads(spec)
+    elif spec.endswith(".json") or Path(spec).is_file():
+        data = json.loads(Path(spec).read_text())
+    else:
+        data = [url.strip() for url in spec.split(",") if url.strip()]
+    if isinstance(data, dict):
+        data = data.get("shards") or []
+    shards = []
+    for entry in data:
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        if not entry.get("url"):
+            raise ValueError(f"shard map entry without a url: {entry!r}")
+        shards.append({"url": entry["url"], "read_url": entry.get("read_url")})
+    return shards
+
+
+SHARD_MAP = load_shard_map(os.getenv("ATTEMPT_SHARDS"))
+SHARDED = bool(SHARD_MAP)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Lamping & Veach jump consistent hash: a bucket in [0, buckets) for a 64-bit key."""
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def shard_index(domain: str, count: int) -> int:
+    """Shard for ``domain`` (already canonical) among ``count`` shards."""
+    if count <= 1:
+        return 0
+    key = int.from_bytes(hashlib.sha1((domain or "").encode("utf-8")).digest()[:8], "big")
+    return jump_hash(key, count)
+
+
+def shard_count() -> int:
+    return max(1, len(SHARD_MAP))
+
+
+def shard_for(domain: str) -> int:
+    return shard_index(canonical_domain(domain), shard_count())
+
+
+def shard_urls() -> List[str]:
+    return [shard["url"] for shard in SHARD_MAP] or [DATABASE_URL]
+
+
+# Per shard: (primary, read, write) engines and (read, write) session factories.
+_engines = [build_engines(shard["url"], shard["read_url"]) for shard in SHARD_MAP]
+_sessions = [
+    (
+        sessionmaker(autocommit=False, autoflush=False, bind=read),
+        sessionmaker(autocommit=False, autoflush=False, bind=write),
+    )
+    for _primary, read, write in _engines
+]
+_async_sessions: List = []
+
+
+def create_attempt_tables() -> None:
+    """Create ``code_attempts`` (and its indexes) on every shard that lacks it."""
+    for primary, _read, _write in _engines:
+        CodeAttempt.__table__.create(bind=primary, checkfirst=True)
+
+
+def _open(domain: Optional[str], write: bool) -> List[Session]:
+    indexes = [shard_for(domain)] if domain else range(len(_sessions))
+    return [_sessions[index][1 if write else 0]() for index in indexes]
+
+
+@contextmanager
+def _shard_sessions(db: Session, domain: Optional[str], write: bool):
+    if not SHARDED:
+        yield [db]
+        return
+    opened = _open(domain, write)
+    try:
+        yield opened
+    finally:
+        for shard_db in opened:
+            shard_db.close()
+
+
+@contextmanager
+def attempt_read_session(domain: str, db: Session):
+    """``db`` itself when unsharded, else a short-lived read session on ``domain``'s shard."""
+    with _shard_sessions(db, domain, False) as sessions:
+        yield sessions[0]
+
+
+@contextmanager
+def attempt_write_session(domain: str, db: Session):
+    with _shard_sessions(db, domain, True) as sessions:
+        yield sessions[0]
+
+
+def attempt_sessions(db: Session, domain: Optional[str] = None):
+    """Read sessions to query for attempts: ``domain``'s shard, or every shard when no domain is given."""
+    return _shard_sessions(db, domain, False)
+
+
+def attempt_write_sessions(db: Session):
+    """A write session per shard, for maintenance such as retention pruning."""
+    return _shard_sessions(db, None, True)
+
+
+def _async_shard_sessions():
+    # Built on first use, like the main async engine, so the sync service never needs aiosqlite.
+    if not _async_sessions:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        for shard in SHARD_MAP:
+            primary, read = build_async_engines(
+                _async_url(shard["url"]), _async_url(shard["read_url"]) if shard["read_url"] else None
+            )
+            _async_sessions.append(
+                (
+                    async_sessionmaker(read, autoflush=False, expire_on_commit=False),
+                    async_sessionmaker(primary, autoflush=False, expire_on_commit=False),
+                )
+            )
+    return _async_sessions
+
+
+@asynccontextmanager
+async def _async_shard_session_list(db, domain: Optional[str], write: bool):
+    if not SHARDED:
+        yield [db]
+        return
+    factories = _async_shard_sessions()
+    indexes = [shard_for(domain)] if domain else range(len(factories))
+    opened = [factories[index][1 if write else 0]() for index in indexes]
+    try:
+        yield opened
+    finally:
+        for shard_db in opened:
+            await shard_db.close()
+
+
+@asynccontextmanager
+async def async_attempt_read_session(domain: str, db):
+    async with _async_shard_session_list(db, domain, False) as sessions:
+        yield sessions[0]
+
+
+@asynccontextmanager
+async def async_attempt_write_session(domain: str, db):
+    async with _async_shard_session_list(db, domain, True) as sessions:
+        yield sessions[0]
+
+
+def async_attempt_sessions(db, domain: Optional[str] = None):
+    return _async_shard_session_list(db, domain, False)
+
+
+def async_attempt_write_sessions(db):
+    return _async_shard_session_list(db, None, True)
+
+
+# Everything but the per-shard id, which the target assigns.
+MOVE_COLUMNS = [column for column in CodeAttempt.__table__.columns if column.name != "id"]
+
+# Progress of a domain's move, kept on the target and committed with each copied batch.
+attempt_moves = Table(
+    "attempt_moves",
+    MetaData(),
+    Column("source", String, primary_key=True),
+    Column("domain", String, primary_key=True),
+    Column("last_id", Integer, nullable=False),
+)
+
+
+def move_domain_attempts(src: Session, dst: Session, source: str, domain: str, batch_size: int, new_domain: Optional[str] = None) -> int:
+    """Copy ``domain``'s rows from ``src`` to ``dst`` in id order, deleting each batch from ``src`` once copied.
+
+    The target records the last copied source id in ``attempt_moves`` in the same commit as
+    the rows, so after an interruption a re-run first deletes what was already copied and
+    never inserts a row twice, keyed or anonymous. ``new_domain`` rewrites the domain on the
+    way. Returns the rows copied.
+    """
+    attempt_moves.create(bind=dst.get_bind(), checkfirst=True)
+    marker = (attempt_moves.c.source == source) & (attempt_moves.c.domain == domain)
+    moved = 0
+    while True:
+        done = dst.execute(select(attempt_moves.c.last_id).where(marker)).scalar()
+        if done is not None:
+            src.execute(delete(CodeAttempt).where(CodeAttempt.domain == domain, CodeAttempt.id <= done))
+            src.commit()
+        rows = src.execute(
+            select(CodeAttempt.id, *MOVE_COLUMNS)
+            .where(CodeAttempt.domain == domain, CodeAttempt.id > (done or 0))
+            .order_by(CodeAttempt.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        keys = [row.idempotency_key for row in rows if row.idempotency_key]
+        present = set(
+            dst.execute(select(CodeAttempt.idempotency_key).where(CodeAttempt.idempotency_key.in_(keys))).scalars()
+        ) if keys else set()
+        payload = []
+        for row in rows:
+            if row.idempotency_key and row.idempotency_key in present:
+                continue
+            values = {column.name: getattr(row, column.name) for column in MOVE_COLUMNS}
+            if new_domain:
+                values["domain"] = new_domain
+            payload.append(values)
+        if payload:
+            dst.execute(insert(CodeAttempt), payload)
+        if done is None:
+            dst.execute(insert(attempt_moves).values(source=source, domain=domain, last_id=rows[-1].id))
+        else:
+            dst.execute(update(attempt_moves).where(marker).values(last_id=rows[-1].id))
+        dst.commit()
+        moved += len(payload)
+    dst.execute(delete(attempt_moves).where(marker))
+    dst.commit()
+    return moved
+
+
+def shard_row_counts() -> List[Dict[str, int]]:
+    counts = []
+    for index, (read, _write) in enumerate(_sessions or [(ReadSessionLocal, WriteSessionLocal)]):
+        db = read()
+        try:
+            rows = db.execute(select(func.count(CodeAttempt.id))).scalar() or 0
+        finally:
+            db.close()
+        counts.append({"shard": index, "rows": int(rows)})
+    return counts
@@ -0,0 +1,337 @@
+"""Resident per-domain success stats for ranking, in compact array-backed columns.
+
+``/rank`` and ``/suggest`` score candidates against per-code ``n``/``ok``/``avg_saved``/
+``last``. Instead of re-aggregating attempts into a dict of dicts on every call, each
+hot domain keeps its stats resident: interned code strings map to a row index, and the
+numbers live in ``array`` columns (two ints and two doubles per code): about 85 bytes
+per code including its index entry, against about 250 for a dict per code. ``/event``
+updates the row in place. Domains are loaded from the database on first use and warmed
+at startup (the busiest ones first). The store is held under ``RANK_STATS_STORE_BYTES``
+by evicting the least recently used domains.
+
+A load queries the database outside the store lock, so events recorded while it runs are
+buffered and folded into the loaded stats unless the query already returned their row.
+
+A resident domain is reloaded after ``RANK_STATS_STORE_RELOAD_SECONDS``, which lets
+attempts age out of the stats window. Events other processes store are noticed by the
+ranking version poller (ranking.py), which marks the domain stale; a stale domain is
+reloaded once it is ``RANK_STATS_STORE_STALE_RELOAD_SECONDS`` old. Setting the budget to 0 disables the store,
+and ranking then aggregates per call as before.
+"""
+
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from metrics import counter, register_collector
+from telemetry import busiest_domains, success_metric_rows, success_metric_rows_async
+
+STORE_BYTES = int(os.getenv("RANK_STATS_STORE_BYTES", str(64 * 1024 * 1024)))
+RELOAD_SECONDS = float(os.getenv("RANK_STATS_STORE_RELOAD_SECONDS", "300"))
+# Floor between reloads of a domain that other processes keep writing to.
+STALE_RELOAD_SECONDS = float(os.getenv("RANK_STATS_STORE_STALE_RELOAD_SECONDS", "10"))
+WARM_DOMAINS = int(os.getenv("RANK_STATS_WARM_DOMAINS", "200"))
+WINDOW_DAYS = 90
+# Approximate resident cost of one code: its index entry plus four 8-byte column cells.
+CODE_BYTES = 96 + 32
+DOMAIN_BYTES = 512
+
+STATS_STORE_REQUESTS = counter(
+    "disco_rank_stats_store_requests_total",
+    "Ranking stats lookups by result (hit, miss, reload).",
+    labels=("result",),
+)
+STATS_STORE_EVICTIONS = counter(
+    "disco_rank_stats_store_evictions_total",
+    "Domains evicted from the resident ranking stats store to stay within its byte budget.",
+)
+
+_EMPTY = {"n": 0, "ok": 0, "avg_saved": 0.0, "last": 0.0}
+
+
+class DomainStats:
+    """Column store of one domain's per-code stats; ``get`` matches the old dict-of-dicts lookup."""
+
+    __slots__ = ("index", "n", "ok", "saved", "last", "loaded_at", "stale")
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.n = array("l")
+        self.ok = array("l")
+        self.saved = array("d")
+        self.last = array("d")
+        self.loaded_at = time.monotonic()
+        # Set when another process stored events for the domain since this load.
+        self.stale = False
+
+    def _row(self, code: str) -> int:
+        row = self.index.get(code)
+        if row is None:
+            # Columns grow first, so a concurrent reader never sees an index past their end.
+            for column in (self.n, self.ok):
+                column.append(0)
+            for column in (self.saved, self.last):
+                column.append(0.0)
+            row = len(self.n) - 1
+            self.index[sys.intern(code)] = row
+        return row
+
+    def add(self, code: str, success: bool, saved: Optional[float], last: Optional[float]) -> None:
+        row = self._row(code)
+        self.n[row] += 1
+        if success or (saved or 0.0) > 0:
+            self.ok[row] += 1
+        self.saved[row] += saved or 0.0
+        if last and last > self.last[row]:
+            self.last[row] = last
+
+    def get(self, code: str, default: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+        row = self.index.get(code)
+        if row is None:
+            return _EMPTY if default is None else default
+        n = self.n[row]
+        return {"n": n, "ok": self.ok[row], "avg_saved": self.saved[row] / n if n else 0.0, "last": self.last[row]}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def nbytes(self) -> int:
+        return DOMAIN_BYTES + CODE_BYTES * len(self.index)
+
+
+def _build(rows) -> DomainStats:
+    stats = DomainStats()
+    for code, success, saved, created_at, _id in rows:
+        stats.add(code, success, saved, created_at.timestamp() if created_at else None)
+    return stats
+
+
+class StatsStore:
+    def __init__(
+        self,
+        budget: int = STORE_BYTES,
+        reload_seconds: float = RELOAD_SECONDS,
+        stale_reload_seconds: float = STALE_RELOAD_SECONDS,
+    ):
+        self.budget = budget
+        self.reload_seconds = reload_seconds
+        self.stale_reload_seconds = stale_reload_seconds
+        self._domains: "OrderedDict[str, DomainStats]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Domain -> loads in flight, and the events recorded since the first of them began.
+        self._loads: Dict[str, int] = {}
+        self._pending: Dict[str, List[tuple]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def lookup(self, domain: str) -> Tuple[Optional[DomainStats], str]:
+        """The resident stats for ``domain`` and why they are (not) usable: hit, miss or reload."""
+        with self._lock:
+            stats = self._domains.get(domain)
+            if stats is None:
+                return None, "miss"
+            age = time.monotonic() - stats.loaded_at
+            if age > self.reload_seconds or (stats.stale and age > self.stale_reload_seconds):
+                return None, "reload"
+            self._domains.move_to_end(domain)
+            return stats, "hit"
+
+    def put(self, domain: str, stats: DomainStats) -> DomainStats:
+        with self._lock:
+            self._put(domain, stats)
+        return stats
+
+    def _put(self, domain: str, stats: DomainStats) -> None:
+        old = self._domains.pop(domain, None)
+        if old is not None:
+            self._bytes -= old.nbytes()
+        self._domains[domain] = stats
+        self._bytes += stats.nbytes()
+        self._evict()
+
+    def mark_stale(self, domain: str) -> None:
+        """Note that ``domain`` has events this process has not seen; it reloads soon."""
+        with self._lock:
+            stats = self._domains.get(domain)
+            if stats is not None:
+                stats.stale = True
+
+    def begin_load(self, domain: str) -> None:
+        """Start buffering ``domain``'s events; call before querying its rows."""
+        with self._lock:
+            self._loads[domain] = self._loads.get(domain, 0) + 1
+            self._pending.setdefault(domain, [])
+
+    def finish_load(self, domain: str, rows) -> DomainStats:
+        """Build ``domain`` from ``rows`` plus the events buffered since ``begin_load`` that they miss."""
+        stats = _build(rows)
+        with self._lock:
+            pending = self._end_load(domain)
+            if pending:
+                loaded = {row[-1] for row in rows}
+                for event_id, code, success, saved, last in pending:
+                    if event_id is None or event_id not in loaded:
+                        stats.add(code, success, saved, last)
+            if self.enabled:
+                self._put(domain, stats)
+        return stats
+
+    def abort_load(self, domain: str) -> None:
+        with self._lock:
+            self._end_load(domain)
+
+    def _end_load(self, domain: str) -> List[tuple]:
+        pending = self._pending.get(domain, [])
+        if self._loads.get(domain, 0) <= 1:
+            self._loads.pop(domain, None)
+            self._pending.pop(domain, None)
+        else:
+            self._loads[domain] -= 1
+        return list(pending)
+
+    def record(
+        self,
+        domain: str,
+        code: str,
+        success: bool,
+        saved: Optional[float],
+        last: Optional[float] = None,
+        event_id: Optional[int] = None,
+    ) -> bool:
+        """Fold one stored event into a resident domain in place; False if the domain is not resident."""
+        last = datetime.utcnow().timestamp() if last is None else last
+        with self._lock:
+            pending = self._pending.get(domain)
+            if pending is not None:
+                pending.append((event_id, code, success, saved, last))
+            stats = self._domains.get(domain)
+            if stats is None:
+                return False
+            before = len(stats)
+            stats.add(code, success, saved, last)
+            self._bytes += CODE_BYTES * (len(stats) - before)
+            self._evict()
+        return True
+
+    def _evict(self) -> None:
+        # Keep at least the domain just touched, however large it is.
+        while self._bytes > self.budget and len(self._domains) > 1:
+            _domain, stats = self._domains.popitem(last=False)
+            self._bytes -= stats.nbytes()
+            STATS_STORE_EVICTIONS.inc()
+
+    def usage(self) -> Tuple[int, int, int]:
+        with self._lock:
+            return len(self._domains), sum(len(stats) for stats in self._domains.values()), self._bytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._domains.clear()
+            self._bytes = 0
+            self._loads.clear()
+            self._pending.clear()
+
+
+store = StatsStore()
+
+
+def domain_stats(db: Session, domain: str) -> DomainStats:
+    """Resident stats for ``domain`` (canonical), loading them from the database when needed."""
+    stats, result = store.lookup(domain)
+    STATS_STORE_REQUESTS.inc(result=result)
+    if stats is not None:
+        return stats
+    return _load(db, domain)
+
+
+def _load(db: Session, domain: str) -> DomainStats:
+    store.begin_load(domain)
+    try:
+        rows = success_metric_rows(db, domain=domain, days=WINDOW_DAYS)
+    except BaseException:
+        store.abort_load(domain)
+        raise
+    return store.finish_load(domain, rows)
+
+
+async def domain_stats_async(db: AsyncSession, domain: str) -> DomainStats:
+    stats, result = store.lookup(domain)
+    STATS_STORE_REQUESTS.inc(result=result)
+    if stats is not None:
+        return stats
+    store.begin_load(domain)
+    try:
+        rows = await success_metric_rows_async(db, domain=domain, days=WINDOW_DAYS)
+    except BaseException:
+        store.abort_load(domain)
+        raise
+    return store.finish_load(domain, rows)
+
+
+def record_event(domain: str, code: str, success: bool, saved: Optional[float], event_id: Optional[int] = None) -> bool:
+    return store.record(domain, code, success, saved, event_id=event_id)
+
+
+def warm_store(db: Session, limit: int = WARM_DOMAINS) -> int:
+    """Load the busiest domains of the stats window, up to ``limit`` or the byte budget."""
+    warmed = 0
+    for domain in busiest_domains(db, days=WINDOW_DAYS, limit=limit):
+        _load(db, domain)
+        warmed += 1
+        if store.usage()[2] >= store.budget:
+            break
+    return warmed
+
+
+def start_store_warmup(session_factory, limit: int = WARM_DOMAINS) -> bool:
+    """Warm the store on a daemon thread so startup does not wait on it."""
+    if not store.enabled or limit <= 0:
+        return False
+
+    def run() -> None:
+        db = session_factory()
+        try:
+            warm_store(db, limit)
+        except Exception:
+            db.rollback()
+        finally:
+            db.close()
+
+    threading.Thread(target=run, name="rank-stats-warmup", daemon=True).start()
+    return True
+
+
+def _collect_store_metrics():
+    domains, codes, used = store.usage()
+    yield (
+        "disco_rank_stats_store_bytes",
+        "gauge",
+        "Approximate bytes held by the resident ranking stats store (limit RANK_STATS_STORE_BYTES).",
+        [("disco_rank_stats_store_bytes", {}, used)],
+    )
+    yield (
+        "disco_rank_stats_store_domains",
+        "gauge",
+        "Domains resident in the ranking stats store.",
+        [("disco_rank_stats_store_domains", {}, domains)],
+    )
+    yield (
+        "disco_rank_stats_store_codes",
+        "gauge",
+        "Per-code rows resident in the ranking stats store.",
+        [("disco_rank_stats_store_codes", {}, codes)],
+    )
+
+
+register_collector(_collect_store_metrics)
@@ -0,0 +1,263 @@
+"""Materialized top-N suggestion sets for domains that get /suggest traffic.
+
+A /suggest call without ``url``/``html`` depends only on per-domain state, so the ranked
+result is computed ahead of time and served from memory (backed by ``SuggestionSet``
+rows shared across processes). Sets are recomputed in the background, at most once per
+``SUGGEST_SET_MIN_INTERVAL_SECONDS`` per domain, when an event or seed lands, when a
+background scrape refresh changes a page's codes, or when a catalog sync marks the row
+stale. A domain without a set is served live once and materialized for next time.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from cachetools import LRUCache
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from db import SessionLocal
+from metrics import counter
+from models import SuggestionSet
+from ranking import domain_version, score_candidates
+from scraper import add_refresh_listener
+from suggestions import gather_candidates, merge_candidates
+
+SET_SIZE = int(os.getenv("SUGGEST_SET_SIZE", "50"))
+MAX_AGE = int(os.getenv("SUGGEST_SET_MAX_AGE_SECONDS", "900"))
+MAX_STALE = int(os.getenv("SUGGEST_SET_MAX_STALE_SECONDS", "3600"))
+MIN_INTERVAL = float(os.getenv("SUGGEST_SET_MIN_INTERVAL_SECONDS", "30"))
+# How long a process trusts its in-memory copy before re-reading the shared row.
+RECHECK_SECONDS = float(os.getenv("SUGGEST_SET_RECHECK_SECONDS", "30"))
+MAX_DOMAINS = int(os.getenv("SUGGEST_SET_MAX_DOMAINS", "2000"))
+WORKERS = int(os.getenv("SUGGEST_SET_WORKERS", "2"))
+# Cold requests a domain needs before it is worth materializing.
+HOT_AFTER = int(os.getenv("SUGGEST_SET_HOT_AFTER", "2"))
+
+SUGGEST_SET_REQUESTS = counter(
+    "disco_suggest_set_requests_total",
+    "/suggest calls without url/html by how they were served (fresh, stale, cold).",
+    labels=("result",),
+)
+SUGGEST_SET_REFRESHES = counter(
+    "disco_suggest_set_refreshes_total",
+    "Background suggestion set recomputations by outcome.",
+    labels=("outcome",),
+)
+
+_sets: LRUCache = LRUCache(maxsize=max(1, MAX_DOMAINS))
+_sets_lock = threading.Lock()
+_cold_hits: LRUCache = LRUCache(maxsize=max(1, MAX_DOMAINS * 4))
+_due: Dict[str, float] = {}
+_due_cond = threading.Condition()
+_computing = set()
+_adapters: Optional[Dict] = None
+_scheduler: Optional[threading.Thread] = None
+_set_pool = ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix="suggest-set")
+
+
+def _entry_from_row(domain: str, row: SuggestionSet) -> Dict[str, Any]:
+    return {
+        "ranked": [tuple(item) for item in json.loads(row.ranked_json or "[]")],
+        "sources": json.loads(row.sources_json or "{}"),
+        "computed_at": row.computed_at,
+        "stale": bool(row.stale),
+        # Other processes' writes reach domain_version through the ranking version poller.
+        "version": domain_version(domain),
+        "checked_at": time.monotonic(),
+    }
+
+
+def _remember(domain: str, entry: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    with _sets_lock:
+        if entry is None:
+            _sets.pop(domain, None)
+        else:
+            _sets[domain] = entry
+    return entry
+
+
+def _cached_entry(domain: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """(memory entry, whether it is recent enough to skip re-reading the row)."""
+    with _sets_lock:
+        entry = _sets.get(domain)
+    return entry, entry is not None and time.monotonic() - entry["checked_at"] < RECHECK_SECONDS
+
+
+def load_suggestion_set(db: Session, domain: str) -> Optional[Dict[str, Any]]:
+    entry, recent = _cached_entry(domain)
+    if recent:
+        return entry
+    row = db.execute(select(SuggestionSet).where(SuggestionSet.domain == domain).limit(1)).scalars().first()
+    return _refreshed_entry(domain, entry, row)
+
+
+async def load_suggestion_set_async(db: AsyncSession, domain: str) -> Optional[Dict[str, Any]]:
+    entry, recent = _cached_entry(domain)
+    if recent:
+        return entry
+    row = (
+        await db.execute(select(SuggestionSet).where(SuggestionSet.domain == domain).limit(1))
+    ).scalars().first()
+    return _refreshed_entry(domain, entry, row)
+
+
+def _refreshed_entry(domain: str, entry: Optional[Dict[str, Any]], row: Optional[SuggestionSet]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return _remember(domain, None)
+    if entry is not None and entry["computed_at"] == row.computed_at:
+        # Same computation as ours; keep its stats version, pick up a catalog-sync stale flag.
+        entry = dict(entry, stale=entry["stale"] or bool(row.stale), checked_at=time.monotonic())
+        return _remember(domain, entry)
+    return _remember(domain, _entry_from_row(domain, row))
+
+
+def _serve(domain: str, entry: Dict[str, Any], limit: int, adapters: Optional[Dict]) -> Optional[Dict[str, Any]]:
+    age = (datetime.utcnow() - entry["computed_at"]).total_seconds() if entry["computed_at"] else float("inf")
+    stale = entry["stale"] or age > MAX_AGE or entry["version"] != domain_version(domain)
+    if stale:
+        schedule_suggestion_refresh(domain, adapters)
+    if age > MAX_STALE:
+        return None
+    SUGGEST_SET_REQUESTS.inc(result="stale" if stale else "fresh")
+    ranked = entry["ranked"][:limit]
+    return {
+        "ranked": ranked,
+        "metadata": {
+            "domain": domain,
+            "count": len(ranked),
+            "sources": entry["sources"],
+            "scrape_timed_out": False,
+            "precomputed": True,
+            "computed_at": entry["computed_at"].isoformat(),
+            "age_seconds": round(age, 1),
+            "stale": stale,
+        },
+    }
+
+
+def precomputed_suggestions(db: Session, adapters: Optional[Dict], domain: str, limit: int) -> Optional[Dict[str, Any]]:
+    """The materialized result for ``domain`` in ``suggest_codes`` shape, or None to go live.
+
+    Returning None for a cold or expired domain also queues its materialization.
+    """
+    if limit > SET_SIZE:
+        return None
+    return _serve_or_schedule(domain, load_suggestion_set(db, domain), limit, adapters)
+
+
+async def precomputed_suggestions_async(db: AsyncSession, adapters: Optional[Dict], domain: str, limit: int) -> Optional[Dict[str, Any]]:
+    if limit > SET_SIZE:
+        return None
+    return _serve_or_schedule(domain, await load_suggestion_set_async(db, domain), limit, adapters)
+
+
+def _serve_or_schedule(domain: str, entry: Optional[Dict[str, Any]], limit: int, adapters: Optional[Dict]) -> Optional[Dict[str, Any]]:
+    result = _serve(domain, entry, limit, adapters) if entry is not None else None
+    if result is None:
+        SUGGEST_SET_REQUESTS.inc(result="cold")
+        with _sets_lock:
+            hits = _cold_hits[domain] = _cold_hits.get(domain, 0) + 1
+        if hits >= HOT_AFTER or entry is not None:
+            schedule_suggestion_refresh(domain, adapters, force=True)
+    return result
+
+
+def materialize_suggestion_set(adapters: Optional[Dict], domain: str) -> Dict[str, Any]:
+    """Compute the top ``SUGGEST_SET_SIZE`` suggestions for ``domain`` and store them."""
+    version = domain_version(domain)
+    # Same scrape budget as /suggest: an overrunning scrape still warms ScrapeCache for the next recompute.
+    gathered = gather_candidates(adapters, domain, limit=SET_SIZE)
+    ranked = score_candidates(merge_candidates(gathered["sources"], SET_SIZE), gathered["stats"], gathered["seed_counts"])
+    sources = {name: len(codes) for name, codes in gathered["sources"].items()}
+    computed_at = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        row = db.execute(select(SuggestionSet).where(SuggestionSet.domain == domain).limit(1)).scalars().first()
+        if row is None:
+            row = SuggestionSet(domain=domain)
+            db.add(row)
+        row.ranked_json = json.dumps([list(item) for item in ranked])
+        row.sources_json = json.dumps(sources)
+        row.computed_at = computed_at
+        row.stale = False
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another process created the row first; its copy is as good as ours.
+            db.rollback()
+    finally:
+        db.close()
+    entry = {
+        "ranked": ranked,
+        "sources": sources,
+        "computed_at": computed_at,
+        "stale": False,
+        "version": version,
+        "checked_at": time.monotonic(),
+    }
+    return _remember(domain, entry)
+
+
+def schedule_suggestion_refresh(domain: str, adapters: Optional[Dict] = None, force: bool = False) -> bool:
+    """Queue a recompute of ``domain``'s set, debounced to one per ``MIN_INTERVAL``.
+
+    Without ``force`` only domains this process already serves from a set are queued, so
+    events for domains nobody asks suggestions for cost nothing.
+    """
+    global _adapters, _scheduler
+    if adapters is not None:
+        _adapters = adapters
+    with _sets_lock:
+        entry = _sets.get(domain)
+    if entry is None and not force:
+        return False
+    delay = 0.0
+    if entry is not None and entry["computed_at"]:
+        delay = max(0.0, MIN_INTERVAL - (datetime.utcnow() - entry["computed_at"]).total_seconds())
+    due = time.monotonic() + delay
+    with _due_cond:
+        if domain in _computing or _due.get(domain, float("inf")) <= due:
+            return False
+        _due[domain] = due
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_scheduler_loop, name="suggest-set-scheduler", daemon=True)
+            _scheduler.start()
+        _due_cond.notify()
+    return True
+
+
+def _scheduler_loop() -> None:
+    while True:
+        with _due_cond:
+            while True:
+                now = time.monotonic()
+                ready = [domain for domain, due in _due.items() if due <= now]
+                if ready:
+                    break
+                _due_cond.wait(min(_due.values()) - now if _due else None)
+            for domain in ready:
+                del _due[domain]
+                _computing.add(domain)
+        for domain in ready:
+            _set_pool.submit(_refresh, domain)
+
+
+def _refresh(domain: str) -> None:
+    try:
+        materialize_suggestion_set(_adapters, domain)
+        SUGGEST_SET_REFRESHES.inc(outcome="ok")
+    except Exception:
+        SUGGEST_SET_REFRESHES.inc(outcome="error")
+    finally:
+        with _due_cond:
+            _computing.discard(domain)
+
+
+add_refresh_listener(schedule_suggestion_refresh)
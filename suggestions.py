@@ -0,0 +1,369 @@
+"""Candidate gathering, merging, and scoring for the /suggest endpoint."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from catalog import (
+    get_retailer_inventory,
+    get_retailer_inventory_async,
+    get_retailer_overrides,
+    get_retailer_overrides_async,
+)
+from db import AsyncReadSessionLocal, AsyncSessionLocal, ReadSessionLocal, SessionLocal
+from metrics import counter, histogram
+from models import CodeAttempt, CodeSeed
+from ranking import load_rank_inputs, load_rank_inputs_async, rank_codes, read_primary, score_candidates
+from scraper import scrape_pipeline, scrape_pipeline_async
+from shards import async_attempt_read_session, attempt_read_session
+
+SUGGEST_WORKERS = int(os.getenv("SUGGEST_WORKERS", "16") or 16)
+SCRAPE_BUDGET_SECONDS = float(os.getenv("SUGGEST_SCRAPE_BUDGET_SECONDS", "3") or 0)
+# Live scrapes run on their own pool, at most SCRAPE_WORKERS at once counting ones that
+# overran their budget, so slow retailers never hold the threads the database sources need.
+SCRAPE_WORKERS = int(os.getenv("SUGGEST_SCRAPE_WORKERS", "8") or 8)
+# Database sources still answer within this; a source that does not is left out.
+SOURCE_TIMEOUT_SECONDS = float(os.getenv("SUGGEST_SOURCE_TIMEOUT_SECONDS", "10") or 10)
+
+# Merge priority when the candidate list has to be truncated before scoring.
+SOURCE_ORDER = ("catalog", "success", "scrape", "seed")
+
+SUGGEST_STAGE_SECONDS = histogram(
+    "disco_suggest_stage_seconds",
+    "Time spent per /suggest stage (source gathering, merge, ranking, serialization).",
+    labels=("stage",),
+)
+SUGGEST_SOURCES_SKIPPED = counter(
+    "disco_suggest_sources_skipped_total",
+    "Candidate sources left out of a suggestion: scrape slots all busy, or a source past its deadline.",
+    labels=("source", "reason"),
+)
+
+_pool = ThreadPoolExecutor(max_workers=max(1, SUGGEST_WORKERS), thread_name_prefix="suggest")
+_scrape_pool = ThreadPoolExecutor(max_workers=max(1, SCRAPE_WORKERS), thread_name_prefix="suggest-scrape")
+_scrape_slots = threading.BoundedSemaphore(max(1, SCRAPE_WORKERS))
+# The async path's scrape slots, same limit; only the event loop thread touches it.
+_async_scrape_slots = asyncio.Semaphore(max(1, SCRAPE_WORKERS))
+# Live scrapes started on the async path; referenced until they finish so they are not garbage collected.
+_background_scrapes: Set[asyncio.Task] = set()
+
+
+def _in_session(stage: str, fn: Callable[..., Any], *args, primary: bool = False, **kwargs) -> Any:
+    # Sessions are not thread-safe, so every gathered source gets its own. Only the scrape
+    # writes (ScrapeCache); the other sources can be served by the read pool or a replica,
+    # unless ``primary`` (the domain was just written and the replica may lag).
+    db = SessionLocal() if primary or stage == "scrape" else ReadSessionLocal()
+    try:
+        with SUGGEST_STAGE_SECONDS.time(stage=stage):
+            return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+def _catalog_codes(db: Session, domain: str, limit: int) -> List[str]:
+    return [item.get("code") for item in get_retailer_inventory(db, domain, limit)]
+
+
+def _success_query(domain: str, limit: int):
+    return (
+        select(CodeAttempt.code)
+        .where(CodeAttempt.domain == domain, CodeAttempt.success == True)
+        .order_by(CodeAttempt.created_at.desc())
+        .limit(limit)
+    )
+
+
+def _seed_query(domain: str, limit: int):
+    return (
+        select(CodeSeed.code)
+        .where(CodeSeed.domain == domain)
+        .order_by(CodeSeed.created_at.desc())
+        .limit(limit)
+    )
+
+
+def _success_codes(db: Session, domain: str, limit: int) -> List[str]:
+    with attempt_read_session(domain, db) as shard_db:
+        return list(shard_db.execute(_success_query(domain, limit)).scalars())
+
+
+def _seed_codes(db: Session, domain: str, limit: int) -> List[str]:
+    return list(db.execute(_seed_query(domain, limit)).scalars())
+
+
+def _scraped_codes(
+    db: Session,
+    adapters: Optional[Dict],
+    domain: str,
+    host: Optional[str],
+    url: Optional[str],
+    html: Optional[str],
+    limit: int,
+) -> List[str]:
+    overrides = get_retailer_overrides(db, domain)
+    return scrape_pipeline(db, adapters, domain=host or domain, url=url, html=html, limit=limit, overrides=overrides)
+
+
+def _submit_scrape(*args) -> Optional[Future]:
+    """Start a live scrape on the scrape pool; None when every scrape slot is taken."""
+    if not _scrape_slots.acquire(blocking=False):
+        SUGGEST_SOURCES_SKIPPED.inc(source="scrape", reason="busy")
+        return None
+    try:
+        future = _scrape_pool.submit(_in_session, "scrape", _scraped_codes, *args)
+    except RuntimeError:
+        _scrape_slots.release()
+        return None
+    future.add_done_callback(lambda _future: _scrape_slots.release())
+    return future
+
+
+def _source_result(future: Future, name: str, default: Any, deadline: float) -> Any:
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeout:
+        SUGGEST_SOURCES_SKIPPED.inc(source=name, reason="timeout")
+        return default
+
+
+def gather_candidates(
+    adapters: Optional[Dict],
+    domain: str,
+    url: Optional[str] = None,
+    html: Optional[str] = None,
+    limit: int = 25,
+    scrape_budget: Optional[float] = None,
+    host: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Query every candidate source concurrently.
+
+    ``domain`` is the canonical key; ``host`` is the site the caller asked for, which the
+    live scrape fetches (regional sites carry their own codes). The live scrape only gets
+    ``scrape_budget`` seconds (0: no live scrape; given ``html`` is still parsed). A scrape
+    that overruns keeps going in the background, warming ``ScrapeCache`` for the next
+    call, while this call returns without it. Database sources get
+    ``SUGGEST_SOURCE_TIMEOUT_SECONDS``.
+    """
+    budget = SCRAPE_BUDGET_SECONDS if scrape_budget is None else scrape_budget
+    deadline = time.monotonic() + SOURCE_TIMEOUT_SECONDS
+    if html:
+        # Parsing a page the client sent fetches nothing, so it needs no scrape slot.
+        scrape_future: Optional[Future] = _pool.submit(_in_session, "scrape", _scraped_codes, adapters, domain, host, url, html, limit)
+    elif budget > 0:
+        scrape_future = _submit_scrape(adapters, domain, host, url, html, limit)
+    else:
+        scrape_future = None
+    primary = read_primary(domain)
+    futures = {
+        "catalog": _pool.submit(_in_session, "catalog", _catalog_codes, domain, limit, primary=primary),
+        "success": _pool.submit(_in_session, "success", _success_codes, domain, limit, primary=primary),
+        "seed": _pool.submit(_in_session, "seed", _seed_codes, domain, limit, primary=primary),
+        "rank_inputs": _pool.submit(_in_session, "rank_inputs", load_rank_inputs, domain, primary=primary),
+    }
+    if scrape_future is not None:
+        wait([scrape_future], timeout=budget if budget > 0 else SOURCE_TIMEOUT_SECONDS)
+
+    sources: Dict[str, List[str]] = {}
+    for name in ("catalog", "success", "seed"):
+        sources[name] = _source_result(futures[name], name, [], deadline)
+    scrape_timed_out = scrape_future is not None and not scrape_future.done()
+    sources["scrape"] = scrape_future.result() if scrape_future is not None and scrape_future.done() else []
+    stats, seed_counts = _source_result(futures["rank_inputs"], "rank_inputs", ({}, {}), deadline)
+    return {
+        "sources": sources,
+        "stats": stats,
+        "seed_counts": seed_counts,
+        "scrape_timed_out": scrape_timed_out,
+    }
+
+
+def merge_candidates(sources: Dict[str, List[str]], limit: int) -> List[str]:
+    merged: List[str] = []
+    seen = set()
+    for name in SOURCE_ORDER:
+        for c in sources.get(name) or []:
+            cu = (c or "").strip().upper()
+            if cu and cu not in seen:
+                merged.append(cu)
+                seen.add(cu)
+            if len(merged) >= limit:
+                return merged
+    return merged
+
+
+def suggest_codes(
+    db: Session,
+    adapters: Optional[Dict],
+    domain: str,
+    url: Optional[str] = None,
+    html: Optional[str] = None,
+    limit: int = 25,
+    host: Optional[str] = None,
+) -> Dict[str, Any]:
+    with SUGGEST_STAGE_SECONDS.time(stage="gather"):
+        gathered = gather_candidates(adapters, domain, url=url, html=html, limit=limit, host=host)
+    with SUGGEST_STAGE_SECONDS.time(stage="rank"):
+        merged = merge_candidates(gathered["sources"], limit)
+        ranked = rank_codes(db, domain, merged, stats=gathered["stats"], seed_counts=gathered["seed_counts"])
+    return {
+        "ranked": ranked,
+        "metadata": {
+            "domain": domain,
+            "count": len(ranked),
+            "sources": {name: len(codes) for name, codes in gathered["sources"].items()},
+            "scrape_timed_out": gathered["scrape_timed_out"],
+        },
+    }
+
+
+async def _in_async_session(stage: str, fn: Callable[..., Any], *args, primary: bool = False, **kwargs) -> Any:
+    # AsyncSession cannot run concurrent statements either, so each source opens its own.
+    async with (AsyncSessionLocal() if primary or stage == "scrape" else AsyncReadSessionLocal()) as db:
+        with SUGGEST_STAGE_SECONDS.time(stage=stage):
+            return await fn(db, *args, **kwargs)
+
+
+async def _catalog_codes_async(db: AsyncSession, domain: str, limit: int) -> List[str]:
+    return [item.get("code") for item in await get_retailer_inventory_async(db, domain, limit)]
+
+
+async def _success_codes_async(db: AsyncSession, domain: str, limit: int) -> List[str]:
+    async with async_attempt_read_session(domain, db) as shard_db:
+        return list((await shard_db.execute(_success_query(domain, limit))).scalars())
+
+
+async def _seed_codes_async(db: AsyncSession, domain: str, limit: int) -> List[str]:
+    return list((await db.execute(_seed_query(domain, limit))).scalars())
+
+
+async def _scraped_codes_async(
+    db: AsyncSession,
+    adapters: Optional[Dict],
+    domain: str,
+    host: Optional[str],
+    url: Optional[str],
+    html: Optional[str],
+    limit: int,
+) -> List[str]:
+    overrides = await get_retailer_overrides_async(db, domain)
+    return await scrape_pipeline_async(db, adapters, domain=host or domain, url=url, html=html, limit=limit, overrides=overrides)
+
+
+async def _start_scrape_task(html: Optional[str], *args) -> Optional[asyncio.Task]:
+    """Start a live scrape task; None when every scrape slot is taken (given ``html`` needs none)."""
+    slot = not html
+    if slot:
+        if _async_scrape_slots.locked():
+            SUGGEST_SOURCES_SKIPPED.inc(source="scrape", reason="busy")
+            return None
+        # Not locked, so this returns without suspending.
+        await _async_scrape_slots.acquire()
+    task = asyncio.ensure_future(_in_async_session("scrape", _scraped_codes_async, *args))
+    _background_scrapes.add(task)
+    task.add_done_callback(lambda done: _scrape_task_done(done, slot))
+    return task
+
+
+def _scrape_task_done(task: asyncio.Task, slot: bool) -> None:
+    _background_scrapes.discard(task)
+    if slot:
+        _async_scrape_slots.release()
+    if not task.cancelled():
+        # Retrieved here so a scrape nobody waited for does not log "exception was never retrieved".
+        task.exception()
+
+
+async def _source_result_async(source: Awaitable[Any], name: str, default: Any, deadline: float) -> Any:
+    try:
+        return await asyncio.wait_for(source, max(0.0, deadline - asyncio.get_running_loop().time()))
+    except asyncio.TimeoutError:
+        SUGGEST_SOURCES_SKIPPED.inc(source=name, reason="timeout")
+        return default
+
+
+async def gather_candidates_async(
+    adapters: Optional[Dict],
+    domain: str,
+    url: Optional[str] = None,
+    html: Optional[str] = None,
+    limit: int = 25,
+    scrape_budget: Optional[float] = None,
+    host: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Async counterpart of ``gather_candidates`` with the same scrape budget semantics."""
+    budget = SCRAPE_BUDGET_SECONDS if scrape_budget is None else scrape_budget
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget
+    source_deadline = loop.time() + SOURCE_TIMEOUT_SECONDS
+    scrape_task = None
+    if budget > 0 or html:
+        scrape_task = await _start_scrape_task(html, adapters, domain, host, url, html, limit)
+    primary = read_primary(domain)
+    catalog, success, seed, (stats, seed_counts) = await asyncio.gather(
+        _source_result_async(
+            _in_async_session("catalog", _catalog_codes_async, domain, limit, primary=primary), "catalog", [], source_deadline
+        ),
+        _source_result_async(
+            _in_async_session("success", _success_codes_async, domain, limit, primary=primary), "success", [], source_deadline
+        ),
+        _source_result_async(
+            _in_async_session("seed", _seed_codes_async, domain, limit, primary=primary), "seed", [], source_deadline
+        ),
+        _source_result_async(
+            _in_async_session("rank_inputs", load_rank_inputs_async, domain, primary=primary),
+            "rank_inputs",
+            ({}, {}),
+            source_deadline,
+        ),
+    )
+    scrape_codes: List[str] = []
+    scrape_timed_out = False
+    if scrape_task is not None:
+        remaining = max(0.0, deadline - loop.time()) if budget > 0 else SOURCE_TIMEOUT_SECONDS
+        done, _ = await asyncio.wait([scrape_task], timeout=remaining)
+        scrape_timed_out = scrape_task not in done
+        scrape_codes = [] if scrape_timed_out else scrape_task.result()
+    return {
+        "sources": {
+            "catalog": catalog,
+            "success": success,
+            "seed": seed,
+            "scrape": scrape_codes,
+        },
+        "stats": stats,
+        "seed_counts": seed_counts,
+        "scrape_timed_out": scrape_timed_out,
+    }
+
+
+async def suggest_codes_async(
+    adapters: Optional[Dict],
+    domain: str,
+    url: Optional[str] = None,
+    html: Optional[str] = None,
+    limit: int = 25,
+    host: Optional[str] = None,
+) -> Dict[str, Any]:
+    with SUGGEST_STAGE_SECONDS.time(stage="gather"):
+        gathered = await gather_candidates_async(adapters, domain, url=url, html=html, limit=limit, host=host)
+    with SUGGEST_STAGE_SECONDS.time(stage="rank"):
+        merged = merge_candidates(gathered["sources"], limit)
+        ranked = score_candidates(merged, gathered["stats"], gathered["seed_counts"])
+    return {
+        "ranked": ranked,
+        "metadata": {
+            "domain": domain,
+            "count": len(ranked),
+            "sources": {name: len(codes) for name, codes in gathered["sources"].items()},
+            "scrape_timed_out": gathered["scrape_timed_out"],
+        },
+    }
@@ -3,15 +3,50 @@
 from __future__ import annotations
 
 import hashlib
+import heapq
 import os
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Iterable, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+from cachetools import TTLCache
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from domains import canonical_domain
+from metrics import counter, histogram, register_collector
 from models import CodeAttempt
+from shards import (async_attempt_read_session, async_attempt_sessions, attempt_read_session, attempt_sessions,
+                    attempt_write_session)
 
 RETENTION_DAYS = int(os.getenv("CODE_EVENT_RETENTION_DAYS", "180") or 0)
+# Events without a client key are keyed by (anon_id, domain, code, outcome, time bucket), with
+# a fingerprint of the user agent and totals standing in for a missing anon_id; the previous EVENT_DEDUP_WINDOW_SECONDS bucket is checked too, so a retry is stored once even
+# when it lands just past a bucket edge.
+DEDUP_WINDOW = int(os.getenv("EVENT_DEDUP_WINDOW_SECONDS", "300"))
+DEDUP_MAX_KEYS = int(os.getenv("EVENT_DEDUP_MAX_KEYS", "100000"))
+
+SUCCESS_METRICS_SECONDS = histogram(
+    "disco_success_metrics_seconds",
+    "Time spent aggregating per-code success stats for one domain (query plus fold).",
+)
+SUCCESS_METRICS_ROWS = counter(
+    "disco_success_metrics_rows_total",
+    "CodeAttempt rows scanned while aggregating success stats.",
+)
+EVENT_DUPLICATES = counter(
+    "disco_event_duplicates_total",
+    "Duplicate /event submissions dropped, by where they were caught (memory, db).",
+    labels=("stage",),
+)
+
+# Recently stored idempotency key -> CodeAttempt id. Bounded; the unique index catches what it forgets.
+_recent_events: TTLCache = TTLCache(maxsize=max(1, DEDUP_MAX_KEYS), ttl=max(1, DEDUP_WINDOW * 2))
+_recent_lock = threading.Lock()
+# Per-second duplicate counts for the trailing minute: second -> count.
+_dup_seconds: Dict[int, int] = {}
 
 
 def normalize_code(code: Optional[str]) -> str:
@@ -19,17 +54,6 @@ def normalize_code(code: Optional[str]) -> str:
     return (code or "").strip().upper()
 
 
-def normalize_domain(domain: Optional[str]) -> str:
-    return (
-        (domain or "")
-        .strip()
-        .lower()
-        .replace("http://", "")
-        .replace("https://", "")
-        .replace("www.", "")
-    )
-
-
 def round_currency(value: Optional[float]) -> Optional[float]:
     if value is None:
         return None
@@ -69,7 +93,7 @@ def record_attempt(
     anon_id: Optional[str] = None,
     user_agent: Optional[str] = None,
 ) -> CodeAttempt:
-    normalized_domain = normalize_domain(domain)
+    normalized_domain = canonical_domain(domain)
     attempt = CodeAttempt(
         domain=normalized_domain,
         code=normalize_code(code),
@@ -80,13 +104,165 @@ def record_attempt(
         anon_id=hash_anon_id(anon_id),
         user_agent=(user_agent or "")[:255] if user_agent else None,
     )
-    db.add(attempt)
-    db.flush()
-    prune_attempts(db)
-    db.commit()
+    with attempt_write_session(normalized_domain, db) as shard_db:
+        shard_db.add(attempt)
+        shard_db.flush()
+        prune_attempts(shard_db)
+        shard_db.commit()
+        if shard_db is not db:
+            # Load it before the shard session closes and detaches it.
+            shard_db.refresh(attempt)
     return attempt
 
 
+def event_idempotency_key(
+    client_key: Optional[str],
+    anon_hash: Optional[str],
+    domain: str,
+    code: str,
+    success: bool,
+    now: Optional[float] = None,
+    fingerprint: Optional[str] = None,
+) -> Optional[str]:
+    """Storage key for an event: the client's key if sent, else one derived from who/what/when.
+
+    A client key is scoped to the shopper and domain, so two clients picking the same key
+    never swallow each other's events. Without an ``anon_id`` the shopper is approximated by
+    ``fingerprint`` (see ``anonymous_event_fingerprint``); with neither the key is None.
+    """
+    if client_key and client_key.strip():
+        material = f"client|{anon_hash or ''}|{domain}|{client_key.strip()}"
+    elif anon_hash or fingerprint:
+        return _derived_key(anon_hash or fingerprint, domain, code, success, _bucket(now))
+    else:
+        return None
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def previous_event_key(
+    client_key: Optional[str],
+    anon_hash: Optional[str],
+    domain: str,
+    code: str,
+    success: bool,
+    now: Optional[float] = None,
+    fingerprint: Optional[str] = None,
+) -> Optional[str]:
+    """The derived key of the previous time bucket (None for client keys)."""
+    if (client_key and client_key.strip()) or not (anon_hash or fingerprint):
+        return None
+    return _derived_key(anon_hash or fingerprint, domain, code, success, _bucket(now) - 1)
+
+
+def anonymous_event_fingerprint(
+    user_agent: Optional[str],
+    before_total: Optional[float],
+    after_total: Optional[float],
+    saved: Optional[float],
+) -> str:
+    """Who an event without an ``anon_id`` probably came from: its user agent and cart totals.
+
+    Two shoppers on the same browser build reporting the same code with the same totals in
+    the same window are counted once; a retry of one report always is.
+    """
+    material = f"anon|{user_agent or ''}|{before_total}|{after_total}|{saved}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _bucket(now: Optional[float]) -> int:
+    return int((time.time() if now is None else now) // max(1, DEDUP_WINDOW))
+
+
+def _derived_key(anon_hash: str, domain: str, code: str, success: bool, bucket: int) -> str:
+    material = f"derived|{anon_hash}|{domain}|{code}|{int(bool(success))}|{bucket}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def count_duplicate_event(stage: str) -> None:
+    EVENT_DUPLICATES.inc(stage=stage)
+    second = int(time.time())
+    with _recent_lock:
+        _dup_seconds[second] = _dup_seconds.get(second, 0) + 1
+        if len(_dup_seconds) > 120:
+            for stamp in [s for s in _dup_seconds if s <= second - 60]:
+                del _dup_seconds[stamp]
+
+
+def duplicate_events_last_minute() -> int:
+    cutoff = int(time.time()) - 60
+    with _recent_lock:
+        return sum(count for second, count in _dup_seconds.items() if second > cutoff)
+
+
+def recent_event_id(key: Optional[str]) -> Optional[int]:
+    """The stored id for ``key`` if this process recorded it recently (a duplicate), else None."""
+    if not key:
+        return None
+    with _recent_lock:
+        event_id = _recent_events.get(key)
+    if event_id is not None:
+        count_duplicate_event("memory")
+    return event_id
+
+
+def remember_event(key: Optional[str], event_id: Optional[int]) -> None:
+    if key and event_id is not None:
+        with _recent_lock:
+            _recent_events[key] = event_id
+
+
+def stored_event_id(db: Session, key: str) -> Optional[int]:
+    """Id of the row that already holds ``key``; call after the unique index rejected an insert."""
+    event_id = db.execute(select(CodeAttempt.id).where(CodeAttempt.idempotency_key == key).limit(1)).scalar()
+    count_duplicate_event("db")
+    remember_event(key, event_id)
+    return event_id
+
+
+async def stored_event_id_async(db: AsyncSession, key: str) -> Optional[int]:
+    event_id = (await db.execute(select(CodeAttempt.id).where(CodeAttempt.idempotency_key == key).limit(1))).scalar()
+    count_duplicate_event("db")
+    remember_event(key, event_id)
+    return event_id
+
+
+def prior_event_id(db: Session, key: Optional[str]) -> Optional[int]:
+    """Id of an event already stored under ``key``, from memory or the database, else None."""
+    if not key:
+        return None
+    event_id = recent_event_id(key)
+    if event_id is None:
+        event_id = db.execute(select(CodeAttempt.id).where(CodeAttempt.idempotency_key == key).limit(1)).scalar()
+        if event_id is not None:
+            count_duplicate_event("db")
+            remember_event(key, event_id)
+    return event_id
+
+
+async def prior_event_id_async(db: AsyncSession, key: Optional[str]) -> Optional[int]:
+    if not key:
+        return None
+    event_id = recent_event_id(key)
+    if event_id is None:
+        event_id = (await db.execute(select(CodeAttempt.id).where(CodeAttempt.idempotency_key == key).limit(1))).scalar()
+        if event_id is not None:
+            count_duplicate_event("db")
+            remember_event(key, event_id)
+    return event_id
+
+
+def _collect_event_metrics():
+    yield (
+        "disco_event_duplicates_last_minute",
+        "gauge",
+        "Duplicate /event submissions dropped in the trailing 60 seconds.",
+        [("disco_event_duplicates_last_minute", {}, duplicate_events_last_minute())],
+    )
+
+
+register_collector(_collect_event_metrics)
+
+
 def prune_attempts(db: Session) -> int:
     if RETENTION_DAYS <= 0:
         return 0
@@ -101,17 +277,45 @@ def recent_attempts(
     days: int = 180,
     limit: Optional[int] = None,
 ) -> List[CodeAttempt]:
-    query = db.query(CodeAttempt)
+    query = _recent_attempts_query(domain, days, limit)
+    with attempt_sessions(db, domain) as sessions:
+        return _newest_first([list(shard_db.execute(query).scalars().all()) for shard_db in sessions], limit)
+
+
+async def recent_attempts_async(
+    db: AsyncSession,
+    *,
+    domain: Optional[str] = None,
+    days: int = 180,
+    limit: Optional[int] = None,
+) -> List[CodeAttempt]:
+    query = _recent_attempts_query(domain, days, limit)
+    async with async_attempt_sessions(db, domain) as sessions:
+        return _newest_first([list((await shard_db.execute(query)).scalars().all()) for shard_db in sessions], limit)
+
+
+def _newest_first(per_shard: List[List[CodeAttempt]], limit: Optional[int]) -> List[CodeAttempt]:
+    if len(per_shard) == 1:
+        return per_shard[0]
+    merged = heapq.merge(*per_shard, key=lambda attempt: attempt.created_at or datetime.min, reverse=True)
+    return list(merged)[:limit] if limit else list(merged)
+
+
+def _recent_attempts_query(domain: Optional[str], days: int, limit: Optional[int]):
+    query = select(CodeAttempt)
     if domain:
-        normalized = normalize_domain(domain)
-        query = query.filter(CodeAttempt.domain == normalized)
+        normalized = canonical_domain(domain)
+        query = query.where(CodeAttempt.domain == normalized)
     if days:
         cutoff = datetime.utcnow() - timedelta(days=days)
-        query = query.filter(CodeAttempt.created_at >= cutoff)
+        query = query.where(CodeAttempt.created_at >= cutoff)
     query = query.order_by(CodeAttempt.created_at.desc())
     if limit:
         query = query.limit(limit)
-    return list(query.all())
+    return query
+
+
+TRAINING_COLUMNS = ("id", "domain", "code", "success", "saved", "before_total", "after_total", "created_at")
 
 
 def build_training_rows(
@@ -120,21 +324,101 @@ def build_training_rows(
     domain: Optional[str] = None,
     days: int = 180,
 ) -> List[Dict[str, Optional[float]]]:
-    rows: List[Dict[str, Optional[float]]] = []
-    for attempt in recent_attempts(db, domain=domain, days=days, limit=None):
-        rows.append(
-            {
-                "id": attempt.id,
-                "domain": attempt.domain,
-                "code": attempt.code,
-                "success": bool(attempt.success),
-                "saved": float(attempt.saved or 0.0),
-                "before_total": float(attempt.before_total) if attempt.before_total is not None else None,
-                "after_total": float(attempt.after_total) if attempt.after_total is not None else None,
-                "created_at": attempt.created_at.isoformat() if attempt.created_at else None,
-            }
+    return list(iter_training_rows(db, domain=domain, days=days))
+
+
+def iter_training_rows(
+    db: Session,
+    *,
+    domain: Optional[str] = None,
+    days: int = 180,
+    page_size: int = 1000,
+    ascending: bool = False,
+    after: Optional[Tuple[datetime, int]] = None,
+    before: Optional[datetime] = None,
+) -> Iterator[Dict[str, Optional[float]]]:
+    """Stream training rows page by page using keyset pagination on (created_at, id).
+
+    Only ``page_size`` plain row tuples are held at a time, so memory stays flat no
+    matter how much history is exported. ``after`` resumes strictly past a
+    (created_at, id) position in the chosen direction; ``before`` excludes rows
+    created at or after that instant. With ``ATTEMPT_SHARDS`` set, a domain-scoped
+    export reads that domain's shard; otherwise every shard is paged the same way and
+    the streams are merged on (created_at, id), holding one page per shard.
+    """
+    with attempt_sessions(db, domain) as sessions:
+        streams = [
+            _keyset_pages(shard_db, domain, days, page_size, ascending, after, before) for shard_db in sessions
+        ]
+        rows = streams[0] if len(streams) == 1 else heapq.merge(
+            *streams, key=lambda row: (row.created_at, row.id), reverse=not ascending
         )
-    return rows
+        for row in rows:
+            yield _training_row(row)
+
+
+def _keyset_pages(
+    db: Session,
+    domain: Optional[str],
+    days: int,
+    page_size: int,
+    ascending: bool,
+    after: Optional[Tuple[datetime, int]],
+    before: Optional[datetime],
+) -> Iterator:
+    columns = [getattr(CodeAttempt, name) for name in TRAINING_COLUMNS]
+    base = select(*columns).where(CodeAttempt.created_at.isnot(None))
+    if domain:
+        base = base.where(CodeAttempt.domain == canonical_domain(domain))
+    if days:
+        base = base.where(CodeAttempt.created_at >= datetime.utcnow() - timedelta(days=days))
+    if before is not None:
+        base = base.where(CodeAttempt.created_at < before)
+    if ascending:
+        base = base.order_by(CodeAttempt.created_at.asc(), CodeAttempt.id.asc())
+    else:
+        base = base.order_by(CodeAttempt.created_at.desc(), CodeAttempt.id.desc())
+
+    position = after
+    while True:
+        query = base
+        if position is not None:
+            last_created, last_id = position
+            if ascending:
+                query = query.where(
+                    or_(
+                        CodeAttempt.created_at > last_created,
+                        and_(CodeAttempt.created_at == last_created, CodeAttempt.id > last_id),
+                    )
+                )
+            else:
+                query = query.where(
+                    or_(
+                        CodeAttempt.created_at < last_created,
+                        and_(CodeAttempt.created_at == last_created, CodeAttempt.id < last_id),
+                    )
+                )
+        page = db.execute(query.limit(page_size)).all()
+        if not page:
+            return
+        yield from page
+        last = page[-1]
+        position = (last.created_at, last.id)
+        if len(page) < page_size:
+            return
+
+
+def _training_row(row) -> Dict[str, Optional[float]]:
+    return {
+        "id": row.id,
+        "domain": row.domain,
+        "code": row.code,
+        "success": bool(row.success),
+        "saved": float(row.saved or 0.0),
+        "before_total": float(row.before_total) if row.before_total is not None else None,
+        "after_total": float(row.after_total) if row.after_total is not None else None,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    }
 
 
 def aggregate_success_metrics(
@@ -145,28 +429,77 @@ def aggregate_success_metrics(
 ) -> Dict[str, Dict[str, float]]:
     if not domain:
         return {}
-    normalized = normalize_domain(domain)
-    stats: Dict[str, Dict[str, float]] = {}
+    with SUCCESS_METRICS_SECONDS.time():
+        return _fold_success_metrics(success_metric_rows(db, domain=domain, days=days))
+
+
+async def aggregate_success_metrics_async(
+    db: AsyncSession,
+    *,
+    domain: str,
+    days: int = 90,
+) -> Dict[str, Dict[str, float]]:
+    if not domain:
+        return {}
+    with SUCCESS_METRICS_SECONDS.time():
+        return _fold_success_metrics(await success_metric_rows_async(db, domain=domain, days=days))
+
+
+def success_metric_rows(db: Session, *, domain: str, days: int = 90) -> List[Tuple]:
+    """Raw (code, success, saved, created_at, id) rows behind the success stats, from ``domain``'s shard."""
+    with attempt_read_session(domain, db) as shard_db:
+        rows = shard_db.execute(_success_metrics_query(domain, days)).all()
+    SUCCESS_METRICS_ROWS.inc(len(rows))
+    return rows
+
+
+async def success_metric_rows_async(db: AsyncSession, *, domain: str, days: int = 90) -> List[Tuple]:
+    async with async_attempt_read_session(domain, db) as shard_db:
+        rows = (await shard_db.execute(_success_metrics_query(domain, days))).all()
+    SUCCESS_METRICS_ROWS.inc(len(rows))
+    return rows
+
+
+def busiest_domains(db: Session, *, days: int = 90, limit: int = 100) -> List[str]:
+    """Domains with the most attempts in the last ``days``, busiest first, across every shard."""
     cutoff = datetime.utcnow() - timedelta(days=days)
-    attempts = (
-        db.query(CodeAttempt)
-        .filter(CodeAttempt.domain == normalized)
-        .filter(CodeAttempt.created_at >= cutoff)
-        .all()
+    query = (
+        select(CodeAttempt.domain, func.count(CodeAttempt.id).label("attempts"))
+        .where(CodeAttempt.created_at >= cutoff)
+        .group_by(CodeAttempt.domain)
+        .order_by(func.count(CodeAttempt.id).desc())
+        .limit(limit)
     )
-    for attempt in attempts:
+    with attempt_sessions(db) as sessions:
+        counts = [row for shard_db in sessions for row in shard_db.execute(query).all()]
+    counts.sort(key=lambda row: row.attempts, reverse=True)
+    return [row.domain for row in counts[:limit] if row.domain]
+
+
+def _success_metrics_query(domain: str, days: int):
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    return (
+        select(CodeAttempt.code, CodeAttempt.success, CodeAttempt.saved, CodeAttempt.created_at, CodeAttempt.id)
+        .where(CodeAttempt.domain == canonical_domain(domain))
+        .where(CodeAttempt.created_at >= cutoff)
+    )
+
+
+def _fold_success_metrics(rows) -> Dict[str, Dict[str, float]]:
+    stats: Dict[str, Dict[str, float]] = {}
+    for code, success, saved, created_at, _id in rows:
         record = stats.setdefault(
-            attempt.code,
+            code,
             {"n": 0, "ok": 0, "avg_saved": 0.0, "last": 0.0},
         )
         record["n"] += 1
-        if attempt.success or (attempt.saved or 0.0) > 0:
+        if success or (saved or 0.0) > 0:
             record["ok"] += 1
         record["avg_saved"] = (
-            (record["avg_saved"] * (record["n"] - 1) + (attempt.saved or 0.0)) / record["n"]
+            (record["avg_saved"] * (record["n"] - 1) + (saved or 0.0)) / record["n"]
         )
-        if attempt.created_at:
-            record["last"] = max(record["last"], attempt.created_at.timestamp())
+        if created_at:
+            record["last"] = max(record["last"], created_at.timestamp())
     return stats
 
 
@@ -178,11 +511,10 @@ def iter_training_batches(
     days: int = 365,
 ) -> Iterable[List[Dict[str, Optional[float]]]]:
     batch: List[Dict[str, Optional[float]]] = []
-    for row in build_training_rows(db, domain=domain, days=days):
+    for row in iter_training_rows(db, domain=domain, days=days, page_size=batch_size):
         batch.append(row)
         if len(batch) >= batch_size:
             yield batch
             batch = []
     if batch:
         yield batch
-
@@ -1,4 +1,3 @@
 import './queue.js';
-import './workerScheduler.js';
 
-console.log('BullMQ workers and scraper scheduler started');
+console.log('BullMQ workers started');